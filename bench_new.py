@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" bench_new.py
+    Benchmarks for new.py's file creation pipeline.
+    Results are written as JSON, and compared against a saved baseline so
+    a change's performance impact can be seen before it ships:
+        ./bench_new.py --save bench_baseline.json   # Before the change.
+        ./bench_new.py --baseline bench_baseline.json
+"""
+
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from colr import docopt
+
+import new
+import plugins
+
+NAME = 'New Benchmarks'
+VERSION = '0.0.1'
+VERSIONSTR = '{} v. {}'.format(NAME, VERSION)
+SCRIPT = os.path.split(os.path.abspath(sys.argv[0]))[1]
+SCRIPTDIR = os.path.abspath(sys.path[0])
+PLUGINDIR = os.path.join(SCRIPTDIR, 'plugins')
+NEWSCRIPT = os.path.join(SCRIPTDIR, 'new.py')
+
+# Bumped when the results format changes.
+RESULTS_VERSION = 1
+DEFAULT_BASELINE = os.path.join(SCRIPTDIR, 'bench_baseline.json')
+DEFAULT_THRESHOLD = 10
+
+# Plugins that can't be benchmarked offline/unattended.
+SKIP_CREATE = {'jquery'}
+
+USAGESTR = """{versionstr}
+    Usage:
+        {script} -h | -v
+        {script} [BENCH...] [-b file] [-j file] [-q] [-s file] [-t pct]
+
+    Options:
+        BENCH                    : Only run benchmarks with names starting
+                                   with these (like: load_plugins create).
+        -b file,--baseline file  : Compare results against a baseline file.
+                                   Default: bench_baseline.json, if it
+                                   exists.
+        -h,--help                : Show this help message.
+        -j file,--json file      : Write JSON results to a file.
+                                   Default: stdout
+        -q,--quick               : Use smaller sizes, for a quick check.
+        -s file,--save file      : Save results as a new baseline file.
+        -t pct,--threshold pct   : Percent slower than the baseline that
+                                   counts as a regression.
+                                   Default: {threshold}
+        -v,--version             : Show version.
+
+    Exits with 1 when a result is slower than the baseline threshold.
+""".format(
+    script=SCRIPT,
+    versionstr=VERSIONSTR,
+    threshold=DEFAULT_THRESHOLD,
+)
+
+# [(name, func)], in the order they run (see: bench()).
+BENCHES = []
+
+
+def main(argd):
+    """ Main entry point, expects docopt arg dict as argd. """
+    try:
+        threshold = float(argd['--threshold'] or DEFAULT_THRESHOLD)
+    except ValueError:
+        print_err('Invalid threshold: {}'.format(argd['--threshold']))
+        return 1
+    baseline = load_baseline(argd['--baseline'])
+    if baseline is False:
+        return 1
+
+    benches = [
+        (name, func)
+        for name, func in BENCHES
+        if (not argd['BENCH']) or name.startswith(tuple(argd['BENCH']))
+    ]
+    if not benches:
+        print_err('No benchmarks match: {}'.format(', '.join(argd['BENCH'])))
+        return 1
+
+    results = run_benches(benches, quick=argd['--quick'])
+    report = {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': argd['--quick'],
+        'results': results,
+    }
+    write_json(report, argd['--json'] or '-')
+    if argd['--save']:
+        write_json(report, argd['--save'])
+        print_err('Saved baseline: {}'.format(argd['--save']))
+    if not baseline:
+        return 0
+    if baseline.get('quick', False) != argd['--quick']:
+        print_err('Baseline was {}made with --quick, comparing anyway.'.format(
+            '' if baseline.get('quick', False) else 'not '
+        ))
+    regressions = compare_results(results, baseline['results'], threshold)
+    return 1 if regressions else 0
+
+
+def bench(name):
+    """ Decorator to register a benchmark function.
+        Benchmark functions receive a BenchContext, and return a dict of
+        {case_name: result_dict} (see: measure()).
+    """
+    def decorator(func):
+        BENCHES.append((name, func))
+        return func
+    return decorator
+
+
+def compare_results(results, baseline, threshold):
+    """ Print a comparison of results and baseline results to stderr.
+        Returns a list of result names that are slower than `threshold`
+        percent.
+    """
+    regressions = []
+    namewidth = max(len(name) for name in results)
+    print_err('\n{:<{w}} {:>12} {:>12} {:>9}'.format(
+        'benchmark',
+        'seconds',
+        'baseline',
+        'change',
+        w=namewidth,
+    ))
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        seconds = result.get('seconds', None)
+        baseseconds = base.get('seconds', None)
+        if seconds is None:
+            print_err('{:<{w}} {:>12}'.format(name, 'error', w=namewidth))
+            continue
+        if not baseseconds:
+            print_err('{:<{w}} {:>12.6f} {:>12}'.format(
+                name,
+                seconds,
+                'new',
+                w=namewidth,
+            ))
+            continue
+        change = ((seconds - baseseconds) / baseseconds) * 100
+        marker = ''
+        if change > threshold:
+            regressions.append(name)
+            marker = '  <- slower'
+        print_err('{:<{w}} {:>12.6f} {:>12.6f} {:>+8.1f}%{}'.format(
+            name,
+            seconds,
+            baseseconds,
+            change,
+            marker,
+            w=namewidth,
+        ))
+    if regressions:
+        print_err('\n{} {} slower than the baseline (>{}%).'.format(
+            len(regressions),
+            'benchmark is' if len(regressions) == 1 else 'benchmarks are',
+            threshold,
+        ))
+    return regressions
+
+
+def load_baseline(filename):
+    """ Load baseline results.
+        Returns None if no baseline is used, or False on errors.
+    """
+    if not filename:
+        if not os.path.exists(DEFAULT_BASELINE):
+            return None
+        filename = DEFAULT_BASELINE
+    try:
+        with open(filename, 'r') as f:
+            baseline = json.load(f)
+    except (EnvironmentError, ValueError) as ex:
+        print_err('Unable to load baseline: {}\n{}'.format(filename, ex))
+        return False
+    if baseline.get('version', None) != RESULTS_VERSION:
+        print_err('Baseline is from another version, not comparing.')
+        return None
+    return baseline
+
+
+def measure(func, runs=5, setup=None, count=None, size=None):
+    """ Time a function.
+        Arguments:
+            func  : Function to time. If `setup` is given, it receives the
+                    return value from setup().
+            runs  : Number of times to run the function.
+            setup : Function to call before each run, not timed.
+            count : Number of items handled in each run, for items/sec.
+            size  : Number of bytes handled in each run, for MB/sec.
+        Returns a dict with the median and min seconds for each run.
+    """
+    times = []
+    for _ in range(runs):
+        if setup is None:
+            start = time.perf_counter()
+            func()
+        else:
+            state = setup()
+            start = time.perf_counter()
+            func(state)
+        times.append(time.perf_counter() - start)
+    return make_result(times, count=count, size=size)
+
+
+def make_result(times, count=None, size=None):
+    """ Build a result dict from a list of run times, in seconds. """
+    result = {
+        'seconds': statistics.median(times),
+        'min': min(times),
+        'runs': len(times),
+    }
+    if count:
+        result['count'] = count
+        result['per_second'] = count / result['seconds']
+    if size:
+        result['bytes'] = size
+        result['mb_per_second'] = (size / (1024 * 1024)) / result['seconds']
+    return result
+
+
+def print_err(*args, **kwargs):
+    """ Print to stderr. """
+    kwargs['file'] = kwargs.get('file', sys.stderr)
+    print(*args, **kwargs)
+
+
+def run_benches(benches, quick=False):
+    """ Run benchmarks, with plugin/new.py output silenced.
+        Returns a dict of {bench.case: result_dict}.
+    """
+    results = {}
+    for name, func in benches:
+        print_err('Running: {}'.format(name))
+        with BenchContext(quick=quick) as ctx:
+            try:
+                with redirect_stdout(io.StringIO()):
+                    benchresults = func(ctx)
+            except Exception as ex:
+                print_err('  Failed: {}: {}'.format(type(ex).__name__, ex))
+                results[name] = {'error': str(ex)}
+                continue
+        for case, result in benchresults.items():
+            resultname = '{}.{}'.format(name, case) if case else name
+            results[resultname] = result
+            if 'seconds' in result:
+                msg = '{:.6f}s'.format(result['seconds'])
+            else:
+                msg = result['error']
+            print_err('  {}: {}'.format(resultname, msg))
+    return results
+
+
+def synthetic_filenames(count):
+    """ Return a list of file names, using every known plugin extension.
+    """
+    exts = sorted({
+        ext
+        for plugincls in plugins.plugins['types'].values()
+        for ext in (plugincls.extensions or ())
+    }) or ['.txt']
+    return [
+        'dir{}/file{}{}'.format(i % 100, i, exts[i % len(exts)])
+        for i in range(count)
+    ]
+
+
+def write_json(data, filename):
+    """ Write JSON to a file, or stdout for '-'. """
+    if filename == '-':
+        json.dump(data, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write('\n')
+        return
+    with open(filename, 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+        f.write('\n')
+
+
+class BenchContext(object):
+    """ Settings and a scratch directory for one benchmark.
+        Plugins are loaded again from PLUGINDIR when it exits.
+    """
+
+    def __init__(self, quick=False):
+        self.quick = quick
+        self.tmpdir = None
+        self.counter = 0
+
+    def __enter__(self):
+        # tmpfs keeps disk speed out of the write benchmarks, when it's
+        # available.
+        basedir = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+        self.tmpdir = tempfile.mkdtemp(prefix='new-bench-', dir=basedir)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        plugins.load_plugins(PLUGINDIR)
+        return False
+
+    def new_dir(self):
+        """ Create and return a new empty directory in tmpdir. """
+        self.counter += 1
+        dirpath = os.path.join(self.tmpdir, 'run{}'.format(self.counter))
+        os.mkdir(dirpath)
+        return dirpath
+
+    def size(self, full, quick):
+        """ Return the full or quick size for a benchmark. """
+        return quick if self.quick else full
+
+
+@bench('load_plugins')
+def bench_load_plugins(ctx):
+    """ load_plugins() in a new interpreter (cold) and again in this
+        one (warm).
+    """
+    code = '\n'.join((
+        'import sys, time',
+        'sys.path.insert(0, {!r})'.format(SCRIPTDIR),
+        'start = time.perf_counter()',
+        'import plugins',
+        'plugins.load_plugins({!r})'.format(PLUGINDIR),
+        'print(time.perf_counter() - start)',
+    ))
+    times = []
+    for _ in range(ctx.size(5, 3)):
+        output = subprocess.check_output(
+            [sys.executable, '-c', code],
+            stderr=subprocess.DEVNULL,
+        )
+        times.append(float(output.decode().strip().splitlines()[-1]))
+    return {
+        'cold': make_result(times),
+        'warm': measure(
+            lambda: plugins.load_plugins(PLUGINDIR),
+            runs=ctx.size(10, 3),
+        ),
+    }
+
+
+@bench('determine_plugins')
+def bench_determine_plugins(ctx):
+    """ determine_plugins() for many synthetic file names. """
+    results = {}
+    for count in ctx.size((10000, 100000), (1000, 10000)):
+        filenames = synthetic_filenames(count)
+        results[str(count)] = measure(
+            lambda: plugins.determine_plugins(None, filenames),
+            runs=ctx.size(5, 2),
+            count=count,
+        )
+    return results
+
+
+@bench('create')
+def bench_create(ctx):
+    """ _create() for each type plugin, with default args. """
+    results = {}
+    for plugincls in sorted(
+            plugins.plugins['types'].values(),
+            key=lambda cls: cls.get_name()):
+        name = plugincls.get_name()
+        if name in SKIP_CREATE:
+            continue
+        plugin = plugincls()
+        plugin.dryrun = True
+        if plugin.multifile:
+            # Multi-file plugins (like makefile) work from source files.
+            ext = '.c'
+        else:
+            ext = (plugin.extensions or ('',))[0]
+        filepath = os.path.join(ctx.tmpdir, 'bench{}'.format(ext))
+
+        def create():
+            try:
+                if plugin.multifile:
+                    plugin._create_multi([filepath], args=[])
+                else:
+                    plugin._create(filepath, args=[])
+            except plugins.SignalAction:
+                pass
+
+        try:
+            results[name] = measure(create, runs=ctx.size(20, 3))
+        except (plugins.SignalExit, Exception) as ex:
+            results[name] = {'error': str(ex) or type(ex).__name__}
+    return results
+
+
+@bench('write_file')
+def bench_write_file(ctx):
+    """ new.write_file() for many small files, on tmpfs if available. """
+    count = ctx.size(2000, 200)
+    content = 'x' * 4095 + '\n'
+
+    def write_files(dirpath):
+        for i in range(count):
+            new.write_file(os.path.join(dirpath, 'f{}.txt'.format(i)), content)
+
+    return {
+        '4k': measure(
+            write_files,
+            runs=ctx.size(5, 2),
+            setup=ctx.new_dir,
+            count=count,
+            size=count * len(content),
+        ),
+    }
+
+
+@bench('post_plugins')
+def bench_post_plugins(ctx):
+    """ do_post_plugins() for C files, with only chmodx and automakefile.
+    """
+    plugincls = plugins.determine_plugin('c', None)
+    count = ctx.size(200, 20)
+    keep = {'chmodx', 'automakefile'}
+
+    def setup():
+        dirpath = ctx.new_dir()
+        filepaths = []
+        for i in range(count):
+            filepath = os.path.join(dirpath, 'f{}.c'.format(i))
+            with open(filepath, 'w') as f:
+                f.write('int main(void) { return 0; }\n')
+            filepaths.append(filepath)
+        plugin = plugincls()
+        plugin.ignore_post = set(plugins.plugins['post']) - keep
+        plugin.ignore_deferred = set(plugins.plugins['deferred'])
+        return plugin, filepaths
+
+    return {
+        'chmodx_automakefile': measure(
+            lambda state: plugins.do_post_plugins(state[1], state[0]),
+            runs=ctx.size(5, 2),
+            setup=setup,
+            count=count,
+        ),
+    }
+
+
+@bench('end_to_end')
+def bench_end_to_end(ctx):
+    """ Full new.py runs, for one file and for a batch of files. """
+    batchsize = ctx.size(1000, 100)
+
+    def run_new(*args):
+        subprocess.check_call(
+            [sys.executable, NEWSCRIPT] + list(args) + ['--noopen'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    return {
+        'one_file': measure(
+            lambda dirpath: run_new(os.path.join(dirpath, 'f.txt')),
+            runs=ctx.size(5, 2),
+            setup=ctx.new_dir,
+        ),
+        'batch': measure(
+            lambda dirpath: run_new(
+                os.path.join(dirpath, 'f{{1..{}}}.txt'.format(batchsize))
+            ),
+            runs=ctx.size(3, 1),
+            setup=ctx.new_dir,
+            count=batchsize,
+        ),
+    }
+
+
+@bench('scaling.custom_plugins')
+def bench_custom_plugins(ctx):
+    """ Loading and looking up custom plugins when many are configured. """
+    count = ctx.size(10000, 1000)
+    customconfig = {
+        'custom{}'.format(i): {
+            'aliases': ['alias{}'.format(i)],
+            'content': 'Custom {} by {{author}}.'.format(i),
+            'formatted': True,
+        }
+        for i in range(count)
+    }
+    lastalias = 'alias{}'.format(count - 1)
+
+    def lookup():
+        customplugins = plugins.CustomPlugins(customconfig)
+        customplugins.get_byname(lastalias)
+
+    def create():
+        customplugins = plugins.CustomPlugins(customconfig)
+        customplugins.get_byname(lastalias)()._create('-', args=[])
+
+    runs = ctx.size(5, 2)
+    return {
+        'lookup': measure(lookup, runs=runs, count=count),
+        'create': measure(create, runs=runs, count=count),
+    }
+
+
+@bench('scaling.plugin_modules')
+def bench_plugin_modules(ctx):
+    """ load_plugins() for a directory with many plugin modules. """
+    count = ctx.size(300, 50)
+    moddir = os.path.join(ctx.tmpdir, 'plugins')
+    os.mkdir(moddir)
+    modnames = []
+    for i in range(count):
+        modname = 'benchmod{}'.format(i)
+        modnames.append(modname)
+        with open(os.path.join(moddir, '{}.py'.format(modname)), 'w') as f:
+            f.write('\n'.join((
+                'from plugins import Plugin',
+                '',
+                '',
+                'class BenchPlugin(Plugin):',
+                '    name = ({!r},)'.format(modname),
+                '    extensions = ({!r},)'.format('.bench{}'.format(i)),
+                '    version = {!r}'.format('0.0.1'),
+                '',
+                '    def create(self, filename):',
+                '        """ Benchmark plugin. """',
+                '        return {!r}'.format(modname),
+                '',
+                '',
+                'exports = (BenchPlugin,)',
+                '',
+            )))
+
+    def unload():
+        for modname in modnames:
+            sys.modules.pop('plugins.{}'.format(modname), None)
+        importlib.invalidate_caches()
+
+    plugins.__path__.append(moddir)
+    try:
+        return {
+            str(count): measure(
+                lambda _: plugins.load_plugins(moddir),
+                runs=ctx.size(5, 2),
+                setup=unload,
+                count=count,
+            ),
+        }
+    finally:
+        plugins.__path__.remove(moddir)
+        unload()
+
+
+@bench('scaling.large_template')
+def bench_large_template(ctx):
+    """ Rendering a very large custom plugin template. """
+    results = {}
+    line = '{"key": "{author}", "year": {year}, "raw": {{}}, "x": [1, 2]}\n'
+    for megabytes in ctx.size((1, 10), (1,)):
+        content = line * ((megabytes * 1024 * 1024) // len(line))
+        customplugins = plugins.CustomPlugins({
+            'large': {
+                'content': content,
+                'formatted': True,
+                'allow_bad_tags': True,
+            },
+        })
+        plugin = customplugins['large']()
+        results['{}mb'.format(megabytes)] = measure(
+            lambda: plugin._create('-', args=[]),
+            runs=ctx.size(5, 2),
+            size=len(content),
+        )
+    return results
+
+
+if __name__ == '__main__':
+    plugins.load_plugins(PLUGINDIR)
+    mainret = main(docopt(USAGESTR, version=VERSIONSTR, script=SCRIPT))
+    sys.exit(mainret)
@@ -23,12 +23,13 @@
 """
 
 import os
+import re
 import sys
 import traceback
+from itertools import islice
 
 import plugins
 from plugins import docopt
-from plugins import C
 debug = plugins.debug
 debug_ex = plugins.debug_ex
 print_err = plugins.print_err
@@ -51,12 +52,22 @@ plugins.set_debug_mode(
     debugplugin=('-P' in sys.argv) or ('--debugplugin' in sys.argv),
 )
 
+if '--memprofile' in sys.argv:
+    # Memory profiling starts before plugins are loaded.
+    from plugins._profile import MemProfiler
+    MEMPROFILER = MemProfiler()
+else:
+    MEMPROFILER = None
+
 try:
     # Load all available plugins.
-    plugins.load_plugins(PLUGINDIR)
+    with plugins.timed('load_plugins'):
+        plugins.load_plugins(PLUGINDIR)
 except plugins.InvalidConfig as ex:
     print_err(ex)
     sys.exit(1)
+if MEMPROFILER is not None:
+    MEMPROFILER.snapshot('load_plugins')
 
 VERSION = plugins.append_plugin_versions(BASEVERSION)
 VERSIONSTR = f'{NAME} v. {VERSION} (base: {BASEVERSION})'
@@ -64,8 +75,53 @@ VERSIONSTR = f'{NAME} v. {VERSION} (base: {BASEVERSION})'
 # Passing this as a file name will write to stdout.
 STDOUT_FILENAME = '-'
 
+# Run options work with any usage form, so they are handled before docopt.
+# {option: value_mode}, where value_mode is one of:
+#   None       : A flag, no value is allowed.
+#   'optional' : A value may be given with --option=VALUE.
+#   'required' : A value is required, with --option VALUE or --option=VALUE.
+RUN_OPTS = {
+    '--timings': 'optional',
+    '--trace': 'required',
+    '--profile': 'required',
+    '--profileplugins': None,
+    '--memprofile': None,
+    '--validate': None,
+    '--output': 'required',
+}
+
+# Number of files that are created and validated before they are written,
+# when validation is enabled (see: handle_plugin_validated).
+VALIDATE_BATCH = 500
+
+# Numeric/letter ranges in file name patterns, like {1..10}, {a..f},
+# or {001..100..5}.
+BRACE_RANGE_PAT = re.compile(
+    r'^(-?\d+|[a-zA-Z])\.\.(-?\d+|[a-zA-Z])(?:\.\.(-?\d+))?$'
+)
+
+# Flags that can be used with the `new FILENAME...` fast path, which skips
+# docopt (see: parse_filename_args). {flag: arg_name}
+FILENAME_FLAGS = {
+    '-d': '--dryrun',
+    '--dryrun': '--dryrun',
+    '-D': '--debug',
+    '--debug': '--debug',
+    '-o': '--noopen',
+    '--noopen': '--noopen',
+    '-O': '--overwrite',
+    '--overwrite': '--overwrite',
+    '-P': '--debugplugin',
+    '--debugplugin': '--debugplugin',
+    '-x': '--executable',
+    '--executable': '--executable',
+}
+
 USAGESTR = """{versionstr}
     Usage:
+        {script} --bundle FILE [-D]
+        {script} --cache ACTION [-D]
+        {script} --completion SHELL [-D]
         {script} --customhelp [-D]
         {script} (-c | -h | -v | -V | -p) [-D] [-P]
         {script} FILENAME... [-d | -O] [-D] [-P] [-o] [-x]
@@ -82,6 +138,21 @@ USAGESTR = """{versionstr}
                                Defaults to: python (unless set in config)
         FILENAME             : File name for the new file.
                                Multiple files can be created.
+                               Brace patterns are expanded (quote them):
+                                   'src/mod_{{001..500}}/{{main,util}}.c'
+        --bundle FILE        : Build a single-file zipapp of New (like
+                               new.pyz), with precompiled plugins and a
+                               snapshot of the current config.
+        --cache ACTION       : Manage New's cache directory, where ACTION
+                               is one of:
+                                   stats : Show the cache size, by
+                                           namespace.
+                                   prune : Remove entries over the
+                                           size/age budgets.
+                                   clear : Remove all entries.
+        --completion SHELL   : Print a completion script for bash, fish,
+                               or zsh, like:
+                                   source <({script} --completion bash)
         --customhelp         : Show help for creating a custom plugin.
         -c,--config          : Print global config and exit.
         -C,--pluginconfig    : Print plugin config and exit.
@@ -103,14 +174,46 @@ USAGESTR = """{versionstr}
         -V,--pluginversions  : Show all plugin versions.
         -v,--version         : Show version.
 
+    Run options (for any of the above):
+        --timings[=FILE]     : Print wall/cpu timings for each phase and
+                               plugin to stderr. If FILE is given, JSON is
+                               also written to it ('-' for stdout).
+        --trace FILE         : Append nested spans for this run to FILE, as
+                               JSON lines (Chrome trace events).
+                               Can also be set with NEW_TRACE=FILE.
+        --profile FILE       : Run under cProfile, writing pstats to FILE and
+                               collapsed stacks (for flame graphs) to
+                               FILE.collapsed.
+        --profileplugins     : With --profile, only keep stacks that run
+                               plugin module code.
+        --memprofile         : Print tracemalloc snapshots (top allocation
+                               sites, peak memory, peak RSS) after plugin
+                               loading, content generation (and each
+                               plugin in a batch), and post plugins.
+        --validate           : Check the syntax of generated content
+                               before writing it (python, json, bash, c).
+                               Can also be set with plugins.validate.
+        --output MODE        : How to report created files and post plugin
+                               results: text (status lines, for terminals),
+                               json (one JSON record per line on stdout),
+                               or progress (one summary line on stderr).
+                               Default: text
+
     Plugin arguments must follow a bare -- argument.
 """.format(script=SCRIPT, versionstr=VERSIONSTR)
 
 
+@plugins.traced(outcome=lambda code: 'error' if code else 'success')
 def main(argd):
     """ Main entry point, expects doctopt arg dict as argd """
     # Do any procedures that don't require a file name/type.
-    if argd['--customhelp']:
+    if argd['--bundle']:
+        return make_bundle(argd['--bundle'])
+    elif argd['--cache']:
+        return manage_cache(argd['--cache'])
+    elif argd['--completion']:
+        return print_completion(argd['--completion'])
+    elif argd['--customhelp']:
         return 0 if plugins.custom_plugin_help() else 1
     elif argd['--pluginversions']:
         return 0 if plugins.list_plugin_versions() else 1
@@ -125,26 +228,33 @@ def main(argd):
     debug('Use default plugin?: {}'.format(use_default_plugin))
     pluginclses = get_plugins(
         argd['PLUGIN'],
-        argd['FILENAME'],
+        expand_filenames(argd['FILENAME']),
         use_default=use_default_plugin,
     )
     if not pluginclses:
         # No a valid plugin names, user cancelled text plugin use.
         return 1
 
+    plugins.tracer.set(plugins=len(pluginclses))
+    is_batch = len(pluginclses) > 1
     createdfiles = {}
     for plugin, filepaths in pluginclses.items():
         try:
             pluginfiles = handle_plugin(plugin, filepaths, argd)
         except plugins.SignalExit as ex:
             return ex.code
+        if is_batch:
+            memprofile_snapshot('content:{}'.format(plugin.get_name()))
         if not pluginfiles:
             break
 
         createdfiles.setdefault(plugin, [])
         createdfiles[plugin].extend(pluginfiles)
+    memprofile_snapshot('content')
 
-    return handle_post_plugins(createdfiles)
+    errs = handle_post_plugins(createdfiles)
+    memprofile_snapshot('post_plugins')
+    return errs
 
 
 def confirm(msg):
@@ -181,6 +291,37 @@ def ensure_file_ext(fname, plugin):
     return '{}{}'.format(fname, plugin.extensions[0])
 
 
+def expand_braces(pattern):
+    """ Lazily expand a shell-style brace pattern in a file name.
+        Supports choices ({a,b,c}), number ranges with an optional step
+        and zero-padding ({1..10}, {001..500}, {0..100..5}), letter ranges
+        ({a..f}), and nesting ({a,b{1..3}}).
+        Braces that are not part of a valid pattern are kept as they are.
+        Yields each expanded file name.
+        Raises InvalidArg if the pattern expands to an empty file name,
+        like: {,a}
+    """
+    if '{' not in pattern:
+        yield pattern
+        return
+    for filename in iter_brace_parts(parse_braces(pattern)):
+        if not filename:
+            raise plugins.InvalidArg(
+                pattern,
+                msg='Brace pattern expands to an empty file name:',
+            )
+        yield filename
+
+
+def expand_filenames(filenames):
+    """ Lazily expand brace patterns in file names (see: expand_braces),
+        so big batches never have to be held in argv or in memory at once.
+        Yields each expanded file name, in order.
+    """
+    for filename in filenames:
+        yield from expand_braces(filename)
+
+
 def expand_path(fname):
     """ Expand a file path, if it's not the marker for stdout output. """
     if fname == STDOUT_FILENAME:
@@ -188,6 +329,18 @@ def expand_path(fname):
     return os.path.abspath(fname)
 
 
+def format_content(plugin, fname, content):
+    """ Run new content through the transform plugins, and then format it
+        for output (indentation, line endings, and final newlines, from
+        plugin/config). This is the exact content that is validated and
+        written.
+        Raises SignalExit if a transform plugin cancels the file.
+    """
+    content = plugins.do_transform_plugins(plugin, fname, content)
+    with plugins.timed('format_output'):
+        return plugin.format_output(fname, content)
+
+
 def get_plugins(pluginname, filenames, use_default=True):
     """ Get the plugin to use based on the user's args (arg dict from docopt).
         When an invalid name is used, optionally use the text plugin.
@@ -199,23 +352,22 @@ def get_plugins(pluginname, filenames, use_default=True):
                            plugin on bad names/types.
                            Default: True
     """
-    debug('Using PLUGIN={!r}, FILENAMES={!r}'.format(pluginname, filenames))
-    if filenames and (filenames[0] == '--'):
-        # Occurs when no args are passed after the seperator: new plugin --
-        debug('No args after --, filename is: {}'.format(filenames[0]))
-        filename = None
-
-    pluginclses = plugins.determine_plugins(
-        pluginname,
-        filenames,
-        use_default=use_default,
-    )
+    debug('Using PLUGIN={!r}'.format(pluginname))
+    with plugins.timed('determine_plugins'):
+        pluginclses = plugins.determine_plugins(
+            pluginname,
+            filenames,
+            use_default=use_default,
+        )
     if not pluginclses:
         return {}
 
     if all((cls is not None) for cls in pluginclses):
         # All plugins were determined.
-        return {cls(): filepaths for cls, filepaths in pluginclses.items()}
+        return {
+            plugins.pool.get(cls): filepaths
+            for cls, filepaths in pluginclses.items()
+        }
 
     # Regular plugin-determinaing failed
     for filename in pluginclses[None]:
@@ -239,44 +391,77 @@ def get_plugins(pluginname, filenames, use_default=True):
             print_err('Unable to load the text plugin, sorry.')
             return None
     # All plugins were determined or set to the TextPlugin.
-    return {cls(): filepaths for cls, filepaths in pluginclses.items()}
+    return {
+        plugins.pool.get(cls): filepaths
+        for cls, filepaths in pluginclses.items()
+    }
 
 
-def handle_content(fname, content, plugin, dryrun=False, filepaths=None):
+@plugins.traced()
+def handle_content(
+        fname, content, plugin, dryrun=False, filepaths=None,
+        overwrite=False):
     """ Either write the new content to a file,
         or print it if this is a dryrun.
         Run post-processing plugins if a file was written.
         Returns the created file name.
         Arguments:
             fname     : The file name to write.
-            content   : Content to write to the file.
+            content   : Content to write to the file, already formatted
+                        (see: format_content()).
             plugin    : The plugin that created the content.
             filepaths : Any extra file paths that were passed to the plugin,
                         for multi-file plugins.
+            overwrite : Whether an existing file may be replaced.
+                        Otherwise the file is created exclusively.
     """
-    if content and plugin.ensure_newline and (not content.endswith('\n')):
-        # Ensure newline if there is any content, only if plugin allows it.
-        debug(
-            'Adding missing newline for {} content.'.format(plugin.get_name())
-        )
-        content = ''.join((content, '\n'))
-    elif content and plugin.ensure_newline and content.endswith('\n\n'):
-        debug('Removing multiple newlines for {} content.'.format(
-            plugin.get_name()
-        ))
-        content = '{}\n'.format(content.rstrip('\n'))
-
+    span = plugins.tracer.current()
+    span.set(plugin=plugin.get_name(), file=fname)
+    span.set(bytes=len(content or ''))
+    reporter = plugins.reporter
     if dryrun and fname != STDOUT_FILENAME:
+        span.set(outcome='dryrun')
+        if reporter.mode == 'json':
+            reporter.record(
+                'dryrun',
+                plugin=plugin.get_name(),
+                file=fname,
+                bytes=len(content or ''),
+                content=content or '',
+            )
+            return None
         print_term('Dry run, would\'ve written: {}\n'.format(fname))
         print(content or '<No Content>')
         # No post plugins can run.
         return None
 
-    created = write_file(fname, content)
+    if (fname == STDOUT_FILENAME) and (reporter.mode == 'json'):
+        # The content goes in the record, instead of between records.
+        span.set(outcome='created')
+        reporter.record(
+            'created',
+            plugin=plugin.get_name(),
+            file=fname,
+            bytes=len(content or ''),
+            content=content or '',
+        )
+        return STDOUT_FILENAME
+
+    with plugins.timed('write_file'):
+        created = write_file(fname, content, overwrite=overwrite)
     if not created:
+        span.set(outcome='failed')
         print_err('\nUnable to create: {}'.format(fname))
+        reporter.record('failed', plugin=plugin.get_name(), file=fname)
         return None
 
+    span.set(outcome='created')
+    reporter.record(
+        'created',
+        plugin=plugin.get_name(),
+        file=created,
+        bytes=len(content or ''),
+    )
     if fname != STDOUT_FILENAME:
         print_status('Created ({}) {}'.format(plugin.get_name(), created))
     return created
@@ -296,11 +481,13 @@ def handle_exception(msg, ex_type, ex_value, ex_tb):
     raise plugins.SignalExit(str(ex_value), code=1)
 
 
+@plugins.traced(outcome=lambda created: 'created' if created else 'none')
 def handle_plugin(plugin, filepaths, argd):
     """ Sets up the plugin, runs command plugins, plugin help,
         plugin config dump, or multiple file writes.
         Returns a list of created files.
     """
+    plugins.tracer.set(plugin=plugin.get_name(), files=len(filepaths))
     # Notify plugin that this might be a dry run.
     plugin.dryrun = argd['--dryrun']
 
@@ -344,9 +531,17 @@ def handle_plugin(plugin, filepaths, argd):
         created = handle_plugin_multifile(plugin, filepaths, argd)
         return [created] if created else []
 
+    if isinstance(plugin, plugins.SkeletonPlugin):
+        # This plugin copies a directory tree for each path.
+        handler = handle_plugin_tree
+    elif validation_enabled(argd):
+        # Content is created and validated in batches, before writing.
+        return handle_plugin_validated(plugin, filepaths, argd)
+    else:
+        handler = handle_plugin_file
     createdfiles = []
     for filename in filepaths:
-        created = handle_plugin_file(plugin, filename, argd)
+        created = handler(plugin, filename, argd)
         if created:
             createdfiles.append(created)
         else:
@@ -354,81 +549,19 @@ def handle_plugin(plugin, filepaths, argd):
     return createdfiles
 
 
+@plugins.traced(outcome=lambda created: 'created' if created else 'none')
 def handle_plugin_file(plugin, filename, argd):
     """ Ensure valid file names, call plugin.create(), catch any
         SignalActions or SignalExits, and eventually write the file content
         if everything goes well.
         Returns the name of the file created.
     """
-    debug('Handling file for {} plugin: {}'.format(
-        plugin.get_name(),
-        filename,
-    ))
-    # Get valid file name for this file.
-    fname = expand_path(
-        ensure_file_ext(filename, plugin)
-    )
-
-    # Make sure the file name doesn't conflict with any plugins.
-    # ...mainly during development and testing.
-    if plugins.conflicting_file(plugin, filename, fname):
-        return None
-    pluginname = plugin.get_name().title()
-    try:
-        content = plugin._create(fname, argd['ARGS'])
-    except plugins.SignalAction as action:
-        # See if we have content to write
-        # No-content is fatal unless explicitly allowed.
-        if not (action.content or plugin.allow_blank):
-            errmsg = 'Plugin action with no content!\n    {}'
-            print_err(errmsg.format(action.message))
-            return None
-
-        content = action.content
-        # Print plugin notification of any major changes (file name changes)
-        if action.message:
-            for line in action.message.split('\n'):
-                plugin.print_status(line)
-        # Plugin is changing the output file name.
-        if action.filename:
-            fname = action.filename
-        # Plugin is adding ignore_post plugins.
-        if action.ignore_post:
-            debug('Adding ignore_post: {!r}'.format(action.ignore_post))
-            plugin.ignore_post.update(action.ignore_post)
-    except plugins.SignalExit as excancel:
-        # Plugin wants to stop immediately.
-        return handle_signalexit(excancel)
-    except Exception:
-        return handle_exception(
-            '{} error:'.format(pluginname),
-            *sys.exc_info())
-
-    # Confirm overwriting existing files, exit on refusal.
-    # Non-existant file names are considered valid, and need no confirmation.
-    if not valid_filename(
-            fname,
-            dryrun=argd['--dryrun'],
-            overwrite=argd['--overwrite']):
-        return None
-
-    if not (plugin.allow_blank or content):
-        debug('{} is not allowed to create a blank file.'.format(pluginname))
-        print_err('\nFailed to create file: {}'.format(fname))
-        return None
-
-    if argd['--noopen']:
-        # Don't open the file.
-        debug('Cancelling open plugin for {}'.format(plugin.get_name()))
-        plugin.ignore_deferred.add('open')
-
-    return handle_content(
-        fname,
-        content,
-        plugin,
-        dryrun=argd['--dryrun'],
-        filepaths=None,
-    )
+    plugins.tracer.set(plugin=plugin.get_name(), file=filename)
+    prepared = prepare_plugin_file(plugin, filename, argd)
+    if not isinstance(prepared, tuple):
+        # Nothing to write.
+        return prepared
+    return write_plugin_file(plugin, prepared, argd)
 
 
 def handle_plugin_multifile(plugin, filepaths, argd):
@@ -480,10 +613,12 @@ def handle_plugin_multifile(plugin, filepaths, argd):
 
     # Confirm overwriting existing files, exit on refusal.
     # Non-existant file names are considered valid, and need no confirmation.
+    exists = os.path.exists(filename)
     if not valid_filename(
             filename,
             dryrun=argd['--dryrun'],
-            overwrite=argd['--overwrite']):
+            overwrite=argd['--overwrite'],
+            exists=exists):
         return None
 
     if not (plugin.allow_blank or content):
@@ -491,6 +626,18 @@ def handle_plugin_multifile(plugin, filepaths, argd):
         print_err('\nFailed to create file: {}'.format(filename))
         return None
 
+    try:
+        content = format_content(plugin, filename, content)
+    except plugins.SignalExit as excancel:
+        # A transform plugin wants to stop immediately.
+        raise plugins.SignalExit(
+            'Exiting for errors.',
+            code=handle_signalexit(excancel)
+        )
+
+    if validation_enabled(argd):
+        validate_content(plugin, [(filename, content)])
+
     if argd['--noopen']:
         # Don't open the file.
         debug('Cancelling open plugin for {}'.format(plugin.get_name()))
@@ -502,9 +649,111 @@ def handle_plugin_multifile(plugin, filepaths, argd):
         plugin,
         dryrun=argd['--dryrun'],
         filepaths=filepaths,
+        overwrite=argd['--overwrite'] or exists,
     )
 
 
+@plugins.traced(outcome=lambda created: 'created' if created else 'none')
+def handle_plugin_tree(plugin, dirpath, argd):
+    """ Like handle_plugin_file, except the plugin copies a whole skeleton
+        directory to `dirpath`, and there is no content to write.
+        Existing files are left alone unless --overwrite is used.
+        Returns the directory path, if anything was created.
+    """
+    plugins.tracer.set(plugin=plugin.get_name(), file=dirpath)
+    if dirpath == STDOUT_FILENAME:
+        print_err('Skeleton plugins can\'t write to stdout.')
+        return None
+    dirpath = expand_path(dirpath)
+    if os.path.exists(dirpath) and not os.path.isdir(dirpath):
+        print_err('Not a directory: {}'.format(dirpath))
+        return None
+    pluginname = plugin.get_name().title()
+    plugin.overwrite = argd['--overwrite']
+    try:
+        created, skipped = plugin._create_tree(dirpath, argd['ARGS'])
+    except plugins.SignalExit as excancel:
+        # Plugin wants to stop immediately.
+        return handle_signalexit(excancel)
+    except Exception:
+        return handle_exception(
+            '{} error:'.format(pluginname),
+            *sys.exc_info())
+
+    if argd['--dryrun']:
+        if plugins.reporter.mode == 'json':
+            plugins.reporter.record(
+                'dryrun',
+                plugin=plugin.get_name(),
+                file=dirpath,
+                files=created,
+            )
+            return None
+        print_term('Dry run, would\'ve written: {}\n'.format(dirpath))
+        print('\n'.join(created) or '<No Files>')
+        # No post plugins can run.
+        return None
+    for filepath in skipped:
+        debug('Skipped existing file: {}'.format(filepath))
+    if not created:
+        print_err('\nNo files created in: {}{}'.format(
+            dirpath,
+            ' ({} existing)'.format(len(skipped)) if skipped else '',
+        ))
+        return None
+
+    if argd['--noopen']:
+        # Don't open the directory.
+        plugin.ignore_deferred.add('open')
+    plugins.reporter.record(
+        'created',
+        plugin=plugin.get_name(),
+        file=dirpath,
+        files=len(created),
+        skipped=len(skipped),
+    )
+    print_status('Created ({}) {}: {} {}{}'.format(
+        plugin.get_name(),
+        dirpath,
+        len(created),
+        'file' if len(created) == 1 else 'files',
+        ', skipped {} existing'.format(len(skipped)) if skipped else '',
+    ))
+    return dirpath
+
+
+def handle_plugin_validated(plugin, filepaths, argd):
+    """ Like calling handle_plugin_file() for each file, except content is
+        created for a batch of files, and only written if it is all valid
+        (see: validate_content()).
+        Returns a list of created files.
+    """
+    createdfiles = []
+    filepaths = iter(filepaths)
+    while True:
+        pending = []
+        stopped = False
+        for filename in islice(filepaths, VALIDATE_BATCH):
+            prepared = prepare_plugin_file(plugin, filename, argd)
+            if not isinstance(prepared, tuple):
+                # Files before this one are still written.
+                stopped = True
+                break
+            pending.append(prepared)
+        if pending:
+            validate_content(
+                plugin,
+                [(fname, content) for fname, content, _ in pending],
+            )
+        for prepared in pending:
+            created = write_plugin_file(plugin, prepared, argd)
+            if not created:
+                return createdfiles
+            createdfiles.append(created)
+        if stopped or (len(pending) < VALIDATE_BATCH):
+            return createdfiles
+
+
 def handle_post_plugins(createdinfo):
     """ Runs post plugins on the created files.
         Arguments:
@@ -513,6 +762,8 @@ def handle_post_plugins(createdinfo):
     errs = 0
     for plugin, pluginfiles in createdinfo.items():
         errs += plugins.do_post_plugins(pluginfiles, plugin)
+    # Post plugins that handle all of the run's files at once.
+    errs += plugins.do_post_flush()
     return errs
 
 
@@ -528,6 +779,60 @@ def handle_signalexit(ex):
     return ex.code
 
 
+def iter_brace_parts(parts, index=0):
+    """ Yield every string for parsed brace pattern parts, starting at
+        parts[index] (see: parse_braces).
+    """
+    if index == len(parts):
+        yield ''
+        return
+    part = parts[index]
+    if isinstance(part, str):
+        heads = (part, )
+    elif part[0] == 'range':
+        _, start, stop, step, width, is_char = part
+        heads = (
+            chr(n) if is_char else str(n).zfill(width)
+            for n in range(start, stop, step)
+        )
+    else:
+        heads = (
+            head
+            for choice in part[1]
+            for head in iter_brace_parts(choice)
+        )
+    for head in heads:
+        for tail in iter_brace_parts(parts, index=index + 1):
+            yield ''.join((head, tail))
+
+
+def make_bundle(filename):
+    """ Build a zipapp bundle of New, with precompiled plugins, the makefile
+        templates, and a snapshot of the current config
+        (see: plugins._bundle).
+    """
+    if plugins.BUNDLE is not None:
+        print_err('Already running from a bundle: {}'.format(plugins.BUNDLE))
+        return 1
+    try:
+        manifest = plugins.build_bundle(
+            filename,
+            os.path.abspath(__file__),
+            PLUGINDIR,
+            plugins.config,
+            modules=plugins.iter_plugin_modules(PLUGINDIR),
+        )
+    except EnvironmentError as ex:
+        print_ex(ex, 'Unable to build bundle: {}'.format(filename))
+        return 1
+    print_status('Bundled {} plugin modules ({} compiled files): {}'.format(
+        len(manifest['modules']),
+        manifest['compiled'],
+        filename,
+    ))
+    return 0
+
+
 def make_dirs(path):
     """ Use os.makedirs() to ensure a path exists, and create it if needed.
         Returns the existing path on success.
@@ -546,8 +851,65 @@ def make_dirs(path):
     return path
 
 
+def manage_cache(action):
+    """ Show stats for, prune, or clear New's cache (see: plugins._cache).
+    """
+    cache = plugins.cache
+    action = action.lower()
+    if action == 'stats':
+        stats = cache.stats()
+        if plugins.reporter.mode == 'json':
+            plugins.print_json(stats, sort_keys=True)
+            return 0
+        print('Cache: {}'.format(stats['root']))
+        for namespace in sorted(stats['namespaces']):
+            nsstats = stats['namespaces'][namespace]
+            print('    {:<16} {:>6} {:<7} {:>10}'.format(
+                namespace,
+                nsstats['entries'],
+                'entry' if nsstats['entries'] == 1 else 'entries',
+                plugins.format_bytes(nsstats['size']),
+            ))
+        print('Total: {} {}, {} (budget: {} MiB, {} days)'.format(
+            stats['entries'],
+            'entry' if stats['entries'] == 1 else 'entries',
+            plugins.format_bytes(stats['size']),
+            stats['max_size_mb'],
+            stats['max_age_days'],
+        ))
+        return 0
+    elif action == 'prune':
+        removed = cache.prune()
+        print_status('Pruned {} {} ({}) from: {}'.format(
+            len(removed),
+            'entry' if len(removed) == 1 else 'entries',
+            plugins.format_bytes(sum(e.size for e in removed)),
+            cache.root,
+        ))
+        return 0
+    elif action == 'clear':
+        removed = cache.clear()
+        print_status('Cleared {} {} from: {}'.format(
+            removed,
+            'entry' if removed == 1 else 'entries',
+            cache.root,
+        ))
+        return 0
+    print_err('Unknown cache action: {} (use: stats, prune, or clear)'.format(
+        action
+    ))
+    return 1
+
+
+def memprofile_snapshot(phase):
+    """ Take a --memprofile snapshot for a run phase, if enabled. """
+    if MEMPROFILER is not None:
+        MEMPROFILER.snapshot(phase)
+
+
 def parse_args():
-    """ Strips plugin args from sys.argv, and fixes the docopt argd.
+    """ Strips plugin args and run options from sys.argv, and fixes the
+        docopt argd.
         Returns a docopt arg dict.
     """
     sysargs = []
@@ -562,15 +924,304 @@ def parse_args():
         else:
             sysargs.append(arg)
 
+    sysargs, runargd = parse_run_args(sysargs)
     plugins.debugprinter.enable(('-D' in sysargs) or ('--debug' in sysargs))
     debug('  Sys args: {}'.format(sysargs))
     debug('Plugin arg: {}'.format(pluginargs), align=True)
-
-    argd = docopt(USAGESTR, version=VERSIONSTR, argv=sysargs, script=SCRIPT)
+    debug('  Run opts: {}'.format(runargd), align=True)
+
+    argd = parse_filename_args(sysargs)
+    if argd is None:
+        argd = docopt(
+            USAGESTR,
+            version=VERSIONSTR,
+            argv=sysargs,
+            script=SCRIPT,
+        )
     argd['ARGS'] = pluginargs
+    argd.update(runargd)
     return argd
 
 
+def parse_brace_group(pattern, start):
+    """ Parse the brace group that starts at pattern[start] ('{').
+        Returns a tuple of (part, end_index) for parse_braces(), or None if
+        it is not a valid group.
+    """
+    depth = 0
+    commas = []
+    for end in range(start, len(pattern)):
+        char = pattern[end]
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                break
+        elif (char == ',') and (depth == 1):
+            commas.append(end)
+    else:
+        # No closing brace.
+        return None
+    if commas:
+        bounds = [start] + commas + [end]
+        choices = [
+            parse_braces(pattern[choicestart + 1:choiceend])
+            for choicestart, choiceend in zip(bounds, bounds[1:])
+        ]
+        return ('choice', choices), end + 1
+
+    rangematch = BRACE_RANGE_PAT.match(pattern[start + 1:end])
+    if rangematch is None:
+        return None
+    first, last, step = rangematch.groups()
+    is_char = first.isalpha()
+    if is_char != last.isalpha():
+        # Mixed letter/number range.
+        return None
+    if is_char:
+        rangestart, rangeend, width = ord(first), ord(last), 0
+    else:
+        rangestart, rangeend = int(first), int(last)
+        # Zero-padded like the shell does, if either number has a leading 0.
+        padded = any(
+            (len(s.lstrip('-')) > 1) and s.lstrip('-').startswith('0')
+            for s in (first, last)
+        )
+        width = max(len(first), len(last)) if padded else 0
+    step = abs(int(step or 1)) or 1
+    if rangestart > rangeend:
+        step = -step
+    rangestop = rangeend + (1 if step > 0 else -1)
+    return (
+        ('range', rangestart, rangestop, step, width, is_char),
+        end + 1,
+    )
+
+
+def parse_braces(pattern):
+    """ Parse a brace pattern into a list of parts for iter_brace_parts():
+            str                 : Literal text.
+            ('choice', [parts]) : Each choice is a list of parsed parts.
+            ('range', start, stop, step, width, is_char)
+    """
+    parts = []
+    literal = []
+    i = 0
+    while i < len(pattern):
+        group = parse_brace_group(pattern, i) if pattern[i] == '{' else None
+        if group is None:
+            literal.append(pattern[i])
+            i += 1
+            continue
+        if literal:
+            parts.append(''.join(literal))
+            literal = []
+        part, i = group
+        parts.append(part)
+    if literal:
+        parts.append(''.join(literal))
+    return parts
+
+
+def parse_filename_args(args):
+    """ Parse args for the most common usage, without docopt:
+            new FILENAME... [-d | -O] [-D] [-P] [-o] [-x]
+        Anything else (plugin names are treated as file names here, like
+        docopt does) returns None, so docopt can handle it.
+        Returns a docopt arg dict on success.
+    """
+    filenames = []
+    flags = set()
+    for arg in args:
+        if arg.startswith('-') and (arg != STDOUT_FILENAME):
+            flag = FILENAME_FLAGS.get(arg, None)
+            if (flag is None) or (flag in flags):
+                # Unknown/combined flags, or a repeated flag.
+                return None
+            flags.add(flag)
+        else:
+            filenames.append(arg)
+    if (not filenames) or ({'--dryrun', '--overwrite'} <= flags):
+        return None
+    argd = plugins.docopt_defaults(USAGESTR)
+    argd['FILENAME'] = filenames
+    argd.update((flag, True) for flag in flags)
+    return argd
+
+
+def parse_run_args(args):
+    """ Pull any run options (see: RUN_OPTS) out of a list of arguments.
+        Returns a tuple of (remaining_args, {option: value}).
+        Flags are set to True/False, and options with values are set to
+        the value (or True if an optional value was not given).
+        Missing options are set to None.
+        Raises InvalidArg for bad values.
+    """
+    runargd = {
+        opt: (False if valmode is None else None)
+        for opt, valmode in RUN_OPTS.items()
+    }
+    remaining = []
+    argiter = iter(args)
+    for arg in argiter:
+        opt, equals, val = arg.partition('=')
+        if opt not in RUN_OPTS:
+            remaining.append(arg)
+            continue
+        valmode = RUN_OPTS[opt]
+        if valmode is None:
+            if equals:
+                raise plugins.InvalidArg(arg, msg='No value is allowed')
+            runargd[opt] = True
+        elif equals:
+            if not val:
+                raise plugins.InvalidArg(opt, msg='Missing value for')
+            runargd[opt] = val
+        elif valmode == 'required':
+            val = next(argiter, None)
+            if not val:
+                raise plugins.InvalidArg(opt, msg='Missing value for')
+            runargd[opt] = val
+        else:
+            runargd[opt] = True
+    return remaining, runargd
+
+
+def prepare_plugin_file(plugin, filename, argd):
+    """ Ensure a valid file name, and call plugin.create(), catching any
+        SignalActions or SignalExits, for handle_plugin_file().
+        Returns a tuple of (file_name, content, file_exists) on success,
+        otherwise None, or the exit code from a plugin's SignalExit.
+    """
+    debug('Handling file for {} plugin: {}'.format(
+        plugin.get_name(),
+        filename,
+    ))
+    # Get valid file name for this file.
+    fname = expand_path(
+        ensure_file_ext(filename, plugin)
+    )
+
+    # Make sure the file name doesn't conflict with any plugins.
+    # ...mainly during development and testing.
+    if plugins.conflicting_file(plugin, filename, fname):
+        return None
+    pluginname = plugin.get_name().title()
+    try:
+        content = plugin._create(fname, argd['ARGS'])
+    except plugins.SignalAction as action:
+        # See if we have content to write
+        # No-content is fatal unless explicitly allowed.
+        if not (action.content or plugin.allow_blank):
+            errmsg = 'Plugin action with no content!\n    {}'
+            print_err(errmsg.format(action.message))
+            return None
+
+        content = action.content
+        # Print plugin notification of any major changes (file name changes)
+        if action.message:
+            for line in action.message.split('\n'):
+                plugin.print_status(line)
+        # Plugin is changing the output file name.
+        if action.filename:
+            fname = action.filename
+        # Plugin is adding ignore_post plugins.
+        if action.ignore_post:
+            debug('Adding ignore_post: {!r}'.format(action.ignore_post))
+            plugin.ignore_post.update(action.ignore_post)
+    except plugins.SignalExit as excancel:
+        # Plugin wants to stop immediately.
+        return handle_signalexit(excancel)
+    except Exception:
+        return handle_exception(
+            '{} error:'.format(pluginname),
+            *sys.exc_info())
+
+    # Confirm overwriting existing files, exit on refusal.
+    # Non-existant file names are considered valid, and need no confirmation.
+    # They are created exclusively, so a file that another process creates
+    # in the meantime is never overwritten.
+    exists = os.path.exists(fname)
+    if not valid_filename(
+            fname,
+            dryrun=argd['--dryrun'],
+            overwrite=argd['--overwrite'],
+            exists=exists):
+        return None
+
+    if not (plugin.allow_blank or content):
+        debug('{} is not allowed to create a blank file.'.format(pluginname))
+        print_err('\nFailed to create file: {}'.format(fname))
+        return None
+
+    try:
+        content = format_content(plugin, fname, content)
+    except plugins.SignalExit as excancel:
+        # A transform plugin wants to stop immediately.
+        return handle_signalexit(excancel)
+    return fname, content, exists
+
+
+def write_plugin_file(plugin, prepared, argd):
+    """ Write content from prepare_plugin_file().
+        Returns the name of the file created.
+    """
+    fname, content, exists = prepared
+    if argd['--noopen']:
+        # Don't open the file.
+        debug('Cancelling open plugin for {}'.format(plugin.get_name()))
+        plugin.ignore_deferred.add('open')
+
+    return handle_content(
+        fname,
+        content,
+        plugin,
+        dryrun=argd['--dryrun'],
+        filepaths=None,
+        overwrite=argd['--overwrite'] or exists,
+    )
+
+
+def print_completion(shell):
+    """ Write completion data for a shell, and print the completion script
+        that uses it (see: plugins._completion).
+    """
+    shell = shell.lower()
+    if shell not in plugins.COMPLETION_SHELLS:
+        print_err('Unsupported shell for completion: {} (use: {})'.format(
+            shell,
+            ', '.join(sorted(plugins.COMPLETION_SHELLS)),
+        ))
+        return 1
+    newfile = plugins.BUNDLE or os.path.abspath(__file__)
+    datafile = plugins.completion_data_file(shell, SCRIPTDIR)
+    try:
+        plugins.write_completion_data(
+            shell,
+            plugins.completion_data(plugins.plugins, USAGESTR),
+            plugins.completion_sources(
+                PLUGINDIR,
+                plugins.find_config_file(),
+                newfile,
+            ),
+            datafile,
+        )
+    except EnvironmentError as ex:
+        print_err('Unable to write completion data: {}\n{}'.format(
+            datafile,
+            ex,
+        ))
+        return 1
+    print(plugins.completion_script(
+        shell,
+        datafile,
+        command=[sys.executable, newfile],
+        names=sorted({'new', SCRIPT}),
+    ))
+    return 0
+
+
 def print_ex(ex, msg, ex_type=None, ex_value=None, ex_tb=None):
     """ Print an error msg, formatted with str(Exception).
         Arguments:
@@ -594,37 +1245,118 @@ def print_ex(ex, msg, ex_type=None, ex_value=None, ex_tb=None):
 
 
 def print_status(msg):
-    """ Print a status message.
-        (color-formatting in the future)
+    """ Print a status message, for terminals in the text output mode
+        (see: plugins._report).
     """
-    print_term('{}: {}'.format(C('new'.ljust(16), 'blue'), msg))
+    plugins.reporter.status('new', msg)
 
 
 def print_term(*args, **kwargs):
-    """ Print only if stdout is a terminal. """
+    """ Print only if stdout is a terminal (and not using --output). """
     kwargs['file'] = kwargs.get('file', sys.stdout)
-    if kwargs['file'].isatty():
+    if plugins.reporter.show_text(kwargs['file']):
         print(*args, **kwargs)
 
 
-def valid_filename(fname, dryrun=False, overwrite=False):
+def print_timings(argd):
+    """ Print the --timings report, if it was requested.
+        Returns True if the report was written (or not requested).
+    """
+    timingsopt = argd.get('--timings', None)
+    if not timingsopt:
+        return True
+    return plugins.timings.report(
+        filename=None if timingsopt is True else timingsopt,
+    )
+
+
+def run_main(argd):
+    """ Run main(argd), under cProfile if --profile was used.
+        Returns main()'s exit code.
+    """
+    if not argd['--profile']:
+        return main(argd)
+    from plugins._profile import profile_call
+    return profile_call(
+        main,
+        argd,
+        filename=argd['--profile'],
+        rootdir=SCRIPTDIR,
+        plugindir=PLUGINDIR if argd['--profileplugins'] else None,
+    )
+
+
+def validate_content(plugin, files):
+    """ Check the syntax of created content before it is written.
+        Arguments:
+            plugin : The plugin that created the content.
+            files  : A list of (file_name, content).
+        Prints a report for all invalid files, and raises SignalExit if
+        there are any.
+    """
+    def on_missing(checkname, ex):
+        print_err('Unable to validate ({}): {}'.format(checkname, ex))
+
+    jobs = plugins.config.get('plugins', {}).get('validate_jobs', None)
+    with plugins.timed('validate'):
+        errors = plugins.validate_files(
+            files,
+            jobs=jobs,
+            on_missing=on_missing,
+        )
+    if not errors:
+        debug('Validated {} {} for {}.'.format(
+            len(files),
+            'file' if len(files) == 1 else 'files',
+            plugin.get_name(),
+        ))
+        return None
+    lines = []
+    for fname, msgs in errors.items():
+        lines.append('  {}:'.format(fname))
+        lines.extend('    {}'.format(msg) for msg in msgs)
+    print_err('\nInvalid content from {} ({} of {} {}):\n{}\n'.format(
+        plugin.get_name(),
+        len(errors),
+        len(files),
+        'file' if len(files) == 1 else 'files',
+        '\n'.join(lines),
+    ))
+    raise plugins.SignalExit('Nothing was written for errors.', code=1)
+
+
+def validation_enabled(argd):
+    """ Return True if content should be validated before it is written,
+        from --validate or the plugins.validate config option.
+    """
+    if argd.get('--validate', False):
+        return True
+    return bool(plugins.config.get('plugins', {}).get('validate', False))
+
+
+def valid_filename(fname, dryrun=False, overwrite=False, exists=None):
     """ Make sure a file doesn't exist already.
         If it does exist, confirm that the user wants to overwrite it.
         If `overwrite` is True, this function always returns True.
         Returns True if it is safe to write the file, otherwise False.
 
         For dryruns, existing files are ignored.
+        If `exists` is given, it is used instead of checking the file again.
     """
     if overwrite:
         return True
-    if not os.path.exists(fname):
+    if exists is None:
+        exists = os.path.exists(fname)
+    if not exists:
         return True
 
     return dryrun or plugins.confirm_overwrite(fname)
 
 
-def write_file(fname, content):
+def write_file(fname, content, overwrite=False):
     """ Write a new file given a filename and it's content.
+        Unless `overwrite` is True, the file is created exclusively, and
+        an existing file (possibly from a parallel run) is left alone.
         Returns the file name on success, or None on failure.
     """
     if content is None:
@@ -642,8 +1374,10 @@ def write_file(fname, content):
         return None
 
     try:
-        with open(fname, 'w') as f:
-            f.write(content)
+        plugins.write_file_atomic(fname, content, overwrite=overwrite)
+    except FileExistsError:
+        print_err('\nFile was created by another process: {}'.format(fname))
+        return None
     except EnvironmentError as ex:
         print_ex(
             ex,
@@ -657,9 +1391,23 @@ def write_file(fname, content):
 
 if __name__ == '__main__':
     # Okay, run.
+    argd = {}
     try:
-        mainret = main(parse_args())
+        with plugins.timed('parse_args'):
+            argd = parse_args()
+        if argd['--trace']:
+            plugins.tracer.enable(argd['--trace'])
+        else:
+            plugins.tracer.enable_from_env()
+        plugins.reporter.set_mode(argd['--output'] or 'text')
+        mainret = run_main(argd)
     except ValueError as ex:
         print_err('Error: {}'.format(ex))
         mainret = 1
+    plugins.reporter.finish()
+    plugins.tracer.close()
+    if not print_timings(argd):
+        mainret = mainret or 1
+    if MEMPROFILER is not None:
+        MEMPROFILER.report()
     sys.exit(mainret)
@@ -7,25 +7,62 @@
 import json
 import os
 import re
-import shutil
 import sys
+import time
 import traceback
+from collections import ChainMap
+from collections.abc import Mapping
 from datetime import datetime
 from enum import Enum
+from fnmatch import fnmatch
 from importlib import import_module
+from itertools import chain
 
 from docopt import DocoptExit, DocoptLanguageError
-from colr import (
-    auto_disable as colr_auto_disable,
-    Colr as C,
-    docopt,
+
+from ._args import docopt, docopt_defaults  # noqa
+from ._bundle import (  # noqa
+    build_bundle,
+    bundle_archive,
+    load_manifest as load_bundle_manifest,
+    open_text,
+)
+from ._cache import Cache, cache  # noqa
+from ._colors import import_colr
+from ._commands import chunk_args, run_command, run_commands  # noqa
+from ._completion import (  # noqa
+    SHELLS as COMPLETION_SHELLS,
+    completion_data,
+    completion_data_file,
+    completion_script,
+    completion_sources,
+    write_completion_data,
+)
+from ._deadline import (  # noqa
+    can_interrupt,
+    deadline,
+    PluginTimeout,
+    TimeBudget,
 )
+from ._debug import debugprinter
+from ._download import (  # noqa
+    check_integrity,
+    download_file,
+    DownloadError,
+    IntegrityError,
+)
+from ._files import dir_lock, write_file_atomic  # noqa
+from ._output import editorconfig_options, OutputStyle
+from ._pool import PluginPool
+from ._report import format_bytes, OUTPUT_MODES, Reporter  # noqa
+from ._skeleton import copy_file, copy_tree  # noqa
+from ._tags import tag_providers
+from ._template import TemplateFormatter
+from ._timing import Timings
+from ._trace import Tracer
+from ._validate import validate_files  # noqa
 
-from fmtblock import FormatBlock  # noqa
-from printdebug import DebugColrPrinter
-debugprinter = DebugColrPrinter()
 debug = debugprinter.debug
-colr_auto_disable()
 
 # Global debug flag.
 # Set with --debug in main().
@@ -36,14 +73,56 @@ DEBUG = False
 DEBUG_PLUGIN = False
 
 SCRIPTDIR = os.path.abspath(sys.path[0])
+# The bundle file and it's manifest, when running from a bundle
+# (see: plugins._bundle).
+BUNDLE = bundle_archive()
+bundle_manifest = load_bundle_manifest()
 
-plugins = {'types': {}, 'post': {}, 'deferred': {}}
+plugins = {'types': {}, 'post': {}, 'deferred': {}, 'transform': {}}
 # Config is loaded in load_plugins()
 config = {}
 
 # Default plugin version made available to all plugins when no config is set.
 default_version = '0.0.1'
 
+# Wall/cpu timings for run phases and plugins, reported with --timings.
+timings = Timings()
+# Plugin instances for this run, created once and reused for every file.
+# Cleared when plugins are loaded.
+pool = PluginPool()
+# Time used by post plugins in this run, for plugins.post_budget.
+post_budget = TimeBudget()
+timed = timings.timed
+# Nested spans for a run, exported with --trace or NEW_TRACE.
+tracer = Tracer()
+traced = tracer.traced
+# Status lines, JSON records, or a progress line, set with --output.
+reporter = Reporter()
+
+# Names that are re-exported here, but only imported on first use,
+# {name: (module, attribute)} (see: __getattr__).
+LAZY_IMPORTS = {
+    'C': ('colr', 'Colr'),
+    'FormatBlock': ('fmtblock', 'FormatBlock'),
+    'colr_auto_disable': ('colr', 'auto_disable'),
+}
+
+
+def __getattr__(name):
+    """ Import re-exported names from LAZY_IMPORTS on first use. """
+    try:
+        modulename, attr = LAZY_IMPORTS[name]
+    except KeyError:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name)
+        )
+    if modulename == 'colr':
+        module = import_colr()
+    else:
+        module = import_module(modulename)
+    value = globals()[name] = getattr(module, attr)
+    return value
+
 
 def append_plugin_versions(basever):
     """ Take New's base version, and calculate a new version based on all
@@ -65,19 +144,40 @@ def append_plugin_versions(basever):
     return f'{bmajor}.{fminor}.{fmicro}'
 
 
+def bad_tags_exit(pluginname, source, badtags, preview=None):
+    """ Create a SignalExit for unknown format tags in a custom plugin's
+        content or template.
+        Arguments:
+            pluginname : Name of the plugin the tags are in.
+            source     : What the tags are in, like: "template, README.md"
+            badtags    : A list of (tag_name, line, column) from
+                         TemplateFormatter.render().
+            preview    : A short preview of the content, or None.
+    """
+    lines = [
+        'Unknown format {} in {}\'s {}:'.format(
+            'tag' if len(badtags) == 1 else 'tags',
+            pluginname,
+            source,
+        ),
+    ]
+    if preview:
+        lines.append('    {}'.format(preview))
+    lines.extend(
+        '    Line {}, column {}: {{{}}}'.format(linenum, column, tagname)
+        for tagname, linenum, column in badtags
+    )
+    lines.extend((
+        '\nYou can create tags in plugins.global, or set',
+        '\'allow_bad_tags\' to leave unknown tags as they are.',
+    ))
+    return SignalExit('\n'.join(lines), code=1)
+
+
 def config_dump():
     """ Dump config to stdout. """
-    if not config:
-        print('\nNo config found.\n')
-        return False
-    try:
-        configstr = json.dumps(config, sort_keys=True, indent=4)
-    except TypeError as ex:
-        print_err('Config has non-string keys!\n  {}'.format(ex))
-        configstr = json.dumps(config, indent=4)
-    print('\nConfig:\n')
-    print(configstr)
-    return True
+    from ._listing import config_dump
+    return config_dump(config)
 
 
 def confirm(question):
@@ -145,412 +245,31 @@ def conflicting_file(plugin, filearg, filename):
     return False
 
 
-def create_custom_plugin(names, info):  # noqa (too complex, I know.)
-    """ Creates a CustomPlugin from user config.
+def create_custom_plugin(names, info):
+    """ Creates a CustomPlugin from user config (see: plugins._custom).
         Returns an uninstantiated CustomPlugin class.
 
         Arguments:
             name  : Plugin name from config, a key in custom config.
             info  : Plugin info
     """
-    if not names:
-        raise ValueError('Custom plugin is missing a name.')
-    name = names[0].lower()
-    if not name:
-        raise ValueError('Custom plugin is missing a name.')
-
-    if not info:
-        raise ValueError('No info for custom plugin: {}'.format(name))
-    filename = info.get('filename', None)
-    content_raw = info.get('content', None)
-    if not (filename or content_raw):
-        # No file name or content.
-        raise ValueError(
-            '\n'.join((
-                'Custom plugin is not configured correctly: {}',
-                'No \'filename\' or \'content\' set.'
-            )).format(name)
-        )
-    elif (filename and content_raw):
-        # Both file name and content.
-        raise ValueError(
-            '\n'.join((
-                'Custom plugin is not configured correctly: {}',
-                'Either \'filename\' or \'content\' can be set, not both.'
-            )).format(name)
-        )
-    # Allow for multiline content, using arrays/lists.
-    if isinstance(content_raw, list):
-        content_str = '\n'.join(content_raw)
-    elif content_raw:
-        content_str = str(content_raw)
-    else:
-        content_str = None
-
-    # Allow for expanded user paths.
-    if filename and not os.path.exists(filename):
-        filename = os.path.expanduser(filename)
-
-    # Create a CustomPlugin class that is local to this function,
-    # so that each custom plugin class is 'unique'.
-    class CustomPlugin(Plugin):
-        # Extensions are not searched for custom plugins.
-        extensions = None
-        # Any extension is allowed to be used.
-        any_extension = True
-        # CustomPlugins are marked with this attribute.
-        is_custom = True
-        # Attributes set by config.
-        name = names
-        input_file = filename
-        input_content = content_str
-        # Config values that don't matter as much.
-        description = info.get('description', None)
-        formatted = info.get('formatted', False)
-        allow_bad_tags = info.get('allow_bad_tags', False)
-        ignore_post = info.get('ignore_post', None)
-        ignore_deferred = info.get('ignore_deferred', None)
-        private = info.get('private', False)
-
-        def config_dump(self, _raw_config=info):
-            """ Overloaded config_dump for custom plugins. """
-            # Custom plugins have a file name, or content, and a description.
-            # There is not much 'config' to them.
-            if not _raw_config:
-                # This only happens if a user calls config_dump() incorrectly.
-                print_err('_raw_config should already be set by default!')
-                print('No config for: {}'.format(self.get_name().title()))
-                return False
-
-            conf = {self.get_name(): _raw_config}
-            try:
-                configstr = json.dumps(conf, sort_keys=True, indent=4)
-            except TypeError as ex:
-                print_err('Config has non-str keys!\n  {}'.format(ex))
-                configstr = json.dumps(conf, indent=4)
-            print(configstr)
-            return True
-
-        def create(self, filename):
-            """ Creates a file based on user configuration. """
-            if self.input_content:
-                # Content based.
-                content = self.input_content
-                self.debug('Custom content used: {}'.format(
-                    self.format_content_preview()
-                ))
-            elif self.input_file:
-                # File-based.
-                try:
-                    with open(self.input_file, 'r') as f:
-                        content = f.read()
-                except EnvironmentError as ex:
-                    raise SignalExit(
-                        'Failed to read custom file: {}\n{}'.format(
-                            self.input_file,
-                            ex
-                        ),
-                        code=1
-                    )
-                else:
-                    self.debug('Custom content loaded: {}'.format(
-                        self.input_file
-                    ))
-            else:
-                msg = 'No file name or content to work with.'
-                self.debug(msg)
-                raise SignalExit(msg)
-
-            if self.formatted:
-                return self.format_content(content)
-            # Simple file/content-copy, no formatting needed.
-            return content
-
-        @staticmethod
-        def find_tag_position(text, tag):
-            """ Find the line number and column for the first occurrence
-                of a tag. This is for reporting bad tags.
-                Returns None, None if the tag cannot be found.
-            """
-            linenum = linepos = 0
-            for i, line in enumerate(text.split('\n')):
-                try:
-                    pos = line.index(tag)
-                except ValueError:
-                    continue
-                else:
-                    linenum = i + 1
-                    linepos = pos
-                    break
-            else:
-                return None, None
-            return linenum, linepos
-
-        def fix_bad_tag(self, content, tagname):
-            """ Replace {tagname} with {{tagname}} in content, to suppress
-                keyerrors.
-            """
-            self.debug('Fixing bad tag: {}'.format(tagname))
-            repl = tagname.join(('{', '}'))
-            replwith = tagname.join(('{{', '}}'))
-            try:
-                replpat = re.compile(
-                    ''.join(('(?!<{)(', repl, ')(?!})'))
-                )
-            except re.error as ex:
-                self.debug(
-                    'Bad regex pattern for tag fixing: {}'.format(ex)
-                )
-                return content.replace(repl, replwith)
+    from ._custom import create_custom_plugin
+    return create_custom_plugin(names, info)
 
-            return replpat.sub(replwith, content)
 
-        def format_content(self, content):
-            """ Return the formatted content from this plugin's file/config.
-            """
-            formatargs = self.get_format_args(content)
-
-            # We should've caught unknown format tags, but just in case:
-            try:
-                # formatargs may be empty, but that's okay.
-                contentfmt = content.format(**formatargs)
-            except KeyError as ex:
-                badtagname = ex.args[0]
-                if self.allow_bad_tags:
-                    try:
-                        # Surround with { and }, then try again.
-                        return self.format_content(
-                            self.fix_bad_tag(content, badtagname)
-                        )
-                    except RecursionError:
-                        pass
-                raise self.make_tag_exception(content, badtagname)
-            return contentfmt
-
-        def format_content_preview(self, max_length=40):
-            """ Get a preview of self.input_content, if it exists.
-                Otherwise returns an empty string.
-            """
-            if not self.input_content:
-                return ''
-            if len(self.input_content) < max_length:
-                return repr(self.input_content)
-            return repr('{}...'.format(self.input_content[:max_length]))
-
-        def get_format_args(self, content):
-            """ Return a dict of str.format args to be used on the content.
-                Arguments:
-                    content : Content to grab possible tags from, to build
-                              format args.
-            """
-            formattags = self.get_format_tags(content)
-            if not formattags:
-                # No format tags to use, so none of this is needed.
-                return {}
-
-            # Load all known/usable tag info.
-            pluginconfig = config.get('plugins', {}).get('global', {})
-            today = datetime.today()
-            knowntags = {
-                'author': pluginconfig.get('author', '(no author set)'),
-                'email': pluginconfig.get('email', '(no email set)'),
-                'date': date(today),
-                'year': today.year,
-                'version': pluginconfig.get(
-                    'default_version',
-                    default_version
-                ),
-            }
-            # Build actual format args to be used.
-            formatargs = {}
-            for tagname in formattags:
-                tagval = knowntags.get(
-                    tagname,
-                    pluginconfig.get(tagname, None)
-                )
-                if tagval is None:
-                    self.debug('Unknown format tag: {}'.format(tagname))
-                    if self.allow_bad_tags:
-                        try:
-                            return self.get_format_args(
-                                self.fix_bad_tag(content, tagname)
-                            )
-                        except RecursionError:
-                            pass
-                    raise self.make_tag_exception(content, tagname)
-                formatargs[tagname] = tagval
-            self.debug('Format args: {!r}'.format(formatargs))
-            return formatargs
-
-        def get_format_tags(self, content):
-            """ Return a list of all format tags found in the content,
-                whether they are valid tags or not.
-            """
-            # Finds basic str.format style tags {like} {this}, but ignores
-            # the escaped tags {{like}} {{this}}.
-            tags = set(
-                tag[1:-1] for tag in re.findall(r'{{?\w+}}?', content)
-                if not tag.startswith('{{')
-            )
-            self.debug('Format tags: {}'.format(
-                ', '.join(tags) or '<no tags>'
-            ))
-            return tags
-
-        def help(self):
-            """ Overloaded help() for custom plugins. """
-            name = self.get_name()
-            print('\nHelp for custom New plugin, {}:\n'.format(name))
-            desc = self.get_desc()
-            if desc:
-                print('Description:\n{}'.format(desc))
-            else:
-                print('(no description available)')
-            filename = getattr(self, 'input_file', None)
-            content = getattr(self, 'input_content', None)
-            if filename:
-                print('\nBased on: {}'.format(filename))
-                if not os.path.exists(filename):
-                    print('          This path does not exist!')
-            elif content:
-                print('\nBased on content:\n  {}'.format(
-                    self.format_content_preview(max_length=77)
-                ))
-
-        def make_tag_exception(self, content, tagname):
-            """ Create a SignalExit to be used when a bad format tag is found
-                in the content.
-            """
-            # Build some info about the bad tag/content.
-            linenum, linepos = self.find_tag_position(
-                content,
-                tagname
-            )
-            if self.input_file:
-                # Use file name, not content.
-                pluginid = 'file, {}'.format(self.input_file)
-            elif self.input_content:
-                # Use content preview.
-                pluginid = 'content'
-            else:
-                msg = 'No file name or content to work with.'
-                self.debug(msg)
-                raise ValueError(msg)
-            msg = '\n'.join((
-                'Unknown format tag in {pluginname}\'s {pluginid}:',
-                '    {content}',
-                '    Position: line {linenum}, column {linepos}',
-                '         Tag: {{{tagname}}}'
-            )).format(
-                pluginname=self.get_name(),
-                pluginid=pluginid,
-                content=self.format_content_preview(),
-                linenum=linenum or '?',
-                linepos=linepos or '?',
-                tagname=tagname
-            )
-            if self.allow_bad_tags:
-                warnmsg = '\n'.join((
-                    '\nThis tag could not be fixed with \'allow_bad_tags\',',
-                    'most likely because there are multiple instances with',
-                    'varying amounts of { and } characters.',
-                    ''
-                ))
-            else:
-                warnmsg = ''
-            return SignalExit(
-                '\n'.join((
-                    msg,
-                    warnmsg,
-                    'You can create this tag in plugins.global.'
-                )),
-                code=1
-            )
-    return CustomPlugin
+def create_skeleton_plugin(names, info, skeletondir):
+    """ Creates a SkeletonPlugin from user config, for a custom plugin with
+        a directory as it's 'filename' (see: plugins._custom).
+        Returns an uninstantiated SkeletonPlugin class.
+    """
+    from ._custom import create_skeleton_plugin
+    return create_skeleton_plugin(names, info, skeletondir)
 
 
 def custom_plugin_help():
     """ Print a message with instructions for creating a custom plugin. """
-    try:
-        from outputcatcher import ProcessOutput
-    except ImportError:
-        ProcessOutput = None
-    configstr = """
-{
-    // Custom plugins live under the 'custom' key in new.json.
-    "custom": {
-        // Main name for this custom plugin.
-        "mit": {
-            // Other names for this custom plugin.
-            "aliases": ["license.mit"],
-
-            // File name to read, copy, format, from when creating the file.
-            "filename": "~/Documents/licenses/mit.template.txt",
-
-            // Short description for the custom plugin.
-            "description": "A new MIT license with the year and author set.",
-
-            // Whether New should format keys like {author}, {date}, ..
-            "formatted": true,
-
-            // Post-processing plugins to ignore, like the chmodx plugin.
-            "ignore_post": ["chmodx"]
-        },
-
-        // Same thing, except uses content straight from the config file:
-        "hello": {
-            "aliases": ["helloworld", "myhelloplugin"],
-            "content": "Hello world from {author}, on {date}.",
-            "description": "A basic content-based custom plugin.",
-            "formatted": true,
-            "ignore_post": ["chmodx"]
-        }
-    }
-    // ...the rest of new.json's config settings.
-}""".strip()
-
-    if ProcessOutput is None:
-        debug('outputcatcher not installed, no highlighting.')
-    else:
-        # Free highlighting for those with outputcatcher installed.
-        cmds = (
-            [
-                'highlight',
-                '--style=night',
-                '--syntax=js',
-                '--out-format=ansi'
-            ],
-            ['ccat', '--colors', '--lexer', 'js', '--style', 'monokai'],
-        )
-        for cmd in cmds:
-            try:
-                with ProcessOutput(cmd, stdin_data=configstr) as p:
-                    debug('Ran command: {!r}'.format(cmd))
-                    configstr = p.stdout.decode()
-                    debug('Got output: {!r}...'.format(configstr[:40]))
-                    if p.stderr:
-                        debug('Got stderr!:')
-                        debug(p.stderr.decode(), align=True)
-                    break
-            except Exception as ex:
-                debug('Highlight failed for {!r}: {}'.format(cmd, ex))
-                continue
-
-    print('Custom plugin config example:\n\n{}'.format(configstr))
-    knowntags = (
-        ('author', 'Set in config under plugins.global.author.'),
-        ('date', 'Set to today\'s date.'),
-        ('email', 'Set in config under plugins.global.email.'),
-        ('version', 'Set in config under plugins.global.default_version.'),
-        ('year', 'Set to this year.'),
-    )
-    print('\nCurrent known formatting tags:\n    {}'.format(
-        '\n    '.join(
-            '{:>8}: {}'.format(key, desc)
-            for key, desc in knowntags
-        )
-    ))
-    return True
+    from ._listing import custom_plugin_help
+    return custom_plugin_help()
 
 
 def date(dateobj=None):
@@ -664,30 +383,36 @@ def determine_plugins(pluginname, filenames, use_default=True):
             use_default  : Whether to return the default plugin on bad
                            plugin names.
                            Default: True
+        `filenames` can be any iterable (like a generator of expanded file
+        name patterns), it is only iterated once.
         Returns {Plugin: [filepaths, ..], ..} for each successful plugin
         determination. On failure to determine a plugin for a given
         filename, there will be a None key with the filepaths that failed.
     """
-    if not pluginname:
+    filenames = iter(filenames)
+    firstname = next(filenames, None)
+    if (not pluginname) and (firstname is not None):
         # Check to see if first 'filename' is actually a plugin name.
         # This is a workaround for docopt.
-        plugincls = get_plugin_byname(filenames[0])
+        plugincls = get_plugin_byname(firstname)
         if plugincls:
             pluginname = plugincls.get_name()
-            filenames.pop(0)
+            firstname = next(filenames, None)
             debug(
                 'Plugin name given, using {} for the following files:'.format(
                     pluginname,
                 )
             )
-    if pluginname and (not filenames):
+    if pluginname and (firstname is None):
         plugincls = get_plugin_byname(pluginname)
         if plugincls:
-            return {plugincls: filenames}
+            return {plugincls: []}
         print_err('Not a valid file type (not supported): {}'.format(
             pluginname,
         ))
         return {}
+    if firstname is not None:
+        filenames = chain((firstname, ), filenames)
 
     determined = {}
     for filename in filenames:
@@ -705,6 +430,28 @@ def determine_plugins(pluginname, filenames, use_default=True):
     return determined
 
 
+@traced(outcome=lambda errors: 'errors' if errors else 'success')
+def do_post_flush():
+    """ Flush the post plugins that were used in this run, after they have
+        processed the files from every plugin group (see: PostPlugin.flush).
+        This lets plugins like gitadd handle all of a run's files at once.
+        Returns: Number of errors encountered.
+    """
+    errors = 0
+    for ptype in ('post', 'deferred'):
+        for postcls in plugins[ptype].values():
+            plugin = pool.instances.get(postcls, None)
+            if plugin is None:
+                # Not used in this run.
+                continue
+            with timed('flush:{}'.format(postcls.get_name())):
+                pluginret = try_post_flush(plugin)
+            if pluginret == PluginReturn.fatal:
+                return errors + 1
+            errors += pluginret.value
+    return errors
+
+
 def do_post_plugins(filepaths, plugin):
     """ Handle all post-processing plugins.
         These plugins will be given the file name to work with.
@@ -720,6 +467,7 @@ def do_post_plugins(filepaths, plugin):
         plugin.get_name(),
         filepaths,
     ))
+    tracer.set(plugin=plugin.get_name(), files=len(filepaths))
     if not filepaths:
         return 0
 
@@ -730,11 +478,12 @@ def do_post_plugins(filepaths, plugin):
             debug(skipmsg.format(postcls.get_name(), plugin.get_name()))
             continue
 
-        pluginret = try_post_plugin(
-            postcls,
-            plugin,
-            filepaths,
-        )
+        with timed('post:{}'.format(postcls.get_name())):
+            pluginret = try_post_plugin(
+                postcls,
+                plugin,
+                filepaths,
+            )
         if pluginret == PluginReturn.fatal:
             return errors + 1
         errors += pluginret.value
@@ -759,11 +508,12 @@ def do_post_plugins(filepaths, plugin):
             skipmsg = 'Skipping deferred-plugin {} for {}.'
             debug(skipmsg.format(deferredcls.get_name(), plugin.get_name()))
             continue
-        pluginret = try_post_plugin(
-            deferredcls,
-            plugin,
-            filepaths,
-        )
+        with timed('deferred:{}'.format(deferredcls.get_name())):
+            pluginret = try_post_plugin(
+                deferredcls,
+                plugin,
+                filepaths,
+            )
         if pluginret == PluginReturn.fatal:
             return errors + 1
         errors += pluginret.value
@@ -771,11 +521,53 @@ def do_post_plugins(filepaths, plugin):
     return errors
 
 
+def do_transform_plugins(plugin, filename, content):
+    """ Run new content through the transform plugins, in order, before it
+        is written. Each transform receives the content from the last one.
+        A transform that fails is skipped (the error is printed), and a
+        SignalExit is not caught, so it can cancel the file.
+        Arguments:
+            plugin   : The Plugin that created the content.
+            filename : The file name that the content will be written to.
+            content  : The content to transform.
+        Returns the final content.
+    """
+    for transform in get_transforms():
+        name = transform.get_name()
+        if plugin.ignore_transform and (name in plugin.ignore_transform):
+            debug('Skipping transform {} for {}.'.format(
+                name,
+                plugin.get_name(),
+            ))
+            continue
+        if transform.config.get('disabled', False):
+            debug('Skipping disabled transform: {}'.format(name))
+            continue
+        if not transform.handles(filename):
+            continue
+        transform.reset()
+        try:
+            with timed('transform:{}'.format(name)):
+                content = transform.transform(plugin, filename, content)
+        except SignalExit:
+            raise
+        except Exception as ex:
+            print_err('\nError in transform plugin \'{}\':\n{}'.format(
+                name,
+                ex,
+            ))
+    return content
+
+
 def find_config_file():
     """ Loads the defult config file. If no file is present, it will look
         for the distribution (example) file, and copy it to the default name.
-
+        The copy is created atomically, so when several processes race to
+        create it, one wins and the rest use its file.
     """
+    if BUNDLE is not None:
+        # Bundles have a frozen config snapshot.
+        return os.path.join(BUNDLE, 'new.json')
     mainfile = os.path.join(SCRIPTDIR, 'new.json')
     if os.path.exists(mainfile):
         return mainfile
@@ -788,7 +580,10 @@ def find_config_file():
 
     try:
         debug('Copying dist config file to: {}'.format(mainfile))
-        shutil.copyfile(distfile, mainfile)
+        with open(distfile, 'r') as f:
+            write_file_atomic(mainfile, f.read())
+    except FileExistsError:
+        debug('Dist config file was copied by another process.')
     except EnvironmentError as ex:
         debug('Unable to copy dist config file: {} -> {}\n {}'.format(
             distfile,
@@ -809,16 +604,16 @@ def fix_author(s):
 
 
 def fix_indent(s, replace='    ', replacement='\t'):
-    """ Replace leading spaces with tabs. """
-    final = []
+    """ Replace leading spaces with tabs.
+        For config-based indentation, see: Plugin.format_output()
+    """
     replacelen = len(replace)
-    for line in s.split('\n'):
-        cnt = 0
-        while line.startswith(replace):
-            cnt += 1
-            line = line[replacelen:]
-        final.append(''.join((replacement * cnt, line)))
-    return '\n'.join(final)
+    return re.sub(
+        '^(?:{})+'.format(re.escape(replace)),
+        lambda match: replacement * (len(match.group()) // replacelen),
+        s,
+        flags=re.MULTILINE,
+    )
 
 
 def fix_indent_spaces(s):
@@ -858,9 +653,9 @@ def get_plugin_byname(name, use_post=False):
         return None
     name = name.lower()
     # Check for custom file-based plugins in config.
-    for plugincls in plugins['custom'].values():
-        if name in {pname.lower() for pname in plugincls.name}:
-            return plugincls
+    plugincls = plugins['custom'].get_byname(name)
+    if plugincls is not None:
+        return plugincls
 
     # Try file type plugins.
     for plugincls in plugins['types'].values():
@@ -887,6 +682,75 @@ def get_plugin_default(_name=None):
     return get_plugin_byname(name)
 
 
+def get_post_option(plugin, key, default=None):
+    """ Return a config option for a post plugin, from it's loaded config,
+        it's config section, or plugins.global.
+        Post plugins don't always load their config (see: load_config()).
+    """
+    sections = (
+        plugin.config,
+        config.get(plugin.get_name(), {}),
+        config.get('plugins', {}).get('global', {}),
+    )
+    for section in sections:
+        if key in section:
+            return section[key]
+    return default
+
+
+def get_post_timeout(plugin):
+    """ Return the time limit (in seconds) for a post plugin, from it's
+        "timeout" option and what is left of plugins.post_budget.
+        Returns None for no limit, or 0 if the budget is used up.
+    """
+    timeout = get_post_option(plugin, 'timeout', None)
+    total = config.get('plugins', {}).get('post_budget', None)
+    try:
+        return post_budget.limit(
+            float(total) if total else None,
+            float(timeout) if timeout else None,
+        )
+    except (TypeError, ValueError) as ex:
+        raise InvalidConfig(
+            'Invalid post plugin timeout for {}: {}'.format(
+                plugin.get_name(),
+                ex,
+            )
+        )
+
+
+def get_template_tags():
+    """ Return a mapping of known format tags, for custom plugin templates.
+        Any value in plugins.global can be used as a tag, and everything
+        else comes from plugins.tag_providers, which are only called for the
+        tags that are used.
+    """
+    pluginconfig = config.get('plugins', {}).get('global', {})
+    configtags = dict(pluginconfig)
+    configtags.update({
+        'author': pluginconfig.get('author', '(no author set)'),
+        'email': pluginconfig.get('email', '(no email set)'),
+        'version': pluginconfig.get('default_version', default_version),
+    })
+    return ChainMap(configtags, tag_providers)
+
+
+def get_transforms():
+    """ Return the (pooled) transform plugin instances, in the order that
+        they run (see: TransformPlugin.get_order()).
+    """
+    transforms = []
+    for transformcls in plugins['transform'].values():
+        try:
+            transforms.append(pool.get(transformcls))
+        except Exception as ex:
+            print_err('Failed to load transform plugin: {}\n{}'.format(
+                transformcls.__name__,
+                ex,
+            ))
+    return sorted(transforms, key=lambda t: (t.get_order(), t.get_name()))
+
+
 def get_usage(indent=0):
     """ Get a usage and options from all plugins.
         Returns (usage_str, options_str).
@@ -922,7 +786,7 @@ def is_plugins_module(module):
 def is_private_module(basename):
     """ Returns True if a file's base name looks like a private module. """
     return (
-        basename.startswith('__') or
+        basename.startswith('_') or
         basename.endswith('pluginbase.py')
     )
 
@@ -965,8 +829,23 @@ def is_invalid_plugin(plugincls):
         if not hasattr(plugincls, 'process'):
             return 'missing process function'
         return None
+    elif issubclass(plugincls, TransformPlugin):
+        if not hasattr(plugincls, 'transform'):
+            return 'missing transform function'
+        return None
+
+    return 'not a Plugin, PostPlugin, DeferredPostPlugin, or TransformPlugin'
 
-    return 'not a Plugin, PostPlugin, or DeferredPostPlugin'
+
+def iter_plugin_modules(plugindir):
+    """ Iterate over all plugin module names in the given path, or the
+        module names from the bundle manifest when running from a bundle.
+    """
+    if bundle_manifest is not None:
+        yield from bundle_manifest['modules']
+        return
+    for name in iter_py_modules(plugindir):
+        yield os.path.splitext(name)[0]
 
 
 def iter_py_modules(path):
@@ -986,104 +865,14 @@ def iter_py_modules(path):
 
 def list_plugins():
     """ Lists all plugins for the terminal. """
-    filetypes = (
-        ('custom', 'custom file-based'),
-        ('types', 'file-type')
-    )
-    # Normal Plugins (file-type)
-    indent = 20
-    verlbl = 'version'.rjust(indent)
-    aliaslbl = 'aliases'.rjust(indent)
-    extlbl = 'extensions'.rjust(indent)
-    desclbl = 'description'.rjust(indent)
-    # Plus 2 to leave room for ': ' in the description.
-    descindent = ''.join(('\n', ' ' * (len(desclbl) + 2)))
-
-    def format_desc(s):
-        return s.replace('\n', descindent)
-
-    for ptype, pname in filetypes:
-        if plugins[ptype]:
-            publicplugins = sorted(
-                s for s in plugins[ptype] if not plugins[ptype][s].private
-            )
-            pluginlen = len(publicplugins)
-            print('\nFound {} {} {}:'.format(
-                pluginlen,
-                pname,
-                'plugin' if pluginlen == 1 else 'plugins'
-            ))
-            for pluginname in publicplugins:
-                plugin = plugins[ptype][pluginname]
-                if plugin.private:
-                    continue
-                print('    {}:'.format(pluginname))
-                print('{}: {}'.format(verlbl, plugin.version))
-                if len(plugin.name) > 1:
-                    print('{}: {}'.format(aliaslbl, ', '.join(plugin.name)))
-                if plugin.extensions:
-                    extlist = ', '.join(plugin.extensions)
-                else:
-                    extlist = 'None'
-                print('{}: {}'.format(extlbl, extlist))
-                desc = format_desc(plugin.get_desc())
-                if desc:
-                    print('{}: {}'.format(desclbl, desc))
-
-    # Do PostPlugin and DeferredPostPlugin
-    posttypes = (
-        ('post', 'post-processing'),
-        ('deferred', 'deferred post-processing')
-    )
-    verlbl = 'version'.rjust(indent - 5)
-    for ptype, pname in posttypes:
-        if plugins[ptype]:
-            publicposts = sorted(
-                s for s in plugins[ptype] if not plugins[ptype][s].private
-            )
-            postlen = len(publicposts)
-            plural = 'plugin' if postlen == 1 else 'plugins'
-            print('\nFound {} {} {}:'.format(postlen, pname, plural))
-            for pname in publicposts:
-                plugin = plugins[ptype][pname]
-                if plugin.private:
-                    continue
-                desc = plugin.get_desc().replace('\n', '\n        ')
-                print('    {}'.format(pname))
-                print('{}: {}'.format(verlbl, plugin.version))
-                print('        {}'.format(desc))
+    from ._listing import list_plugins
+    return list_plugins(plugins)
 
 
 def list_plugin_versions():
-    plen = sum(len(plugins[k]) for k in plugins)
-    if not plen:
-        print_err('\nNo plugins found!')
-        return 1
-    filetypes = (
-        ('custom', 'custom file-based'),
-        ('types', 'file-type')
-    )
-    posttypes = (
-        ('post', 'post-processing'),
-        ('deferred', 'deferred post-processing')
-    )
-
-    print('\nFound {} {}:'.format(plen, 'plugin' if plen == 1 else 'plugins'))
-    for ptype, typedesc in filetypes:
-        typefmt = typedesc.title()
-        typelen = len(plugins[ptype])
-        print(f'\n    {typefmt} ({typelen}):')
-        for name in sorted(plugins[ptype]):
-            p = plugins[ptype][name]
-            print(f'        {name:<16}: {p.version}')
-    for ptype, typedesc in posttypes:
-        typefmt = typedesc.title()
-        typelen = len(plugins[ptype])
-        print(f'\n    {typefmt} ({typelen}):')
-        for name in sorted(plugins[ptype]):
-            p = plugins[ptype][name]
-            print(f'        {name:<16}: {p.version}')
-    return 0
+    """ Lists all plugin versions for the terminal. """
+    from ._listing import list_plugin_versions
+    return list_plugin_versions(plugins)
 
 
 def load_config(section=None):
@@ -1117,7 +906,7 @@ def load_config_file(filename, section=None):
     conf = {}
     try:
         conflines = []
-        with open(filename, 'r') as f:
+        with open_text(filename) as f:
             for line in f:
                 stripped = line.strip()
                 if stripped and not stripped.startswith('//'):
@@ -1143,22 +932,12 @@ def load_config_file(filename, section=None):
 
 def load_custom_plugins():
     """ Load all custom config-based plugins.
-        Returns a dict of {name: CustomPlugin class}
+        The plugin classes are not created until they are used.
+        Returns a CustomPlugins mapping of {name: CustomPlugin class}
     """
-    tmp_plugins = {}
-    customplugins = config.get('custom', {})
-    for customname in config.get('custom', {}):
-        custominfo = customplugins[customname]
-        customaliases = custominfo.get('aliases', tuple())
-        customnames = [customname]
-        customnames.extend(customaliases)
-        customcls = create_custom_plugin(
-            customnames,
-            custominfo
-        )
-        tmp_plugins[customname] = customcls
-        debug('Loaded: {} ({})'.format(customname, customcls.__name__))
-    return tmp_plugins
+    customplugins = CustomPlugins(config.get('custom', {}))
+    debug('Found {} custom plugins.'.format(len(customplugins)))
+    return customplugins
 
 
 def load_module(modulename):
@@ -1182,15 +961,17 @@ def load_module_plugins(module):  # noqa
         Returns a dict of: {
             'types': {name: instance},
             'post': {name: instance},
-            'deferred': {name: instance}
+            'deferred': {name: instance},
+            'transform': {name: instance}
         }
     """
     pluginsconfig = config.get('plugins', {})
     disabled_deferred = pluginsconfig.get('disabled_deferred', [])
     disabled_post = pluginsconfig.get('disabled_post', [])
+    disabled_transform = pluginsconfig.get('disabled_transform', [])
     disabled_types = pluginsconfig.get('disabled_types', [])
 
-    tmp_plugins = {'types': {}, 'post': {}, 'deferred': {}}
+    tmp_plugins = {'types': {}, 'post': {}, 'deferred': {}, 'transform': {}}
     modname = getattr(module, '__name__', 'unknown_module_name')
 
     for plugincls in module.exports:
@@ -1250,6 +1031,20 @@ def load_module_plugins(module):  # noqa
                 continue
             tmp_plugins['post'][name] = plugincls
             debug('Loaded: {} (PostPlugin)'.format(fullname))
+        elif issubclass(plugincls, TransformPlugin):
+            if not name:
+                debug_missing('name', 'transform', modname, plugincls)
+                continue
+            # See if the plugin is disabled.
+            if name in disabled_transform:
+                skipmsg = 'Skipping disabled transform plugin: {}'
+                debug(skipmsg.format(fullname))
+                continue
+            elif name in tmp_plugins['transform']:
+                debug('Conflicting TransformPlugin: {}'.format(name))
+                continue
+            tmp_plugins['transform'][name] = plugincls
+            debug('Loaded: {} (TransformPlugin)'.format(fullname))
         else:
             debug('\nNon-plugin type!: {}'.format(plugincls.__name__))
     return tmp_plugins
@@ -1296,15 +1091,21 @@ def load_plugins(plugindir):
     global plugins, config
     # Load general plugin config.
     config = load_config()
+    cache.configure(config.get('plugins', {}).get('cache', None))
 
     debug('Loading plugins from: {}'.format(plugindir))
-    tmp_plugins = {'custom': {}, 'types': {}, 'post': {}, 'deferred': {}}
+    tmp_plugins = {
+        'custom': {},
+        'types': {},
+        'post': {},
+        'deferred': {},
+        'transform': {},
+    }
     # Load custom config/file-based plugins.
     tmp_plugins['custom'] = load_custom_plugins()
 
     # Load single-file plugins.
-    modnames = (os.path.splitext(p)[0] for p in iter_py_modules(plugindir))
-    for modname in modnames:
+    for modname in iter_plugin_modules(plugindir):
         try:
             module = load_module(modname)
         except ImportError as eximp:
@@ -1313,7 +1114,7 @@ def load_plugins(plugindir):
             continue
         try:
             moduleplugins = load_module_plugins(module)
-            for ptype in ('types', 'post', 'deferred'):
+            for ptype in ('types', 'post', 'deferred', 'transform'):
                 # Add this module's [ptype]-plugins to the global set.
                 tmp_plugins[ptype].update(moduleplugins[ptype])
         except Exception as ex:
@@ -1321,6 +1122,8 @@ def load_plugins(plugindir):
 
     # Set module-level copy of plugins.
     plugins = tmp_plugins
+    pool.clear()
+    post_budget.clear()
 
 
 def print_err(*args, **kwargs):
@@ -1345,6 +1148,30 @@ def print_json(o, indent=4, sort_keys=False, file=None):
     )
 
 
+def report_post_plugin(plugin, typeplugin, filepaths, result, ex=None):
+    """ Report a post plugin's result for --output (see: plugins._report).
+        Arguments:
+            plugin      : The Post or Deferred plugin that ran, or it's
+                          name if it could not be created.
+            typeplugin  : The original Plugin that created the content,
+                          or None for a flush (see: try_post_flush()).
+            filepaths   : The files given to the post plugin.
+            result      : 'success', 'error', or 'fatal'.
+            ex          : The exception for errors, if any.
+    """
+    if reporter.mode == 'text':
+        return None
+    fields = {
+        'post': plugin if isinstance(plugin, str) else plugin.get_name(),
+        'plugin': None if typeplugin is None else typeplugin.get_name(),
+        'files': list(filepaths),
+        'result': result,
+    }
+    if ex is not None:
+        fields['error'] = getattr(ex, 'reason', None) or str(ex)
+    reporter.record('post', **fields)
+
+
 def save_config(config, section=None):
     """ Save config to global config file. """
     configfile = os.path.join(SCRIPTDIR, 'new.json')
@@ -1394,15 +1221,76 @@ def sum_plugin_versions():
     minors = 0
     micros = 0
     for ptype in plugins:
-        for name in plugins[ptype]:
-            p = plugins[ptype][name]
-            major, minor, micro = p.version_numbers()
+        if ptype == 'custom':
+            # Custom plugins always have the base version, so they can be
+            # counted without creating their classes.
+            versions = [Plugin.version_numbers()] * len(plugins[ptype])
+        else:
+            versions = (
+                plugins[ptype][name].version_numbers()
+                for name in plugins[ptype]
+            )
+        for major, minor, micro in versions:
             majors += major
             minors += minor
             micros += micro
     return (majors, minors, micros)
 
 
+@traced(outcome=lambda pluginret: pluginret.name)
+def try_post_flush(plugin):
+    """ Try running plugin.flush(), for do_post_flush().
+        The plugin's timeout and plugins.post_budget apply, like they do for
+        process() in try_post_plugin().
+        Returns a PluginReturn, like try_post_plugin().
+    """
+    tracer.set(post_plugin=plugin.get_name())
+    try:
+        timeout = get_post_timeout(plugin)
+    except InvalidConfig as ex:
+        print_err('\n{}'.format(ex))
+        report_post_plugin(plugin, None, [], 'error', ex)
+        return PluginReturn.error
+    if timeout == 0:
+        errmsg = '\nSkipping post-processing plugin \'{}\': {}'.format(
+            plugin.get_name(),
+            'The post-processing budget (plugins.post_budget) was used up.',
+        )
+        print_err(errmsg)
+        report_post_plugin(plugin, None, [], 'error')
+        return PluginReturn.error
+
+    started = time.perf_counter()
+    try:
+        with deadline(timeout):
+            plugin.flush()
+    except PluginTimeout as extime:
+        errmsg = '\nCancelled post-processing plugin \'{}\':\n{}'
+        print_err(errmsg.format(plugin.get_name(), extime))
+        report_post_plugin(plugin, None, [], 'error', extime)
+        return PluginReturn.error
+    except SignalExit as exstop:
+        errmsg = '\nFatal error in post-processing plugin \'{}\':\n{}'
+        print_err(errmsg.format(
+            plugin.get_name(),
+            exstop.reason or 'No reason was given for the exit.',
+        ))
+        report_post_plugin(plugin, None, [], 'fatal', exstop)
+        return PluginReturn.fatal
+    except Exception as ex:
+        msg = '\nError in post-processing plugin \'{}\':\n{}'.format(
+            plugin.get_name(),
+            ex
+        )
+        print_err(msg)
+        report_post_plugin(plugin, None, [], 'error', ex)
+        return PluginReturn.error
+    finally:
+        post_budget.add(time.perf_counter() - started)
+    return PluginReturn.success
+
+
+@traced(outcome=lambda pluginret: pluginret.name)
 def try_post_plugin(plugincls, typeplugin, filepaths):
     """ Try running plugin.process(filename).
         Arguments:
@@ -1414,14 +1302,22 @@ def try_post_plugin(plugincls, typeplugin, filepaths):
             PluginReturn.error (1)
             PluginReturn.fatal (2)
     """
+    tracer.set(
+        post_plugin=plugincls.get_name(),
+        plugin=typeplugin.get_name(),
+        files=len(filepaths),
+    )
     try:
-        plugin = plugincls()
+        plugin = pool.get(plugincls)
     except Exception as ex:
-        print_err('Failed to load post plugin: {}\n{}'.format(
+        postname = getattr(plugincls, 'get_name', lambda: 'unknown name')()
+        print_err('Failed to load post plugin: {} ({})\n{}'.format(
             plugincls.__name__,
-            getattr(plugincls, 'get_name', lambda: 'unknown name')(),
+            postname,
             ex
         ))
+        # There is no instance to report, only the name.
+        report_post_plugin(postname, typeplugin, filepaths, 'fatal', ex)
         return PluginReturn.fatal
     disabled = plugin.config.get('disabled', None)
     if disabled:
@@ -1429,11 +1325,39 @@ def try_post_plugin(plugincls, typeplugin, filepaths):
         return PluginReturn.success
 
     try:
-        if plugin.multifile:
-            plugin.process_multi(typeplugin, filepaths)
-        else:
-            for filepath in filepaths:
-                plugin.process(typeplugin, filepath)
+        timeout = get_post_timeout(plugin)
+    except InvalidConfig as ex:
+        print_err('\n{}'.format(ex))
+        report_post_plugin(plugin, typeplugin, filepaths, 'error', ex)
+        return PluginReturn.error
+    if timeout == 0:
+        errmsg = '\nSkipping post-processing plugin \'{}\': {}'.format(
+            plugin.get_name(),
+            'The post-processing budget (plugins.post_budget) was used up.',
+        )
+        print_err(errmsg)
+        report_post_plugin(plugin, typeplugin, filepaths, 'error')
+        return PluginReturn.error
+
+    started = time.perf_counter()
+    try:
+        with deadline(timeout):
+            if plugin.multifile:
+                plugin.reset()
+                plugin.process_multi(typeplugin, filepaths)
+            else:
+                for filepath in filepaths:
+                    plugin.reset()
+                    plugin.process(typeplugin, filepath)
+    except PluginTimeout as extime:
+        errmsg = '\nCancelled post-processing plugin \'{}\':\n{}'
+        print_err(errmsg.format(plugin.get_name(), extime))
+        if get_post_option(plugin, 'timeout_fatal', False):
+            print_err('\nCancelling all post plugins.')
+            report_post_plugin(plugin, typeplugin, filepaths, 'fatal', extime)
+            return PluginReturn.fatal
+        report_post_plugin(plugin, typeplugin, filepaths, 'error', extime)
+        return PluginReturn.error
     except SignalExit as exstop:
         if exstop.reason:
             errmsg = '\nFatal error in post-processing plugin \'{}\':\n{}'
@@ -1442,6 +1366,7 @@ def try_post_plugin(plugincls, typeplugin, filepaths):
             errmsg = '\nFatal error in post-processing plugin: \'{}\''
             print_err(errmsg.format(plugin.name))
         print_err('\nCancelling all post plugins.')
+        report_post_plugin(plugin, typeplugin, filepaths, 'fatal', exstop)
         return PluginReturn.fatal
     except Exception as ex:
         msg = '\nError in post-processing plugin \'{}\':\n{}'.format(
@@ -1449,10 +1374,69 @@ def try_post_plugin(plugincls, typeplugin, filepaths):
             ex
         )
         print_err(msg)
+        report_post_plugin(plugin, typeplugin, filepaths, 'error', ex)
         return PluginReturn.error
+    finally:
+        post_budget.add(time.perf_counter() - started)
+    report_post_plugin(plugin, typeplugin, filepaths, 'success')
     return PluginReturn.success
 
 
+class CustomPlugins(Mapping):
+    """ Custom config-based plugins, by name.
+        The CustomPlugin classes are only created (see: create_custom_plugin)
+        when they are first looked up, so loading them is cheap no matter
+        how many are configured.
+    """
+
+    def __init__(self, customconfig=None):
+        # {name: custom plugin config}
+        self.info = dict(customconfig or {})
+        # {name: CustomPlugin class}, for classes that have been created.
+        self.classes = {}
+        # {lowercase name/alias: name}, built on the first get_byname().
+        self.aliases = None
+
+    def __contains__(self, name):
+        return name in self.info
+
+    def __getitem__(self, name):
+        plugincls = self.classes.get(name, None)
+        if plugincls is None:
+            plugincls = self.classes[name] = create_custom_plugin(
+                self.get_names(name),
+                self.info[name],
+            )
+            debug('Loaded: {} ({})'.format(name, plugincls.__name__))
+        return plugincls
+
+    def __iter__(self):
+        return iter(self.info)
+
+    def __len__(self):
+        return len(self.info)
+
+    def get_byname(self, name):
+        """ Get a custom plugin class by name or alias (case-insensitive).
+            Returns None if there is no custom plugin by that name.
+        """
+        if self.aliases is None:
+            self.aliases = {}
+            for customname in self.info:
+                for alias in self.get_names(customname):
+                    self.aliases.setdefault(alias.lower(), customname)
+        customname = self.aliases.get(name.lower(), None)
+        if customname is None:
+            return None
+        return self[customname]
+
+    def get_names(self, name):
+        """ Get the name and aliases for a custom plugin, from config. """
+        names = [name]
+        names.extend(self.info[name].get('aliases', tuple()))
+        return names
+
+
 class InvalidArg(ValueError):
     def __init__(self, arg, msg=None):
         self.arg = arg
@@ -1680,7 +1664,7 @@ class PluginBase(object):
     @classmethod
     def get_name(cls):
         """ Get the proper name for this plugin (no aliases). """
-        if issubclass(cls, PostPlugin):
+        if issubclass(cls, (PostPlugin, TransformPlugin)):
             return cls.name or ''
 
         # Grab single name from names/aliases in Plugins.
@@ -1884,6 +1868,8 @@ class PluginBase(object):
     def parse_docopt(self, usage, argv, version=None):
         """ Wrapper around docopt.docopt() for plugins.
             It provides better error messages, and includes the plugin name.
+            The usage string's grammar is cached (see: plugins._args), so
+            it is only built once.
             Returns an arg dict on success.
             Raises SignalExit on error, or when the user provides incorrect
             command line arguments.
@@ -1942,22 +1928,32 @@ class PluginBase(object):
             This function provides implementation of 'self.print_status' for
             Plugins and PostPlugins.
         """
-        self.print_term(
-            '{}{}: {}'.format(
-                '\n' * padlines,
-                C(self.get_name().ljust(16), 'blue'),
-                msg
-            ),
-            **kwargs
-        )
+        reporter.status(self.get_name(), msg, padlines=padlines, **kwargs)
 
     @staticmethod
     def print_term(*args, **kwargs):
-        """ Print only if stdout is a terminal. """
+        """ Print only if stdout is a terminal (and not using --output). """
         kwargs['file'] = kwargs.get('file', sys.stdout)
-        if kwargs['file'].isatty():
+        if reporter.show_text(kwargs['file']):
             print(*args, **kwargs)
 
+    def reset(self):
+        """ Clear per-file state, before a pooled instance handles another
+            file (see: plugins._pool).
+            Config, args, and anything cached from them are kept.
+            Plugins that keep state for a single file should override this.
+        """
+        return None
+
+    def timed(self, label):
+        """ Context manager to time a block of plugin code for --timings.
+            The label is prefixed with the plugin name.
+            Example:
+                with self.timed('render'):
+                    content = self.render()
+        """
+        return timed('{}.{}'.format(self.get_name(), label))
+
     @classmethod
     def version_numbers(cls):
         ns = []
@@ -2013,6 +2009,12 @@ class Plugin(PluginBase):
     # If the plugin fails to end content with a newline, `new` will add it.
     ensure_newline = True
 
+    # (dict)
+    # Output options that this plugin needs, overriding any user config.
+    # See: format_output(), and plugins._output.OutputStyle.
+    # For example, {'indent': 'keep'} when indentation is significant.
+    output_options = None
+
     # (set)
     # Names of deferred plugins that will be skipped when using this plugin.
     ignore_deferred = set()
@@ -2021,6 +2023,10 @@ class Plugin(PluginBase):
     # Names of post plugins that will be skipped when using this plugin.
     ignore_post = set()
 
+    # (set)
+    # Names of transform plugins that will be skipped when using this plugin.
+    ignore_transform = set()
+
     def __init__(self, name=None, extensions=None):
         self.name = self.name or name
         self.extensions = self.extensions or extensions
@@ -2038,18 +2044,16 @@ class Plugin(PluginBase):
             from config.
         """
         self._setup(args=args)
+        self.reset()
         if getattr(self, 'created', None) is None:
             self.created = []
         self.debug('Calling {}.create({!r})'.format(
             type(self).__name__,
             filepath,
         ))
-        try:
+        with timed('create:{}'.format(self.get_name())):
             content = self.create(filepath)
-        except Exception:
-            raise
-        else:
-            self.created.append(filepath)
+        self.created.append(filepath)
         return content
 
     def _create_multi(self, filepaths, args=None):
@@ -2061,18 +2065,17 @@ class Plugin(PluginBase):
             from config.
         """
         self._setup(args=args)
+        self.reset()
         self.debug('Calling {}.create_multi({!r})'.format(
             type(self).__name__,
             filepaths,
         ))
-        try:
+        with timed('create:{}'.format(self.get_name())):
             filename, content = self.create_multi(filepaths)
-        except Exception:
-            raise
-        else:
-            self.created.extend(filepaths)
-            if filename not in self.created:
-                self.created.append(filename)
+        self.created.extend(filepaths)
+        if filename not in self.created:
+            self.created.append(filename)
+        return filename, content
 
     def create(self, filepath):
         """ (unimplemented plugin description)
@@ -2107,10 +2110,159 @@ class Plugin(PluginBase):
         """
         raise NotImplementedError('create_multi() must be implemented!')
 
+    def format_output(self, filepath, content):
+        """ Fix indentation, line endings, and the final newline for content
+            before it is written. Options are merged from (lowest priority
+            first):
+                ensure_newline,
+                config: plugins.output,
+                .editorconfig files (if plugins.output.editorconfig is set),
+                config: <plugin>.output,
+                self.output_options
+            Returns the new content.
+        """
+        outputconfig = config.get('plugins', {}).get('output', {})
+        optiondicts = [
+            {'final_newline': True if self.ensure_newline else 'keep'},
+            outputconfig,
+        ]
+        if outputconfig.get('editorconfig', False) and (filepath != '-'):
+            optiondicts.append(editorconfig_options(filepath))
+        optiondicts.append(self.config.get('output', None))
+        optiondicts.append(self.output_options)
+        style = OutputStyle.from_options(*optiondicts)
+        self.debug('Output style: {!r}'.format(style))
+        return style.apply(content)
+
+
+class SkeletonPlugin(Plugin):
+
+    """ Base for plugins that copy a whole directory tree (a project
+        skeleton) instead of creating content for one file.
+        Plain files are copied in the kernel (see: plugins._skeleton), and
+        only template files are read and rendered with the format tags.
+    """
+    # Any path can be used, they are directories.
+    extensions = None
+    any_extension = True
+
+    # (bool)
+    # Whether unknown format tags are left in templates as they are.
+    allow_bad_tags = False
+
+    # (str)
+    # The directory to copy.
+    skeleton_dir = None
+
+    # (tuple)
+    # fnmatch patterns for relative paths that are templates.
+    template_globs = tuple()
+
+    # (str)
+    # Files ending with this are templates, and the suffix is removed.
+    template_suffix = '.template'
+
+    def _create_tree(self, dirpath, args=None):
+        """ This method is called for tree creation, and is responsible
+            for calling the plugin's create_tree() method.
+            Returns a tuple of (created_files, skipped_existing_files).
+        """
+        self._setup(args=args)
+        self.reset()
+        self.debug('Calling {}.create_tree({!r})'.format(
+            type(self).__name__,
+            dirpath,
+        ))
+        with timed('create:{}'.format(self.get_name())):
+            created, skipped = self.create_tree(dirpath)
+        self.created.append(dirpath)
+        return created, skipped
+
+    def create(self, filepath):
+        """ Skeleton plugins create trees, not content (see: create_tree).
+        """
+        raise SignalExit(
+            'Not a single-file plugin: {}'.format(self.get_name()),
+            code=1,
+        )
+
+    def create_tree(self, dirpath):
+        """ Copy the skeleton directory to `dirpath`.
+            Existing files are skipped unless this is an overwrite.
+            Returns a tuple of (created_files, skipped_existing_files).
+        """
+        if not (self.skeleton_dir and os.path.isdir(self.skeleton_dir)):
+            raise SignalExit(
+                'Skeleton directory does not exist: {}'.format(
+                    self.skeleton_dir,
+                ),
+                code=1,
+            )
+        return copy_tree(
+            self.skeleton_dir,
+            dirpath,
+            is_template=self.is_template,
+            render=self.render_template,
+            overwrite=getattr(self, 'overwrite', False),
+            dryrun=getattr(self, 'dryrun', False),
+        )
+
+    def help(self):
+        """ Overloaded help() for skeleton plugins. """
+        print('\nHelp for skeleton New plugin, {}:\n'.format(
+            self.get_name()
+        ))
+        print(self.get_desc() or '(no description available)')
+        print('\nCopies: {}'.format(self.skeleton_dir))
+        if not os.path.isdir(self.skeleton_dir or ''):
+            print('        This directory does not exist!')
+        print('\nTemplates: *{}{}'.format(
+            self.template_suffix,
+            ''.join(', {}'.format(g) for g in self.template_globs),
+        ))
+        return True
+
+    def is_template(self, relpath):
+        """ Return the output path for a template file (relative to the
+            skeleton), or None if it is a plain file.
+        """
+        if relpath.endswith(self.template_suffix):
+            return relpath[:-len(self.template_suffix)]
+        for glob in self.template_globs:
+            if fnmatch(relpath, glob):
+                return relpath
+        return None
+
+    def render_template(self, relpath, content):
+        """ Render a template file's content with the known format tags.
+            Unknown tags are left as they are if `allow_bad_tags` is set,
+            otherwise they are all reported in a SignalExit.
+        """
+        contentfmt, badtags = TemplateFormatter().render(
+            content,
+            get_template_tags(),
+        )
+        if badtags and not self.allow_bad_tags:
+            raise bad_tags_exit(
+                self.get_name(),
+                'template, {}'.format(relpath),
+                badtags,
+            )
+        return contentfmt
+
 
 class PostPlugin(PluginBase):
     """ Base for post-processing plugins. """
 
+    def flush(self):
+        """ Called once per run, after process() or process_multi() has
+            been called for the files from every plugin group.
+            Plugins that handle all of a run's files at once (like gitadd)
+            can collect the files while processing, and handle them here.
+            It may raise an exception to signal that something went wrong.
+        """
+        return None
+
     def plugin_argd(self, plugin):
         """ Retrieve any arguments that the regular Plugin may have sent
             to this PostPlugin, through the <PostPlugin.name>_argd attribute.
@@ -2190,6 +2342,52 @@ class DeferredPostPlugin(PostPlugin):
     pass
 
 
+class TransformPlugin(PluginBase):
+
+    """ Base for transform plugins, which change new content before it is
+        written (see: do_transform_plugins()).
+        Transforms work on the content in memory, so there is no need to
+        read and rewrite the file afterwards like a PostPlugin would.
+    """
+
+    # (tuple)
+    # File extensions that this transform handles. None means all files.
+    extensions = None
+
+    # (int)
+    # Transforms run from the lowest order to the highest (then by name).
+    # This can be changed in the plugin's config with "order".
+    order = 50
+
+    def get_order(self):
+        """ Return the order for this transform, from config or self.order.
+        """
+        try:
+            return int(self.config.get('order', self.order))
+        except (TypeError, ValueError):
+            return self.order
+
+    def handles(self, filename):
+        """ Returns True if this transform should run for a file name. """
+        if not self.extensions:
+            return True
+        return os.path.splitext(filename)[-1].lower() in self.extensions
+
+    def transform(self, plugin, filename, content):
+        """ (unimplemented transform description)
+
+            This should return the new content for a file.
+            It may raise an exception to signal that something went wrong,
+            or SignalExit to cancel the file.
+
+            Arguments:
+                plugin    : The original Plugin that created the content.
+                filename  : The file name the content will be written to.
+                content   : Content from the plugin, or the last transform.
+        """
+        raise NotImplementedError('transform() must be overridden!')
+
+
 class PluginReturn(Enum):
 
     """ Return values for try_post_plugin().
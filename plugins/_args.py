@@ -0,0 +1,224 @@
+""" Cached argument parsing for New.
+    docopt rebuilds its pattern tree from the usage string on every call,
+    which is most of the time spent parsing arguments. This module builds
+    the tree once for each usage string and caches it (as JSON) on disk,
+    keyed by a hash of the usage string, so later runs only have to match
+    the arguments (see: plugins._cache, the 'args' namespace).
+
+    docopt() works like colr.docopt(), with the same colorized help and
+    error messages, but colr is only imported when help or an error is
+    shown (see: colorize()).
+"""
+
+import hashlib
+import sys
+
+import docopt as docoptlib
+
+from ._cache import cache
+from ._colors import import_colr, is_imported
+
+# Bumped when the cache format changes.
+CACHE_VERSION = 1
+
+# Pattern classes that can be stored in the cache, by name.
+BRANCH_TYPES = {
+    cls.__name__: cls
+    for cls in (
+        docoptlib.AnyOptions,
+        docoptlib.Either,
+        docoptlib.OneOrMore,
+        docoptlib.Optional,
+        docoptlib.Required,
+    )
+}
+LEAF_TYPES = {
+    cls.__name__: cls
+    for cls in (
+        docoptlib.Argument,
+        docoptlib.Command,
+        docoptlib.Option,
+    )
+}
+
+# Grammars that were already loaded in this process, {key: grammar_data}.
+grammars = {}
+
+
+def build_grammar(doc):
+    """ Build the usage section, options, and fixed pattern tree for a
+        usage string, the same way docopt.docopt() does.
+        Returns JSON-friendly grammar data (see: load_grammar()).
+    """
+    usage = docoptlib.printable_usage(doc)
+    options = docoptlib.parse_defaults(doc)
+    pattern = docoptlib.parse_pattern(
+        docoptlib.formal_usage(usage),
+        options,
+    )
+    pattern_options = set(pattern.flat(docoptlib.Option))
+    for anyoptions in pattern.flat(docoptlib.AnyOptions):
+        anyoptions.children = list(
+            set(docoptlib.parse_defaults(doc)) - pattern_options
+        )
+    pattern.fix()
+    return {
+        'usage': usage,
+        'options': [encode_pattern(o) for o in options],
+        'pattern': encode_pattern(pattern),
+    }
+
+
+def cache_key(doc):
+    """ Return the cache key for a usage string. """
+    keystr = '{}:{}:{}'.format(CACHE_VERSION, docoptlib.__version__, doc)
+    return hashlib.sha1(keystr.encode()).hexdigest()
+
+
+def colorize(script=None):
+    """ Import colr's docopt module, which replaces docopt.DocoptExit and
+        docopt.extras with colorized versions.
+        Returns the colr_docopt module.
+    """
+    colr_docopt = import_colr('colr.colr_docopt')
+    # Used by colr to colorize the script name in help/errors.
+    colr_docopt.SCRIPT = script
+    return colr_docopt
+
+
+def decode_pattern(data):
+    """ Rebuild a docopt pattern from encode_pattern() data. """
+    typename = data[0]
+    if typename in BRANCH_TYPES:
+        return BRANCH_TYPES[typename](
+            *(decode_pattern(child) for child in data[1])
+        )
+    if typename == 'Option':
+        pattern = docoptlib.Option(data[1], data[2], data[3])
+        pattern.value = data[4]
+        return pattern
+    pattern = LEAF_TYPES[typename](data[1])
+    pattern.value = data[2]
+    return pattern
+
+
+def docopt(doc, argv=None, help=True, version=None, script=None):
+    """ Parse `argv` with the usage string `doc`, like colr.docopt(), but
+        using a cached grammar (see: load_grammar()).
+        Returns a docopt arg dict.
+        Raises DocoptExit (colorized by colr) for bad arguments, and
+        DocoptLanguageError for bad usage strings.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    usage, options, pattern = load_grammar(doc)
+    # docopt checks for it's own DocoptExit while parsing argv, so that is
+    # used. Until colr is imported, the usage is left out, and the error is
+    # colorized when it is raised again (see: usage_exit()).
+    colorized = is_imported('colr.colr_docopt')
+    if colorized:
+        colorize(script)
+    docoptlib.DocoptExit.usage = usage if colorized else ''
+    try:
+        argv = docoptlib.parse_argv(
+            docoptlib.TokenStream(argv, docoptlib.DocoptExit),
+            list(options),
+            False,
+        )
+    except docoptlib.DocoptExit as ex:
+        if colorized:
+            raise
+        raise usage_exit(usage, script, ex.code)
+    if wants_extras(help, version, argv):
+        colorize(script)
+        docoptlib.extras(help, version, argv, doc)
+    matched, left, collected = pattern.match(argv)
+    if matched and left == []:
+        return docoptlib.Dict(
+            (a.name, a.value) for a in (pattern.flat() + collected)
+        )
+    raise usage_exit(usage, script)
+
+
+def docopt_defaults(doc):
+    """ Return a docopt arg dict for a usage string, with every argument
+        set to it's default value (as if nothing was matched).
+    """
+    _, _, pattern = load_grammar(doc)
+    return docoptlib.Dict((a.name, a.value) for a in pattern.flat())
+
+
+def encode_pattern(pattern):
+    """ Encode a docopt pattern as JSON-friendly lists. """
+    typename = type(pattern).__name__
+    if typename in BRANCH_TYPES:
+        return [typename, [encode_pattern(c) for c in pattern.children]]
+    if typename == 'Option':
+        return [
+            typename,
+            pattern.short,
+            pattern.long,
+            pattern.argcount,
+            pattern.value,
+        ]
+    return [typename, pattern.name, pattern.value]
+
+
+def load_grammar(doc):
+    """ Load the grammar for a usage string, from memory, the disk cache,
+        or by building it (and caching it).
+        Returns a tuple of (usage_section, options, pattern), with new
+        pattern objects for each call.
+    """
+    key = cache_key(doc)
+    data = grammars.get(key, None)
+    if data is None:
+        data = grammars[key] = read_grammar(key) or write_grammar(key, doc)
+    return (
+        data['usage'],
+        [decode_pattern(o) for o in data['options']],
+        decode_pattern(data['pattern']),
+    )
+
+
+def read_grammar(key):
+    """ Read cached grammar data from disk.
+        Returns None if it is not cached, or the cache file is bad.
+    """
+    data = cache.store('args').get_json('{}.json'.format(key))
+    if not isinstance(data, dict):
+        return None
+    if not all(k in data for k in ('usage', 'options', 'pattern')):
+        return None
+    return data
+
+
+def usage_exit(usage, script=None, msg=''):
+    """ Return colr's colorized DocoptExit for bad arguments, with the
+        usage string.
+    """
+    colorize(script)
+    docoptlib.DocoptExit.usage = usage
+    return docoptlib.DocoptExit(msg)
+
+
+def wants_extras(help, version, argv):
+    """ Return True if docopt.extras() would print help or the version for
+        parsed `argv`, which is when colr is needed.
+    """
+    names = set()
+    if help:
+        names.update(('-h', '--help'))
+    if version:
+        names.add('--version')
+    return any((o.name in names) and o.value for o in argv)
+
+
+def write_grammar(key, doc):
+    """ Build grammar data for a usage string, and try to cache it on disk.
+        The grammar is returned even if it could not be cached.
+    """
+    return cache.store('args').put_json(
+        '{}.json'.format(key),
+        build_grammar(doc),
+    )
@@ -0,0 +1,155 @@
+""" Zipapp bundles for New.
+    A bundle is a single executable zip file (see: `new --bundle FILE`) with
+    new.py, the plugins package, the makefile templates, a snapshot of the
+    config, and a manifest of plugin modules.
+
+    zipimport never writes bytecode, so without help every run from a zip
+    file (or a read-only install) compiles all of the plugin source again.
+    Bundles have a .pyc next to each .py file, which is where zipimport
+    looks for them. They are compiled with unchecked hashes, so they are
+    always used, no matter what timestamps the zip entries have.
+    The files are stored without compression, which makes them faster to
+    load.
+"""
+
+import io
+import json
+import os
+import py_compile
+import shutil
+import sys
+import tempfile
+
+# Bumped when the manifest format changes.
+MANIFEST_VERSION = 1
+# The manifest, relative to the bundle's plugins package.
+MANIFEST_NAME = 'bundle.json'
+
+# Files from the plugins directory that are not bundled.
+IGNORE_PATTERNS = ('__pycache__', '*.pyc', '*.pyo', '.*', MANIFEST_NAME)
+
+DEFAULT_INTERPRETER = '/usr/bin/env python3'
+
+MAIN_PY = """# New, bundled with `new --bundle`.
+import runpy
+
+runpy.run_module('new', run_name='__main__')
+"""
+
+
+def build_bundle(
+        filename, scriptfile, plugindir, config, modules,
+        interpreter=DEFAULT_INTERPRETER):
+    """ Build a zipapp bundle for New.
+        Arguments:
+            filename    : The bundle file to write (like: new.pyz).
+            scriptfile  : Path to new.py.
+            plugindir   : Path to the plugins package.
+            config      : Config to use in the bundle (a frozen snapshot).
+            modules     : Plugin module names to load from the bundle.
+            interpreter : The bundle's shebang interpreter.
+        Returns the bundle manifest.
+    """
+    # zipapp (and zipfile) are slow to import, and only needed here.
+    import zipapp
+
+    with tempfile.TemporaryDirectory(prefix='new-bundle-') as tmpdir:
+        shutil.copy2(scriptfile, os.path.join(tmpdir, 'new.py'))
+        shutil.copytree(
+            plugindir,
+            os.path.join(tmpdir, 'plugins'),
+            ignore=shutil.ignore_patterns(*IGNORE_PATTERNS),
+        )
+        with open(os.path.join(tmpdir, '__main__.py'), 'w') as f:
+            f.write(MAIN_PY)
+        with open(os.path.join(tmpdir, 'new.json'), 'w') as f:
+            json.dump(config, f, indent=4, sort_keys=True)
+
+        compiled = compile_tree(tmpdir)
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'cache_tag': sys.implementation.cache_tag,
+            'compiled': compiled,
+            'modules': list(modules),
+        }
+        manifestfile = os.path.join(tmpdir, 'plugins', MANIFEST_NAME)
+        with open(manifestfile, 'w') as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+
+        # Written next to the target, and moved into place when complete.
+        tmpfile = '{}.tmp{}'.format(filename, os.getpid())
+        try:
+            zipapp.create_archive(
+                tmpdir,
+                target=tmpfile,
+                interpreter=interpreter,
+                compressed=False,
+            )
+            os.replace(tmpfile, filename)
+        finally:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+    return manifest
+
+
+def bundle_archive():
+    """ Return the bundle's file path when running from a bundle,
+        or None when running from a normal install.
+    """
+    return getattr(__loader__, 'archive', None)
+
+
+def compile_tree(dirpath):
+    """ Compile every .py file in a directory tree to a .pyc file next to
+        it, with an unchecked hash, for zipimport.
+        Tracebacks use the file's path relative to `dirpath`.
+        Returns the number of files compiled.
+    """
+    compiled = 0
+    for root, _, filenames in os.walk(dirpath):
+        for filename in filenames:
+            if not filename.endswith('.py'):
+                continue
+            filepath = os.path.join(root, filename)
+            py_compile.compile(
+                filepath,
+                cfile='{}c'.format(filepath),
+                dfile=os.path.relpath(filepath, dirpath),
+                doraise=True,
+                invalidation_mode=(
+                    py_compile.PycInvalidationMode.UNCHECKED_HASH
+                ),
+            )
+            compiled += 1
+    return compiled
+
+
+def load_manifest():
+    """ Load the bundle manifest, when running from a bundle.
+        Returns None when not running from a bundle, or when the manifest
+        is missing or from an incompatible version.
+    """
+    archive = bundle_archive()
+    if archive is None:
+        return None
+    try:
+        data = __loader__.get_data(
+            os.path.join(archive, 'plugins', MANIFEST_NAME)
+        )
+        manifest = json.loads(data.decode('utf-8'))
+    except (EnvironmentError, ValueError):
+        return None
+    if manifest.get('version', None) != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def open_text(filename):
+    """ Like open(filename, 'r'), but files inside the bundle (when running
+        from one) can be read too.
+    """
+    archive = bundle_archive()
+    if archive and filename.startswith(archive + os.sep):
+        data = __loader__.get_data(filename)
+        return io.StringIO(data.decode('utf-8'))
+    return open(filename, 'r')
@@ -0,0 +1,365 @@
+""" On-disk cache for New and it's plugins.
+    Everything that New caches (argument grammars, completion data,
+    downloads) lives in one directory, $XDG_CACHE_HOME/new (or ~/.cache/new),
+    falling back to a .cache directory next to new.py when that is not
+    writable. The directory can also be set with plugins.cache.dir.
+
+    Each user of the cache gets it's own namespace (a subdirectory):
+        store = plugins.cache.store('myplugin')
+        data = store.get_json('key')
+        if data is None:
+            data = store.put_json('key', expensive_work())
+
+    Entries are written atomically, and reading an entry marks it as used,
+    so the least recently used entries are removed first when the cache
+    goes over it's size budget (plugins.cache.max_size_mb), after entries
+    that have not been used in plugins.cache.max_age_days are removed.
+    That happens automatically about once a day, or with `new --cache prune`.
+
+    Pinned namespaces (like 'completion', which the shell completion script
+    needs to find) are never pruned, and are only cleared by name.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+# Budget defaults, can be set in config under plugins.cache.
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_SIZE_MB = 100
+# Seconds between automatic prunes.
+AUTO_PRUNE_INTERVAL = 24 * 60 * 60
+# Marker file for the last prune, in the cache root.
+PRUNE_STAMP = '.pruned'
+# Namespaces that are not pruned, or cleared with the rest of the cache.
+PINNED_NAMESPACES = ('completion',)
+
+# Keys that can be used as file names as they are. Other keys are hashed.
+SAFE_KEY_PAT = re.compile(r'^[\w][\w.-]{0,127}$')
+
+
+def default_root():
+    """ Return the default cache directory, from XDG_CACHE_HOME. """
+    basedir = (
+        os.environ.get('XDG_CACHE_HOME', None) or
+        os.path.join(os.path.expanduser('~'), '.cache')
+    )
+    return os.path.join(basedir, 'new')
+
+
+def fallback_root():
+    """ Return the cache directory to use when the default is not
+        writable, next to new.py.
+    """
+    scriptdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(scriptdir, '.cache')
+
+
+def is_writable_dir(dirpath):
+    """ Return True if a directory exists (or can be created), and is
+        writable.
+    """
+    try:
+        os.makedirs(dirpath, exist_ok=True)
+    except EnvironmentError:
+        return False
+    return os.access(dirpath, os.W_OK | os.X_OK)
+
+
+class Cache(object):
+    """ The cache directory, with a store for each namespace. """
+
+    def __init__(self, root=None):
+        # A root set in config (or for tests), otherwise found on first use.
+        self.configured_root = root
+        self.resolved_root = None
+        self.max_age_days = DEFAULT_MAX_AGE_DAYS
+        self.max_size_mb = DEFAULT_MAX_SIZE_MB
+        self.pinned = set(PINNED_NAMESPACES)
+        # {namespace: CacheStore}
+        self.stores = {}
+
+    def clear(self, namespace=None):
+        """ Remove all entries (except pinned namespaces), or all entries
+            in one namespace.
+            Returns the number of files removed.
+        """
+        removed = 0
+        for entry in self.entries(namespace):
+            if remove_file(entry.path):
+                removed += 1
+        return removed
+
+    def configure(self, cacheconfig):
+        """ Set the cache directory and budgets from config
+            (plugins.cache).
+        """
+        cacheconfig = cacheconfig or {}
+        root = cacheconfig.get('dir', None)
+        self.configured_root = os.path.expanduser(root) if root else None
+        self.resolved_root = None
+        self.max_age_days = cacheconfig.get(
+            'max_age_days',
+            DEFAULT_MAX_AGE_DAYS,
+        )
+        self.max_size_mb = cacheconfig.get('max_size_mb', DEFAULT_MAX_SIZE_MB)
+
+    def entries(self, namespace=None, pinned=False):
+        """ Return a list of CacheEntry for every file in the cache, or in
+            one namespace. Entries in pinned namespaces are only included
+            when `pinned` is True, or their namespace is given.
+        """
+        if namespace is None:
+            dirpath = self.root
+        else:
+            dirpath = self.store(namespace).dirpath
+        entries = []
+        for parent, _, filenames in os.walk(dirpath):
+            for filename in filenames:
+                if parent == self.root:
+                    # Only the prune stamp lives here, not entries.
+                    continue
+                entry = CacheEntry.from_path(
+                    os.path.join(parent, filename),
+                    self.root,
+                )
+                if entry is None:
+                    continue
+                if (namespace is None) and (not pinned) and (
+                        entry.namespace in self.pinned):
+                    continue
+                entries.append(entry)
+        return entries
+
+    def maybe_prune(self):
+        """ Prune the cache if it has not been pruned for a while
+            (see: AUTO_PRUNE_INTERVAL).
+        """
+        stamp = os.path.join(self.root, PRUNE_STAMP)
+        try:
+            pruned = os.stat(stamp).st_mtime
+        except FileNotFoundError:
+            pruned = 0
+        except EnvironmentError:
+            return None
+        if (time.time() - pruned) < AUTO_PRUNE_INTERVAL:
+            return None
+        try:
+            with open(stamp, 'w'):
+                pass
+        except EnvironmentError:
+            return None
+        return self.prune()
+
+    def prune(self, max_size_mb=None, max_age_days=None):
+        """ Remove entries that were not used in `max_age_days`, and then
+            the least recently used entries until the cache fits in
+            `max_size_mb`. The configured budgets are used by default.
+            Pinned namespaces are not pruned, or counted in the budget.
+            Returns a list of removed CacheEntrys.
+        """
+        if max_size_mb is None:
+            max_size_mb = self.max_size_mb
+        if max_age_days is None:
+            max_age_days = self.max_age_days
+        entries = sorted(self.entries(), key=lambda e: e.used)
+        removed = []
+        if max_age_days is not None:
+            oldest = time.time() - (max_age_days * 24 * 60 * 60)
+            while entries and (entries[0].used < oldest):
+                entry = entries.pop(0)
+                if remove_file(entry.path):
+                    removed.append(entry)
+        if max_size_mb is not None:
+            maxsize = max_size_mb * 1024 * 1024
+            size = sum(e.size for e in entries)
+            while entries and (size > maxsize):
+                entry = entries.pop(0)
+                size -= entry.size
+                if remove_file(entry.path):
+                    removed.append(entry)
+        return removed
+
+    @property
+    def root(self):
+        """ The cache directory, found (and created) on first use. """
+        if self.configured_root:
+            return self.configured_root
+        if self.resolved_root is None:
+            root = default_root()
+            if not is_writable_dir(root):
+                fallback = fallback_root()
+                if is_writable_dir(fallback):
+                    root = fallback
+            self.resolved_root = root
+        return self.resolved_root
+
+    def stats(self):
+        """ Return a JSON-friendly dict of the cache's size and entries, by
+            namespace.
+        """
+        namespaces = {}
+        for entry in self.entries(pinned=True):
+            nsstats = namespaces.setdefault(
+                entry.namespace,
+                {'entries': 0, 'size': 0},
+            )
+            nsstats['entries'] += 1
+            nsstats['size'] += entry.size
+        return {
+            'root': self.root,
+            'entries': sum(s['entries'] for s in namespaces.values()),
+            'size': sum(s['size'] for s in namespaces.values()),
+            'max_size_mb': self.max_size_mb,
+            'max_age_days': self.max_age_days,
+            'namespaces': namespaces,
+        }
+
+    def store(self, namespace):
+        """ Return the CacheStore for a namespace. """
+        store = self.stores.get(namespace, None)
+        if store is None:
+            store = self.stores[namespace] = CacheStore(self, namespace)
+        return store
+
+
+class CacheEntry(object):
+    """ A file in the cache, with it's size and last-used time. """
+    __slots__ = ('path', 'namespace', 'size', 'used')
+
+    def __init__(self, path, namespace, size, used):
+        self.path = path
+        self.namespace = namespace
+        self.size = size
+        self.used = used
+
+    @classmethod
+    def from_path(cls, path, root):
+        """ Return a CacheEntry for a file, or None if it is gone. """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        namespace = os.path.relpath(path, root).split(os.sep)[0]
+        return cls(path, namespace, st.st_size, st.st_mtime)
+
+
+class CacheStore(object):
+    """ Entries for one namespace in the cache, by key.
+        Keys that are not safe file names are hashed.
+    """
+
+    def __init__(self, cache, namespace):
+        if not SAFE_KEY_PAT.match(namespace):
+            raise ValueError('Invalid cache namespace: {}'.format(namespace))
+        self.cache = cache
+        self.namespace = namespace
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    @property
+    def dirpath(self):
+        """ The directory for this namespace. """
+        return os.path.join(self.cache.root, self.namespace)
+
+    def get(self, key, binary=False):
+        """ Return an entry's content (str, or bytes for `binary`), and mark
+            it as used. Returns None if it is not cached.
+        """
+        filename = self.path(key)
+        try:
+            with open(filename, 'rb' if binary else 'r') as f:
+                content = f.read()
+        except (EnvironmentError, ValueError):
+            return None
+        self.touch(key)
+        return content
+
+    def get_json(self, key):
+        """ Return an entry's decoded JSON data, or None if it is not cached
+            (or not valid JSON).
+        """
+        content = self.get(key)
+        if content is None:
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return None
+
+    def makedirs(self):
+        """ Create the directory for this namespace, if needed.
+            Returns the directory path.
+        """
+        dirpath = self.dirpath
+        os.makedirs(dirpath, exist_ok=True)
+        return dirpath
+
+    def path(self, key):
+        """ Return the file path for a key. """
+        if not SAFE_KEY_PAT.match(key):
+            key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.dirpath, key)
+
+    def put(self, key, content):
+        """ Write an entry (str or bytes) atomically, replacing any entry
+            with the same key.
+            Returns the content, even if it could not be cached.
+        """
+        filename = self.path(key)
+        try:
+            self.makedirs()
+            fd, tmppath = tempfile.mkstemp(
+                prefix='.{}.'.format(os.path.basename(filename)),
+                suffix='.tmp',
+                dir=self.dirpath,
+            )
+            try:
+                binary = isinstance(content, bytes)
+                with os.fdopen(fd, 'wb' if binary else 'w') as f:
+                    f.write(content)
+                os.replace(tmppath, filename)
+            finally:
+                remove_file(tmppath)
+        except EnvironmentError:
+            # Another process is using the cache, or it is not writable.
+            return content
+        self.cache.maybe_prune()
+        return content
+
+    def put_json(self, key, data):
+        """ Write an entry as JSON. Returns the data. """
+        self.put(key, json.dumps(data))
+        return data
+
+    def remove(self, key):
+        """ Remove an entry. Returns True if it was removed. """
+        return remove_file(self.path(key))
+
+    def touch(self, key):
+        """ Mark an entry as used, for LRU eviction. """
+        try:
+            os.utime(self.path(key))
+        except EnvironmentError:
+            pass
+
+
+def remove_file(filename):
+    """ Remove a file, ignoring files that are already gone.
+        Returns True if the file was removed.
+    """
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        return False
+    except EnvironmentError:
+        return False
+    return True
+
+
+# The cache for New, configured when plugins are loaded.
+cache = Cache()
@@ -0,0 +1,35 @@
+""" Lazy colr imports for New.
+    colr takes longer to import than the rest of New's startup, and it is
+    only needed for colorized output (help, errors, status lines, debug
+    output), so it is imported on first use instead of with the plugins
+    package.
+"""
+
+import sys
+from importlib import import_module
+
+# Set once colr.auto_disable() has been called.
+auto_disabled = False
+
+
+def import_colr(modulename='colr'):
+    """ Import and return colr, or one of it's modules
+        (like 'colr.colr_docopt').
+        The first time, colors are disabled if stdout or stderr are not
+        terminals (see: colr.auto_disable()).
+    """
+    global auto_disabled
+    colr = import_module('colr')
+    if not auto_disabled:
+        colr.auto_disable()
+        auto_disabled = True
+    if modulename == 'colr':
+        return colr
+    return import_module(modulename)
+
+
+def is_imported(modulename='colr'):
+    """ Return True if colr (or one of it's modules) was already imported,
+        by New or anything else.
+    """
+    return modulename in sys.modules
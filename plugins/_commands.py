@@ -0,0 +1,123 @@
+""" Batched command running for New's post plugins.
+    Post plugins that run an external command on created files should pass
+    as many files as possible to each process (see: chunk_args), and run
+    independent commands side by side (see: run_commands), instead of
+    starting one process per file.
+"""
+
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Bytes left for anything else the kernel counts, when ARG_MAX is used.
+ARG_MARGIN = 4096
+# Used when ARG_MAX is not available.
+DEFAULT_ARG_MAX = 131072
+# Bytes for each argument's pointer in argv, on top of the string.
+ARG_POINTER_SIZE = 8
+
+
+class CommandResult(object):
+    """ The result of one command from run_commands(). """
+
+    def __init__(self, cmd, returncode=None, output=None, error=None):
+        self.cmd = cmd
+        # None if the command could not be started.
+        self.returncode = returncode
+        # Combined stdout/stderr.
+        self.output = output or ''
+        # The exception that kept the command from starting.
+        self.error = error
+
+    def __repr__(self):
+        return '{}(cmd={!r}, returncode={!r})'.format(
+            type(self).__name__,
+            self.cmd,
+            self.returncode,
+        )
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+
+def arg_max():
+    """ Return the maximum bytes available for command arguments, minus
+        the environment and a safety margin.
+    """
+    try:
+        maxbytes = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        maxbytes = -1
+    if maxbytes <= 0:
+        maxbytes = DEFAULT_ARG_MAX
+    envbytes = sum(
+        len(k) + len(v) + 2 + ARG_POINTER_SIZE
+        for k, v in os.environ.items()
+    )
+    return max(maxbytes - envbytes - ARG_MARGIN, ARG_MARGIN)
+
+
+def arg_size(arg):
+    """ Return the bytes an argument uses in argv. """
+    return len(os.fsencode(arg)) + 1 + ARG_POINTER_SIZE
+
+
+def chunk_args(cmd, args, maxbytes=None):
+    """ Split `args` into lists that fit in a command line after `cmd`.
+        Yields lists of args.
+    """
+    if maxbytes is None:
+        maxbytes = arg_max()
+    basesize = sum(arg_size(a) for a in cmd)
+    chunk = []
+    chunksize = basesize
+    for arg in args:
+        size = arg_size(arg)
+        if chunk and (chunksize + size > maxbytes):
+            yield chunk
+            chunk = []
+            chunksize = basesize
+        chunk.append(arg)
+        chunksize += size
+    if chunk:
+        yield chunk
+
+
+def run_command(cmd, cwd=None):
+    """ Run a single command, and return a CommandResult. """
+    try:
+        proc = subprocess.run(
+            cmd,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+    except EnvironmentError as ex:
+        return CommandResult(cmd, error=ex)
+    return CommandResult(
+        cmd,
+        returncode=proc.returncode,
+        output=proc.stdout.decode(errors='replace'),
+    )
+
+
+def run_commands(cmds, jobs=None, cwd=None):
+    """ Run commands with at most `jobs` processes at once.
+        Arguments:
+            cmds : An iterable of command lists.
+            jobs : Maximum number of processes to run at once.
+                   Default: os.cpu_count()
+            cwd  : Working directory for the commands.
+        Returns a list of CommandResults, in the same order as `cmds`.
+    """
+    cmds = list(cmds)
+    if not cmds:
+        return []
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(cmds)))
+    if jobs == 1:
+        return [run_command(cmd, cwd=cwd) for cmd in cmds]
+    # The processes do the work, the threads only wait for them.
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(lambda c: run_command(c, cwd=cwd), cmds))
@@ -0,0 +1,510 @@
+""" Shell completion for New.
+    Completing plugin names and options should not start Python (importing,
+    loading config, and loading plugins) on every key press, so New writes
+    what completion needs (plugin names, aliases, extensions, and each
+    plugin's options) to a small data file that the shell script sources.
+
+    The data file lists the files it was generated from (plugin modules,
+    new.json, new.py). When one of them is newer than the data file, the
+    completion script regenerates it in the background with
+    `new --completion SHELL`, and uses the old data until it is done.
+    A missing data file is regenerated before completing (at most once a
+    minute, if that fails).
+
+    The data file lives in the pinned 'completion' cache namespace, so it
+    is not removed when the cache is pruned (see: plugins._cache).
+"""
+
+import hashlib
+import os
+import re
+import shlex
+
+from ._cache import cache
+from ._files import write_file_atomic
+
+# Supported shells, and the extension for their data files.
+SHELLS = {
+    'bash': 'sh',
+    'fish': 'fish',
+    'zsh': 'sh',
+}
+
+# Options in a usage string, like: -h, --help, --timings.
+OPTION_PAT = re.compile(r'(?<![\w-])(--?[a-zA-Z][\w-]*)')
+
+# Shell code is templated with @NAME@ markers, to leave $, {} and % alone.
+BASH_SCRIPT = r"""
+# Bash completion for New (new --completion bash).
+_new_data=@DATAFILE@
+_new_regen=(@COMMAND@ --completion bash)
+_new_regen_at=-60
+
+_new_load() {
+    if [[ ! -r $_new_data ]]; then
+        # The data file was removed, write it again before using it.
+        (( SECONDS - _new_regen_at >= 60 )) || return 1
+        _new_regen_at=$SECONDS
+        "${_new_regen[@]}" >/dev/null 2>&1
+        [[ -r $_new_data ]] || return 1
+    fi
+    source "$_new_data"
+    local src
+    for src in "${_new_sources[@]}"; do
+        if [[ $src -nt $_new_data ]]; then
+            if (( SECONDS - _new_regen_at >= 60 )); then
+                _new_regen_at=$SECONDS
+                ( "${_new_regen[@]}" >/dev/null 2>&1 & )
+            fi
+            break
+        fi
+    done
+    return 0
+}
+
+_new_complete() {
+    local cur=${COMP_WORDS[COMP_CWORD]}
+    local prev=${COMP_WORDS[COMP_CWORD-1]}
+    COMPREPLY=()
+    _new_load || return 0
+    local i word plugin='' args=0 npos=0
+    for (( i=1; i < COMP_CWORD; i++ )); do
+        word=${COMP_WORDS[i]}
+        if [[ $word == -- ]]; then
+            args=1
+            continue
+        fi
+        (( args )) && continue
+        [[ $word == -* ]] && continue
+        (( npos++ ))
+        [[ -n $plugin ]] && continue
+        _new_reply=''
+        (( npos == 1 )) && _new_plugin_name "$word"
+        [[ -z $_new_reply && $word == *.* ]] && \
+            _new_plugin_byext ".${word##*.}"
+        plugin=$_new_reply
+    done
+    case $prev in
+        --completion)
+            COMPREPLY=($(compgen -W 'bash fish zsh' -- "$cur"))
+            return 0
+            ;;
+        --profile|--trace)
+            return 0
+            ;;
+    esac
+    if [[ $cur == -* ]]; then
+        if (( args )); then
+            _new_reply=''
+            [[ -n $plugin ]] && _new_plugin_opts "$plugin"
+        else
+            _new_reply=$_new_opts
+        fi
+        COMPREPLY=($(compgen -W "$_new_reply" -- "$cur"))
+        return 0
+    fi
+    (( args )) && return 0
+    compopt -o filenames 2>/dev/null
+    if (( npos == 0 )); then
+        COMPREPLY=($(compgen -W "$_new_plugins" -- "$cur"))
+    fi
+    if [[ $cur == ?*.* && $cur != */ ]]; then
+        local ext
+        for ext in $_new_exts; do
+            [[ ${cur%.*}$ext == "$cur"* ]] && COMPREPLY+=("${cur%.*}$ext")
+        done
+    fi
+    COMPREPLY+=($(compgen -f -- "$cur"))
+    return 0
+}
+
+complete -o bashdefault -o default -F _new_complete @NAMES@
+"""
+
+FISH_SCRIPT = r"""
+# Fish completion for New (new --completion fish), needs fish 3.5+.
+set -g __new_data @DATAFILE@
+set -g __new_regen_at 0
+
+function __new_load
+    if not test -r $__new_data
+        # The data file was removed, write it again before using it.
+        set -l now (date +%s)
+        test (math $now - $__new_regen_at) -ge 60; or return 1
+        set -g __new_regen_at $now
+        @COMMAND@ --completion fish >/dev/null 2>&1
+        test -r $__new_data; or return 1
+    end
+    source $__new_data
+    set -l datatime (path mtime -- $__new_data)
+    for src in $__new_sources
+        set -l srctime (path mtime -- $src)
+        test -n "$srctime"; or continue
+        if test $srctime -gt $datatime
+            set -l now (date +%s)
+            if test (math $now - $__new_regen_at) -ge 60
+                set -g __new_regen_at $now
+                @COMMAND@ --completion fish >/dev/null 2>&1 &
+                disown
+            end
+            break
+        end
+    end
+end
+
+function __new_complete
+    __new_load; or return
+    set -l tokens (commandline -opc)
+    set -l cur (commandline -ct)
+    set -l plugin ''
+    set -l args 0
+    set -l npos 0
+    for word in $tokens[2..-1]
+        if test "$word" = '--'
+            set args 1
+            continue
+        end
+        test $args -eq 1; and continue
+        string match -q -- '-*' $word; and continue
+        set npos (math $npos + 1)
+        test -n "$plugin"; and continue
+        if test $npos -eq 1
+            set plugin (__new_plugin_name $word)
+        end
+        if test -z "$plugin"
+            set -l ext (string match -r -- '\.[^.]*$' $word)
+            and set plugin (__new_plugin_byext $ext)
+        end
+    end
+    switch "$tokens[-1]"
+        case --completion
+            printf '%s\n' bash fish zsh
+            return
+        case --profile --trace
+            __fish_complete_path $cur
+            return
+    end
+    if string match -q -- '-*' $cur
+        if test $args -eq 1
+            test -n "$plugin"; and __new_plugin_opts $plugin
+        else
+            printf '%s\n' $__new_opts
+        end
+        return
+    end
+    test $args -eq 1; and return
+    test $npos -eq 0; and printf '%s\n' $__new_plugins
+    if string match -q -r -- '^[^/]+\.[^/]*$' $cur
+        set -l base (string replace -r -- '\.[^.]*$' '' $cur)
+        printf "$base%s\n" $__new_exts
+    end
+    __fish_complete_path $cur
+end
+
+for name in @NAMES@
+    complete -c $name -e
+    complete -c $name -f -a '(__new_complete)'
+end
+"""
+
+ZSH_SCRIPT = r"""
+# Zsh completion for New (new --completion zsh).
+_new_data=@DATAFILE@
+_new_regen=(@COMMAND@ --completion zsh)
+_new_regen_at=-60
+
+_new_load() {
+    if [[ ! -r $_new_data ]]; then
+        # The data file was removed, write it again before using it.
+        (( SECONDS - _new_regen_at >= 60 )) || return 1
+        _new_regen_at=$SECONDS
+        "${_new_regen[@]}" >/dev/null 2>&1
+        [[ -r $_new_data ]] || return 1
+    fi
+    source "$_new_data"
+    local src
+    for src in "${_new_sources[@]}"; do
+        if [[ $src -nt $_new_data ]]; then
+            if (( SECONDS - _new_regen_at >= 60 )); then
+                _new_regen_at=$SECONDS
+                ( "${_new_regen[@]}" >/dev/null 2>&1 & )
+            fi
+            break
+        fi
+    done
+    return 0
+}
+
+_new() {
+    _new_load || return 1
+    local i word plugin='' args=0 npos=0
+    for (( i=2; i < CURRENT; i++ )); do
+        word=${words[i]}
+        if [[ $word == -- ]]; then
+            args=1
+            continue
+        fi
+        (( args )) && continue
+        [[ $word == -* ]] && continue
+        (( npos++ ))
+        [[ -n $plugin ]] && continue
+        _new_reply=''
+        (( npos == 1 )) && _new_plugin_name "$word"
+        [[ -z $_new_reply && $word == *.* ]] && \
+            _new_plugin_byext ".${word##*.}"
+        plugin=$_new_reply
+    done
+    case ${words[CURRENT-1]} in
+        --completion)
+            compadd -- bash fish zsh
+            return
+            ;;
+        --profile|--trace)
+            _files
+            return
+            ;;
+    esac
+    if [[ $PREFIX == -* ]]; then
+        if (( args )); then
+            _new_reply=''
+            [[ -n $plugin ]] && _new_plugin_opts "$plugin"
+        else
+            _new_reply=$_new_opts
+        fi
+        compadd -- ${=_new_reply}
+        return
+    fi
+    (( args )) && return
+    (( npos == 0 )) && compadd -- ${=_new_plugins}
+    if [[ $PREFIX == ?*.* && $PREFIX != */* ]]; then
+        local -a exts
+        exts=(${=_new_exts})
+        compadd -- ${PREFIX%.*}${^exts}
+    fi
+    _files
+}
+
+compdef _new @NAMES@
+"""
+
+SCRIPTS = {
+    'bash': BASH_SCRIPT,
+    'fish': FISH_SCRIPT,
+    'zsh': ZSH_SCRIPT,
+}
+
+
+def completion_data(pluginsets, usage):
+    """ Gather what shell completion needs from loaded plugins.
+        Arguments:
+            pluginsets : The loaded plugins (see: plugins.load_plugins()).
+            usage      : New's usage string, for it's own options.
+        Returns a dict with:
+            options        : New's options.
+            plugins        : {plugin_name: [name_or_alias, ..]}
+            extensions     : {extension: plugin_name}
+            plugin_options : {plugin_name: [option, ..]}
+    """
+    data = {
+        'options': usage_options(usage),
+        'plugins': {},
+        'extensions': {},
+        'plugin_options': {},
+    }
+    custom = pluginsets.get('custom', {})
+    for name in sorted(custom):
+        data['plugins'][name] = list(custom.get_names(name))
+    for name in sorted(pluginsets['types']):
+        plugincls = pluginsets['types'][name]
+        pluginname = plugincls.get_name()
+        data['plugins'][pluginname] = list(plugincls.name)
+        for ext in plugincls.extensions or ():
+            data['extensions'].setdefault(ext.lower(), pluginname)
+        opts = usage_options(plugincls.get_usage())
+        if opts:
+            data['plugin_options'][pluginname] = opts
+    for ptype in ('post', 'deferred'):
+        for plugincls in pluginsets[ptype].values():
+            pluginname = plugincls.get_name()
+            data['plugins'][pluginname] = [pluginname]
+            opts = usage_options(plugincls.get_usage())
+            if opts:
+                data['plugin_options'][pluginname] = opts
+    return data
+
+
+def completion_script(shell, datafile, command, names):
+    """ Render the completion script for a shell.
+        Arguments:
+            shell    : Shell name (see: SHELLS).
+            datafile : Path to the data file the script sources.
+            command  : Command (list of arguments) that runs new.py, for
+                       regenerating the data file.
+            names    : Command names to complete (like: new, new.py).
+    """
+    script = SCRIPTS[shell].lstrip('\n')
+    quote = quote_fish if shell == 'fish' else shlex.quote
+    replacements = {
+        '@COMMAND@': ' '.join(quote(arg) for arg in command),
+        '@DATAFILE@': quote(datafile),
+        '@NAMES@': ' '.join(quote(name) for name in names),
+    }
+    for marker, value in replacements.items():
+        script = script.replace(marker, value)
+    return script
+
+
+def completion_data_file(shell, scriptdir):
+    """ Return the data file path for a shell and a New installation,
+        in the pinned 'completion' cache namespace (see: plugins._cache).
+    """
+    key = hashlib.sha1(scriptdir.encode('utf-8')).hexdigest()[:12]
+    return cache.store('completion').path(
+        '{}.{}'.format(key, SHELLS[shell])
+    )
+
+
+def completion_sources(plugindir, *filenames):
+    """ Return the files that completion data is generated from: the plugin
+        directory, it's files, and any other files given (like new.json).
+    """
+    sources = [plugindir]
+    try:
+        names = sorted(os.listdir(plugindir))
+    except EnvironmentError:
+        names = []
+    sources.extend(
+        os.path.join(plugindir, name)
+        for name in names
+        if name.endswith('.py')
+    )
+    sources.extend(filenames)
+    return sources
+
+
+def quote_fish(s):
+    """ Quote a string for fish. """
+    return "'{}'".format(s.replace('\\', '\\\\').replace("'", "\\'"))
+
+
+def render_data(shell, data, sources):
+    """ Render completion data as a file that the shell can source. """
+    if shell == 'fish':
+        return render_data_fish(data, sources)
+    return render_data_sh(data, sources)
+
+
+def render_data_fish(data, sources):
+    """ Render completion data for fish. """
+    q = quote_fish
+    lines = [
+        '# Generated by `new --completion fish`, do not edit.',
+        'set -g __new_sources -- {}'.format(' '.join(q(s) for s in sources)),
+        'set -g __new_opts -- {}'.format(' '.join(data['options'])),
+        'set -g __new_plugins -- {}'.format(' '.join(
+            q(name)
+            for names in data['plugins'].values()
+            for name in names
+        )),
+        'set -g __new_exts -- {}'.format(
+            ' '.join(q(ext) for ext in data['extensions'])
+        ),
+        '',
+        'function __new_plugin_name',
+        '    switch $argv[1]',
+    ]
+    for pluginname, names in data['plugins'].items():
+        lines.append('        case {}'.format(' '.join(q(n) for n in names)))
+        lines.append('            echo {}'.format(q(pluginname)))
+    lines.extend(('    end', 'end', '', 'function __new_plugin_byext'))
+    lines.append('    switch $argv[1]')
+    for ext, pluginname in data['extensions'].items():
+        lines.append('        case {}'.format(q(ext)))
+        lines.append('            echo {}'.format(q(pluginname)))
+    lines.extend(('    end', 'end', '', 'function __new_plugin_opts'))
+    lines.append('    switch $argv[1]')
+    for pluginname, opts in data['plugin_options'].items():
+        lines.append('        case {}'.format(' '.join(
+            q(name)
+            for name in data['plugins'].get(pluginname, [pluginname])
+        )))
+        lines.append("            printf '%s\\n' {}".format(' '.join(opts)))
+    lines.extend(('    end', 'end', ''))
+    return '\n'.join(lines)
+
+
+def render_data_sh(data, sources):
+    """ Render completion data for bash and zsh.
+        Lookups are `case` statements, which work the same in both shells.
+        Each lookup function sets $_new_reply.
+    """
+    q = shlex.quote
+    lines = [
+        '# Generated by `new --completion`, do not edit.',
+        '_new_sources=({})'.format(' '.join(q(s) for s in sources)),
+        '_new_opts={}'.format(q(' '.join(data['options']))),
+        '_new_plugins={}'.format(q(' '.join(
+            name
+            for names in data['plugins'].values()
+            for name in names
+        ))),
+        '_new_exts={}'.format(q(' '.join(data['extensions']))),
+        '',
+        '_new_plugin_name() {',
+        '    case "$1" in',
+    ]
+    for pluginname, names in data['plugins'].items():
+        lines.append('        {}) _new_reply={};;'.format(
+            '|'.join(q(n) for n in names),
+            q(pluginname),
+        ))
+    lines.extend(('    esac', '}', '', '_new_plugin_byext() {'))
+    lines.append('    case "$1" in')
+    for ext, pluginname in data['extensions'].items():
+        lines.append('        {}) _new_reply={};;'.format(
+            q(ext),
+            q(pluginname),
+        ))
+    lines.extend(('    esac', '}', '', '_new_plugin_opts() {'))
+    lines.append('    case "$1" in')
+    for pluginname, opts in data['plugin_options'].items():
+        lines.append('        {}) _new_reply={};;'.format(
+            '|'.join(
+                q(name)
+                for name in data['plugins'].get(pluginname, [pluginname])
+            ),
+            q(' '.join(opts)),
+        ))
+    lines.extend(('    esac', '}', ''))
+    return '\n'.join(lines)
+
+
+def usage_options(usage):
+    """ Return the options (-h, --help, ..) in a usage string, in order.
+        Old-style usage dicts ({'usage': [..], 'options': [..]}) are
+        supported too.
+    """
+    if not usage:
+        return []
+    if isinstance(usage, dict):
+        usage = '\n'.join(
+            list(usage.get('usage', [])) + list(usage.get('options', []))
+        )
+    opts = []
+    for opt in OPTION_PAT.findall(usage):
+        if opt not in opts:
+            opts.append(opt)
+    return opts
+
+
+def write_completion_data(shell, data, sources, filename):
+    """ Write completion data for a shell to a file, atomically, so a
+        completion that is running never sources a half-written file.
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    write_file_atomic(
+        filename,
+        render_data(shell, data, sources),
+        overwrite=True,
+    )
+    return filename
@@ -0,0 +1,265 @@
+""" Custom plugins for New, from the 'custom' config (see: CustomPlugins).
+    The plugin classes are created the first time a custom plugin is used,
+    so this module is only imported then, after the plugins package is
+    loaded.
+"""
+
+import json
+import os
+
+from . import (
+    Plugin,
+    SignalExit,
+    SkeletonPlugin,
+    bad_tags_exit,
+    get_template_tags,
+    print_err,
+)
+from ._template import TemplateFormatter
+
+
+def create_custom_plugin(names, info):  # noqa (too complex, I know.)
+    """ Creates a CustomPlugin from user config.
+        Returns an uninstantiated CustomPlugin class.
+
+        Arguments:
+            name  : Plugin name from config, a key in custom config.
+            info  : Plugin info
+    """
+    if not names:
+        raise ValueError('Custom plugin is missing a name.')
+    name = names[0].lower()
+    if not name:
+        raise ValueError('Custom plugin is missing a name.')
+
+    if not info:
+        raise ValueError('No info for custom plugin: {}'.format(name))
+    filename = info.get('filename', None)
+    content_raw = info.get('content', None)
+    if not (filename or content_raw):
+        # No file name or content.
+        raise ValueError(
+            '\n'.join((
+                'Custom plugin is not configured correctly: {}',
+                'No \'filename\' or \'content\' set.'
+            )).format(name)
+        )
+    elif (filename and content_raw):
+        # Both file name and content.
+        raise ValueError(
+            '\n'.join((
+                'Custom plugin is not configured correctly: {}',
+                'Either \'filename\' or \'content\' can be set, not both.'
+            )).format(name)
+        )
+    # Allow for multiline content, using arrays/lists.
+    if isinstance(content_raw, list):
+        content_str = '\n'.join(content_raw)
+    elif content_raw:
+        content_str = str(content_raw)
+    else:
+        content_str = None
+
+    # Allow for expanded user paths.
+    if filename and not os.path.exists(filename):
+        filename = os.path.expanduser(filename)
+    if filename and os.path.isdir(filename):
+        # A whole directory, copied as a project skeleton.
+        return create_skeleton_plugin(names, info, filename)
+
+    # Create a CustomPlugin class that is local to this function,
+    # so that each custom plugin class is 'unique'.
+    class CustomPlugin(Plugin):
+        # Extensions are not searched for custom plugins.
+        extensions = None
+        # Any extension is allowed to be used.
+        any_extension = True
+        # CustomPlugins are marked with this attribute.
+        is_custom = True
+        # Attributes set by config.
+        name = names
+        input_file = filename
+        input_content = content_str
+        # Config values that don't matter as much.
+        description = info.get('description', None)
+        formatted = info.get('formatted', False)
+        allow_bad_tags = info.get('allow_bad_tags', False)
+        ignore_post = info.get('ignore_post', None)
+        ignore_deferred = info.get('ignore_deferred', None)
+        ignore_transform = info.get('ignore_transform', None)
+        private = info.get('private', False)
+
+        def config_dump(self, _raw_config=info):
+            """ Overloaded config_dump for custom plugins. """
+            # Custom plugins have a file name, or content, and a description.
+            # There is not much 'config' to them.
+            if not _raw_config:
+                # This only happens if a user calls config_dump() incorrectly.
+                print_err('_raw_config should already be set by default!')
+                print('No config for: {}'.format(self.get_name().title()))
+                return False
+
+            conf = {self.get_name(): _raw_config}
+            try:
+                configstr = json.dumps(conf, sort_keys=True, indent=4)
+            except TypeError as ex:
+                print_err('Config has non-str keys!\n  {}'.format(ex))
+                configstr = json.dumps(conf, indent=4)
+            print(configstr)
+            return True
+
+        def create(self, filename):
+            """ Creates a file based on user configuration. """
+            if self.input_content:
+                # Content based.
+                content = self.input_content
+                self.debug('Custom content used: {}'.format(
+                    self.format_content_preview()
+                ))
+            elif self.input_file:
+                # File-based.
+                try:
+                    with open(self.input_file, 'r') as f:
+                        content = f.read()
+                except EnvironmentError as ex:
+                    raise SignalExit(
+                        'Failed to read custom file: {}\n{}'.format(
+                            self.input_file,
+                            ex
+                        ),
+                        code=1
+                    )
+                else:
+                    self.debug('Custom content loaded: {}'.format(
+                        self.input_file
+                    ))
+            else:
+                msg = 'No file name or content to work with.'
+                self.debug(msg)
+                raise SignalExit(msg)
+
+            if self.formatted:
+                return self.format_content(content)
+            # Simple file/content-copy, no formatting needed.
+            return content
+
+        def format_content(self, content):
+            """ Return the formatted content from this plugin's file/config.
+                Unknown tags are left as they are if `allow_bad_tags` is
+                set, otherwise they are all reported in a SignalExit.
+            """
+            contentfmt, badtags = TemplateFormatter().render(
+                content,
+                self.get_format_args(),
+            )
+            for tagname, linenum, column in badtags:
+                self.debug('Unknown format tag: {{{}}} ({}:{})'.format(
+                    tagname,
+                    linenum,
+                    column,
+                ))
+            if badtags and not self.allow_bad_tags:
+                raise self.make_tag_exception(badtags)
+            return contentfmt
+
+        def format_content_preview(self, max_length=40):
+            """ Get a preview of self.input_content, if it exists.
+                Otherwise returns an empty string.
+            """
+            if not self.input_content:
+                return ''
+            if len(self.input_content) < max_length:
+                return repr(self.input_content)
+            return repr('{}...'.format(self.input_content[:max_length]))
+
+        def get_format_args(self):
+            """ Return a mapping of known format tags, for format_content().
+                See: get_template_tags()
+            """
+            return get_template_tags()
+
+        def help(self):
+            """ Overloaded help() for custom plugins. """
+            name = self.get_name()
+            print('\nHelp for custom New plugin, {}:\n'.format(name))
+            desc = self.get_desc()
+            if desc:
+                print('Description:\n{}'.format(desc))
+            else:
+                print('(no description available)')
+            filename = getattr(self, 'input_file', None)
+            content = getattr(self, 'input_content', None)
+            if filename:
+                print('\nBased on: {}'.format(filename))
+                if not os.path.exists(filename):
+                    print('          This path does not exist!')
+            elif content:
+                print('\nBased on content:\n  {}'.format(
+                    self.format_content_preview(max_length=77)
+                ))
+
+        def make_tag_exception(self, badtags):
+            """ Create a SignalExit to be used when bad format tags are found
+                in the content.
+                Arguments:
+                    badtags : A list of (tag_name, line, column) from
+                              TemplateFormatter.render().
+            """
+            if self.input_file:
+                # Use file name, not content.
+                pluginid = 'file, {}'.format(self.input_file)
+            elif self.input_content:
+                # Use content preview.
+                pluginid = 'content'
+            else:
+                msg = 'No file name or content to work with.'
+                self.debug(msg)
+                raise ValueError(msg)
+            return bad_tags_exit(
+                self.get_name(),
+                pluginid,
+                badtags,
+                preview=self.format_content_preview(),
+            )
+    return CustomPlugin
+
+
+def create_skeleton_plugin(names, info, skeletondir):
+    """ Creates a SkeletonPlugin from user config, for a custom plugin with
+        a directory as it's 'filename'.
+        Returns an uninstantiated SkeletonPlugin class.
+
+        Arguments:
+            names       : Plugin name and aliases from config.
+            info        : Plugin info
+            skeletondir : The expanded skeleton directory.
+    """
+    templates = info.get('templates', None) or []
+    if isinstance(templates, str):
+        templates = [templates]
+
+    class CustomSkeletonPlugin(SkeletonPlugin):
+        # CustomPlugins are marked with this attribute.
+        is_custom = True
+        # Attributes set by config.
+        name = names
+        skeleton_dir = skeletondir
+        template_globs = tuple(templates)
+        # Config values that don't matter as much.
+        description = info.get('description', None)
+        allow_bad_tags = info.get('allow_bad_tags', False)
+        ignore_post = set(info.get('ignore_post', None) or {'chmodx'})
+        ignore_deferred = set(info.get('ignore_deferred', None) or {'open'})
+        ignore_transform = set(info.get('ignore_transform', None) or ())
+        private = info.get('private', False)
+
+        def config_dump(self, _raw_config=info):
+            """ Overloaded config_dump for skeleton plugins. """
+            print(json.dumps(
+                {self.get_name(): _raw_config},
+                sort_keys=True,
+                indent=4,
+            ))
+            return True
+
+    return CustomSkeletonPlugin
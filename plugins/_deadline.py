@@ -0,0 +1,97 @@
+""" Time limits for post plugins in New.
+    Each post plugin can have a timeout in it's config ("timeout": seconds,
+    or in plugins.global for all of them), and all post-processing in a run
+    can be limited with plugins.post_budget.
+
+    Plugins that run too long are interrupted with SIGALRM (see: deadline()),
+    which also breaks out of blocking socket reads, like a stalled download.
+    That needs signal.setitimer() and the main thread, otherwise limits are
+    not enforced. Commands that a plugin runs in worker threads are not
+    interrupted, only the wait for them is.
+"""
+
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PluginTimeout(BaseException):
+    """ Raised in a post plugin that runs past it's time limit.
+        This is a BaseException, so it is not caught by plugin code that
+        handles every Exception and keeps going.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __str__(self):
+        return 'Timed out after {:.3g}s.'.format(self.seconds)
+
+
+class TimeBudget(object):
+    """ Time used by post plugins in a run, for plugins.post_budget. """
+
+    def __init__(self):
+        self.used = 0.0
+
+    def add(self, seconds):
+        """ Add time (in seconds) that was used by a post plugin. """
+        self.used += seconds
+
+    def clear(self):
+        """ Forget all used time, like when plugins are reloaded. """
+        self.used = 0.0
+
+    def limit(self, total, timeout=None):
+        """ Return the time limit for the next post plugin, which is the
+            smaller of `timeout` and the time left in `total`.
+            Returns None when there is no limit, and 0 when the budget is
+            used up.
+        """
+        if not total:
+            return timeout or None
+        remaining = max(total - self.used, 0)
+        if not timeout:
+            return remaining
+        return min(timeout, remaining)
+
+
+def can_interrupt():
+    """ Return True if deadline() can interrupt code on this platform and
+        thread.
+    """
+    return (
+        hasattr(signal, 'setitimer') and
+        (threading.current_thread() is threading.main_thread())
+    )
+
+
+@contextmanager
+def deadline(seconds):
+    """ Raise PluginTimeout inside the block if it runs for more than
+        `seconds`. None (or 0) means no limit.
+        The previous SIGALRM handler and timer are restored afterwards.
+    """
+    if not (seconds and can_interrupt()):
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise PluginTimeout(seconds)
+
+    oldhandler = signal.signal(signal.SIGALRM, on_alarm)
+    olddelay, _ = signal.setitimer(signal.ITIMER_REAL, seconds)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, oldhandler)
+        if olddelay:
+            # Restart an outer timer, minus the time that was spent here.
+            elapsed = time.perf_counter() - started
+            signal.setitimer(
+                signal.ITIMER_REAL,
+                max(olddelay - elapsed, 0.001),
+            )
@@ -0,0 +1,59 @@
+""" Debug printing for New.
+    printdebug (and colr, which it uses) take longer to import than the
+    rest of New's startup, and debug output is off for normal runs, so
+    the DebugColrPrinter is only created when debug output is enabled,
+    or one of it's other methods is used.
+    Calls to debug() are ignored without importing anything while debug
+    output is disabled.
+"""
+
+from ._colors import import_colr
+
+
+class LazyDebugPrinter(object):
+    """ A stand-in for printdebug.DebugColrPrinter that creates the real
+        printer on first use.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.printer = None
+
+    def __getattr__(self, name):
+        # Anything else (debug_err, debug_json, ..) uses the real printer.
+        return getattr(self.get_printer(), name)
+
+    def debug(self, *args, **kwargs):
+        """ Print a debug message with file, line, and function info,
+            if debug output is enabled.
+        """
+        if not self.enabled:
+            return None
+        # Account for this call, the line info is from the caller.
+        kwargs['level'] = kwargs.get('level', 0) + 1
+        return self.get_printer().debug(*args, **kwargs)
+
+    def disable(self, disabled=True):
+        """ Disable debug output. """
+        self.enable(not disabled)
+
+    def enable(self, enabled=True):
+        """ Enable (or disable) debug output. The real printer is created
+            when debug output is first enabled.
+        """
+        self.enabled = bool(enabled)
+        if self.enabled or (self.printer is not None):
+            self.get_printer().enable(self.enabled)
+
+    def get_printer(self):
+        """ Return the DebugColrPrinter, creating it on first use. """
+        if self.printer is None:
+            import_colr()
+            from printdebug import DebugColrPrinter
+            self.printer = DebugColrPrinter()
+            self.printer.enable(self.enabled)
+        return self.printer
+
+
+# The debug printer for New and it's plugins, enabled with --debug.
+debugprinter = LazyDebugPrinter()
@@ -0,0 +1,222 @@
+""" File downloads for New's plugins.
+    Downloads are written to a partial file next to the destination
+    (<dest>.part), and only renamed to the destination when they are
+    complete (and verified), so an existing destination file is never a
+    partial download.
+
+    A partial file that is left behind (a timeout, a lost connection) is
+    resumed with an HTTP Range request next time. Servers that don't
+    support ranges send the whole file again, which replaces it.
+
+    Downloads can be verified with Subresource Integrity strings
+    ("sha384-<base64 digest>", space-separated for more than one).
+"""
+
+import base64
+import hashlib
+import http.client
+import os
+import time
+from urllib import request
+from urllib.error import HTTPError
+
+# Seconds to wait for the server on each connection/read.
+DEFAULT_TIMEOUT = 30
+# Bytes to read at a time.
+CHUNK_SIZE = 65536
+# Extension for partial downloads.
+PARTIAL_EXT = '.part'
+# Minimum seconds between progress reports.
+REPORT_INTERVAL = 0.2
+# Hash algorithms that can be used for integrity strings (like SRI).
+INTEGRITY_ALGORITHMS = ('sha256', 'sha384', 'sha512')
+
+
+class DownloadError(Exception):
+    """ Raised when a file can't be downloaded. """
+
+    def __init__(self, url, msg=None):
+        self.url = url
+        self.msg = msg
+
+    def __str__(self):
+        if not self.msg:
+            return 'Unable to download: {}'.format(self.url)
+        return 'Unable to download: {}\n    {}'.format(self.url, self.msg)
+
+
+class IntegrityError(DownloadError):
+    """ Raised when a downloaded file does not match it's integrity string.
+    """
+    pass
+
+
+def check_integrity(filename, integrity):
+    """ Return True if a file's content matches an integrity string.
+        Raises ValueError for bad integrity strings.
+    """
+    hashers = integrity_hashers(integrity)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            for hasher, _ in hashers:
+                hasher.update(chunk)
+    return integrity_matches(hashers)
+
+
+def download_file(
+        url, dest, integrity=None, timeout=DEFAULT_TIMEOUT, reporter=None,
+        report_interval=REPORT_INTERVAL):
+    """ Download a url to a file, resuming a partial download if one exists.
+        Arguments:
+            url             : The url to download.
+            dest            : The destination file path.
+            integrity       : An integrity string to verify the download
+                              with (like: 'sha384-<base64>'), or None.
+            timeout         : Seconds to wait on each connection/read.
+            reporter        : A function to call with
+                              (bytes_read, total_bytes) while downloading.
+                              total_bytes is None when it is not known.
+            report_interval : Minimum seconds between reporter() calls.
+                              It is always called once at the end.
+        Returns `dest`.
+        Raises DownloadError, or IntegrityError for a bad download (the
+        partial file is removed, so the next try starts over).
+    """
+    hashers = integrity_hashers(integrity) if integrity else []
+    partial = '{}{}'.format(dest, PARTIAL_EXT)
+    offset = 0
+    if os.path.exists(partial):
+        offset = os.path.getsize(partial)
+        if hashers:
+            with open(partial, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    for hasher, _ in hashers:
+                        hasher.update(chunk)
+
+    req = request.Request(url)
+    if offset:
+        req.add_header('Range', 'bytes={}-'.format(offset))
+    try:
+        resp = request.urlopen(req, timeout=timeout)
+    except HTTPError as ex:
+        if (ex.code != 416) or not offset:
+            raise DownloadError(url, ex)
+        # The range starts at the end, the partial file is complete.
+        resp = None
+    except (EnvironmentError, ValueError) as ex:
+        raise DownloadError(url, ex)
+
+    if resp is not None:
+        with resp:
+            if offset and (resp.status != 206):
+                # No range support, the whole file is being sent again.
+                offset = 0
+                hashers = integrity_hashers(integrity) if integrity else []
+            total = response_size(resp, offset)
+            try:
+                readtotal = read_response(
+                    resp,
+                    partial,
+                    offset,
+                    hashers,
+                    reporter=reporter,
+                    total=total,
+                    report_interval=report_interval,
+                )
+            except (EnvironmentError, http.client.HTTPException) as ex:
+                # Timeouts, lost connections, and incomplete reads.
+                # The partial file is kept, to resume next time.
+                raise DownloadError(url, ex)
+            if (total is not None) and (readtotal < total):
+                raise DownloadError(
+                    url,
+                    'Incomplete download, {} of {} bytes.'.format(
+                        readtotal,
+                        total,
+                    ),
+                )
+
+    if hashers and not integrity_matches(hashers):
+        os.remove(partial)
+        raise IntegrityError(
+            url,
+            'Download does not match the integrity string: {}'.format(
+                integrity
+            ),
+        )
+    os.replace(partial, dest)
+    return dest
+
+
+def integrity_hashers(integrity):
+    """ Return a list of (hasher, expected_digest) for an integrity string.
+        Raises ValueError for bad integrity strings.
+    """
+    hashers = []
+    for item in integrity.split():
+        algo, _, digest = item.partition('-')
+        algo = algo.lower()
+        if (algo not in INTEGRITY_ALGORITHMS) or not digest:
+            raise ValueError('Invalid integrity string: {}'.format(item))
+        # SRI strings may have options after the digest (sha384-xxx?opt).
+        digest = digest.partition('?')[0]
+        try:
+            expected = base64.b64decode(digest, validate=True)
+        except ValueError as ex:
+            raise ValueError(
+                'Invalid integrity digest: {}\n    {}'.format(item, ex)
+            )
+        hashers.append((hashlib.new(algo), expected))
+    if not hashers:
+        raise ValueError('Empty integrity string.')
+    return hashers
+
+
+def integrity_matches(hashers):
+    """ Return True if any hasher from integrity_hashers() matches it's
+        expected digest (like SRI, where any listed hash may match).
+    """
+    return any(
+        hasher.digest() == expected
+        for hasher, expected in hashers
+    )
+
+
+def read_response(
+        resp, filename, offset, hashers, reporter=None, total=None,
+        report_interval=REPORT_INTERVAL):
+    """ Read a response into a file, appending if `offset` is not 0.
+        Hashers from integrity_hashers() are updated with each chunk, and
+        the reporter is called at most once per `report_interval`.
+        Returns the total bytes in the file, including the `offset`.
+    """
+    readtotal = offset
+    reported = time.perf_counter()
+    with open(filename, 'ab' if offset else 'wb') as f:
+        for chunk in iter(lambda: resp.read(CHUNK_SIZE), b''):
+            f.write(chunk)
+            for hasher, _ in hashers:
+                hasher.update(chunk)
+            readtotal += len(chunk)
+            if reporter is None:
+                continue
+            now = time.perf_counter()
+            if (now - reported) >= report_interval:
+                reported = now
+                reporter(readtotal, total)
+    if reporter is not None:
+        reporter(readtotal, total)
+    return readtotal
+
+
+def response_size(resp, offset=0):
+    """ Return the full size of a download, from a response's headers,
+        or None if it is not known.
+    """
+    contentrange = resp.headers.get('Content-Range', '')
+    if contentrange:
+        # bytes 100-199/200
+        size = contentrange.rpartition('/')[-1]
+        return int(size) if size.isdigit() else None
+    length = resp.headers.get('Content-Length', '')
+    return (int(length) + offset) if length.isdigit() else None
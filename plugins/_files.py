@@ -0,0 +1,112 @@
+""" File writing helpers for New.
+    These are safe to use when several `new` processes are writing to the
+    same directories at once. New files are written to a temporary file and
+    then hard-linked into place, so an existing file is never clobbered, and
+    a half-written file is never seen under the real name.
+"""
+
+import errno
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on this platform, dir_lock() does nothing.
+    fcntl = None
+
+# Temporary files are created with 0600, the final file should have the
+# same permissions that open() would have used.
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+# Errors from os.link() that mean hard links are not supported here,
+# so O_EXCL is used instead (see: link_into_place).
+LINK_UNSUPPORTED = {
+    errno.EPERM,
+    errno.EACCES,
+    errno.EXDEV,
+    errno.EMLINK,
+    getattr(errno, 'ENOTSUP', errno.EPERM),
+    getattr(errno, 'EOPNOTSUPP', errno.EPERM),
+}
+
+
+@contextmanager
+def dir_lock(dirpath):
+    """ Hold an exclusive advisory lock (flock) on a directory, for shared
+        outputs like makefiles. Other processes using dir_lock() on the same
+        directory will wait until it is released.
+        Where flock is not available, this does nothing.
+    """
+    if fcntl is None:
+        yield dirpath
+        return
+    fd = os.open(dirpath or os.curdir, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield dirpath
+    finally:
+        # Closing the file descriptor releases the lock.
+        os.close(fd)
+
+
+def link_into_place(tmppath, filename):
+    """ Hard-link a complete temporary file to `filename`, in the same
+        directory, so the file only appears once it is complete.
+        Raises FileExistsError if `filename` already exists.
+        Where hard links are not supported, the name is reserved with
+        O_EXCL, and then replaced with the temporary file.
+        The temporary file is left for the caller to remove.
+    """
+    try:
+        os.link(tmppath, filename)
+    except FileExistsError:
+        raise
+    except OSError as ex:
+        if ex.errno not in LINK_UNSUPPORTED:
+            raise
+        # No hard links on this file system.
+        os.close(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        os.replace(tmppath, filename)
+
+
+def write_file_atomic(filename, content, overwrite=False):
+    """ Write `content` to `filename` through a temporary file in the same
+        directory, so the file only appears once it is complete.
+        If `overwrite` is False, the file is created exclusively and
+        FileExistsError is raised if it already exists (even if another
+        process created it a moment ago). Otherwise it is atomically
+        replaced, keeping the existing file's permissions, and writing
+        through symlinks.
+        Other errors are raised as usual (EnvironmentError).
+    """
+    mode = FILE_MODE
+    if overwrite:
+        filename = os.path.realpath(filename)
+        try:
+            mode = os.stat(filename).st_mode & 0o7777
+        except FileNotFoundError:
+            pass
+    dirpath, basename = os.path.split(os.path.abspath(filename))
+    fd, tmppath = tempfile.mkstemp(
+        prefix='.{}.'.format(basename),
+        suffix='.tmp',
+        dir=dirpath,
+    )
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmppath, mode)
+        if overwrite:
+            os.replace(tmppath, filename)
+        else:
+            link_into_place(tmppath, filename)
+    finally:
+        try:
+            os.remove(tmppath)
+        except FileNotFoundError:
+            pass
+    return filename
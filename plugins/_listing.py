@@ -0,0 +1,230 @@
+""" Plugin listings and help for New's rarely used commands
+    (--config, --customhelp, --plugins, --pluginversions).
+    This module is only imported when one of them is used.
+"""
+
+import json
+
+from . import print_err
+from ._debug import debugprinter
+from ._tags import tag_providers
+
+debug = debugprinter.debug
+
+
+def config_dump(config):
+    """ Dump config to stdout. """
+    if not config:
+        print('\nNo config found.\n')
+        return False
+    try:
+        configstr = json.dumps(config, sort_keys=True, indent=4)
+    except TypeError as ex:
+        print_err('Config has non-string keys!\n  {}'.format(ex))
+        configstr = json.dumps(config, indent=4)
+    print('\nConfig:\n')
+    print(configstr)
+    return True
+
+
+def custom_plugin_help():
+    """ Print a message with instructions for creating a custom plugin. """
+    try:
+        from outputcatcher import ProcessOutput
+    except ImportError:
+        ProcessOutput = None
+    configstr = """
+{
+    // Custom plugins live under the 'custom' key in new.json.
+    "custom": {
+        // Main name for this custom plugin.
+        "mit": {
+            // Other names for this custom plugin.
+            "aliases": ["license.mit"],
+
+            // File name to read, copy, format, from when creating the file.
+            "filename": "~/Documents/licenses/mit.template.txt",
+
+            // Short description for the custom plugin.
+            "description": "A new MIT license with the year and author set.",
+
+            // Whether New should format keys like {author}, {date}, ..
+            "formatted": true,
+
+            // Post-processing plugins to ignore, like the chmodx plugin.
+            "ignore_post": ["chmodx"],
+
+            // Transform plugins to ignore, like the license plugin.
+            "ignore_transform": ["license"]
+        },
+
+        // Same thing, except uses content straight from the config file:
+        "hello": {
+            "aliases": ["helloworld", "myhelloplugin"],
+            "content": "Hello world from {author}, on {date}.",
+            "description": "A basic content-based custom plugin.",
+            "formatted": true,
+            "ignore_post": ["chmodx"]
+        },
+
+        // A directory 'filename' copies the whole tree as a skeleton:
+        //     new service ./myservice
+        // Files ending in .template (and any 'templates' globs) are
+        // formatted, everything else is copied as it is.
+        "service": {
+            "filename": "~/skeletons/service",
+            "description": "A new service project.",
+            "templates": ["*.md", "src/*.py"]
+        }
+    }
+    // ...the rest of new.json's config settings.
+}""".strip()
+
+    if ProcessOutput is None:
+        debug('outputcatcher not installed, no highlighting.')
+    else:
+        # Free highlighting for those with outputcatcher installed.
+        cmds = (
+            [
+                'highlight',
+                '--style=night',
+                '--syntax=js',
+                '--out-format=ansi'
+            ],
+            ['ccat', '--colors', '--lexer', 'js', '--style', 'monokai'],
+        )
+        for cmd in cmds:
+            try:
+                with ProcessOutput(cmd, stdin_data=configstr) as p:
+                    debug('Ran command: {!r}'.format(cmd))
+                    configstr = p.stdout.decode()
+                    debug('Got output: {!r}...'.format(configstr[:40]))
+                    if p.stderr:
+                        debug('Got stderr!:')
+                        debug(p.stderr.decode(), align=True)
+                    break
+            except Exception as ex:
+                debug('Highlight failed for {!r}: {}'.format(cmd, ex))
+                continue
+
+    print('Custom plugin config example:\n\n{}'.format(configstr))
+    knowntags = sorted([
+        ('author', 'Set in config under plugins.global.author.'),
+        ('email', 'Set in config under plugins.global.email.'),
+        ('version', 'Set in config under plugins.global.default_version.'),
+    ] + tag_providers.describe())
+    keywidth = max(len(key) for key, _ in knowntags)
+    print('\nCurrent known formatting tags:\n    {}'.format(
+        '\n    '.join(
+            '{:>{w}}: {}'.format(key, desc, w=keywidth)
+            for key, desc in knowntags
+        )
+    ))
+    print('\nAny other value in plugins.global can be used as a tag.')
+    return True
+
+
+def list_plugins(registry):
+    """ Lists all plugins in a registry (like plugins.plugins) for the
+        terminal.
+    """
+    filetypes = (
+        ('custom', 'custom file-based'),
+        ('types', 'file-type')
+    )
+    # Normal Plugins (file-type)
+    indent = 20
+    verlbl = 'version'.rjust(indent)
+    aliaslbl = 'aliases'.rjust(indent)
+    extlbl = 'extensions'.rjust(indent)
+    desclbl = 'description'.rjust(indent)
+    # Plus 2 to leave room for ': ' in the description.
+    descindent = ''.join(('\n', ' ' * (len(desclbl) + 2)))
+
+    def format_desc(s):
+        return s.replace('\n', descindent)
+
+    for ptype, pname in filetypes:
+        if registry[ptype]:
+            publicplugins = sorted(
+                s for s in registry[ptype] if not registry[ptype][s].private
+            )
+            pluginlen = len(publicplugins)
+            print('\nFound {} {} {}:'.format(
+                pluginlen,
+                pname,
+                'plugin' if pluginlen == 1 else 'plugins'
+            ))
+            for pluginname in publicplugins:
+                plugin = registry[ptype][pluginname]
+                if plugin.private:
+                    continue
+                print('    {}:'.format(pluginname))
+                print('{}: {}'.format(verlbl, plugin.version))
+                if len(plugin.name) > 1:
+                    print('{}: {}'.format(aliaslbl, ', '.join(plugin.name)))
+                if plugin.extensions:
+                    extlist = ', '.join(plugin.extensions)
+                else:
+                    extlist = 'None'
+                print('{}: {}'.format(extlbl, extlist))
+                desc = format_desc(plugin.get_desc())
+                if desc:
+                    print('{}: {}'.format(desclbl, desc))
+
+    # Do PostPlugin, DeferredPostPlugin, and TransformPlugin
+    posttypes = (
+        ('post', 'post-processing'),
+        ('deferred', 'deferred post-processing'),
+        ('transform', 'transform'),
+    )
+    verlbl = 'version'.rjust(indent - 5)
+    for ptype, pname in posttypes:
+        if registry[ptype]:
+            publicposts = sorted(
+                s for s in registry[ptype] if not registry[ptype][s].private
+            )
+            postlen = len(publicposts)
+            plural = 'plugin' if postlen == 1 else 'plugins'
+            print('\nFound {} {} {}:'.format(postlen, pname, plural))
+            for pname in publicposts:
+                plugin = registry[ptype][pname]
+                if plugin.private:
+                    continue
+                desc = plugin.get_desc().replace('\n', '\n        ')
+                print('    {}'.format(pname))
+                print('{}: {}'.format(verlbl, plugin.version))
+                print('        {}'.format(desc))
+
+
+def list_plugin_versions(registry):
+    plen = sum(len(registry[k]) for k in registry)
+    if not plen:
+        print_err('\nNo plugins found!')
+        return 1
+    filetypes = (
+        ('custom', 'custom file-based'),
+        ('types', 'file-type')
+    )
+    posttypes = (
+        ('post', 'post-processing'),
+        ('deferred', 'deferred post-processing'),
+        ('transform', 'transform'),
+    )
+
+    print('\nFound {} {}:'.format(plen, 'plugin' if plen == 1 else 'plugins'))
+    for ptype, typedesc in filetypes:
+        typefmt = typedesc.title()
+        typelen = len(registry[ptype])
+        print(f'\n    {typefmt} ({typelen}):')
+        for name in sorted(registry[ptype]):
+            p = registry[ptype][name]
+            print(f'        {name:<16}: {p.version}')
+    for ptype, typedesc in posttypes:
+        typefmt = typedesc.title()
+        typelen = len(registry[ptype])
+        print(f'\n    {typefmt} ({typelen}):')
+        for name in sorted(registry[ptype]):
+            p = registry[ptype][name]
+            print(f'        {name:<16}: {p.version}')
+    return 0
@@ -0,0 +1,254 @@
+""" Output whitespace handling for New.
+    Every plugin's content goes through one OutputStyle before it is
+    written, which fixes indentation, line endings, and the final newline
+    with a few whole-string regex passes (linear in the content size).
+
+    Styles come from config (plugins.output, and <plugin>.output), the
+    nearest .editorconfig files (when plugins.output.editorconfig is set),
+    and finally the plugin's own `output_options`.
+"""
+
+import os
+import re
+
+# Keys that can be set for an OutputStyle.
+OPTION_KEYS = ('indent', 'width', 'line_endings', 'final_newline')
+INDENT_STYLES = ('keep', 'spaces', 'tabs')
+LINE_ENDINGS = {'keep': None, 'lf': '\n', 'crlf': '\r\n', 'cr': '\r'}
+FINAL_NEWLINES = ('keep', True, False)
+
+EDITORCONFIG_FILE = '.editorconfig'
+
+
+class OutputStyle(object):
+    """ Whitespace rules for output content.
+        Arguments:
+            indent        : 'tabs', 'spaces', or 'keep'.
+            width         : Number of columns for each indent level/tab.
+            line_endings  : 'lf', 'crlf', 'cr', or 'keep'.
+            final_newline : True to end with exactly one newline, False to
+                            remove trailing newlines, or 'keep'.
+    """
+    indent_pat = re.compile(r'^[ \t]+', flags=re.MULTILINE)
+    newline_pat = re.compile(r'\r\n?')
+
+    def __init__(
+            self, indent='keep', width=4, line_endings='keep',
+            final_newline='keep'):
+        if indent not in INDENT_STYLES:
+            raise ValueError(
+                'Invalid output indent, expecting {}: {!r}'.format(
+                    ', '.join(INDENT_STYLES),
+                    indent,
+                )
+            )
+        if line_endings not in LINE_ENDINGS:
+            raise ValueError(
+                'Invalid output line_endings, expecting {}: {!r}'.format(
+                    ', '.join(LINE_ENDINGS),
+                    line_endings,
+                )
+            )
+        if final_newline not in FINAL_NEWLINES:
+            raise ValueError(
+                'Invalid output final_newline, expecting {}: {!r}'.format(
+                    'true, false, or keep',
+                    final_newline,
+                )
+            )
+        try:
+            width = int(width)
+        except (TypeError, ValueError):
+            width = 0
+        if width < 1:
+            raise ValueError(
+                'Invalid output width, expecting a number: {!r}'.format(width)
+            )
+        self.indent = indent
+        self.width = width
+        self.line_endings = line_endings
+        self.final_newline = final_newline
+        # Converted indents, {old_indent: new_indent}.
+        # Most content only uses a few different indents.
+        self.indents = {}
+
+    def __repr__(self):
+        return ''.join((
+            '{}(indent={!r}, width={!r}, line_endings={!r}, ',
+            'final_newline={!r})',
+        )).format(
+            type(self).__name__,
+            self.indent,
+            self.width,
+            self.line_endings,
+            self.final_newline,
+        )
+
+    def apply(self, content):
+        """ Apply this style to content, returning the new content. """
+        if not content:
+            return content
+        newline = LINE_ENDINGS[self.line_endings]
+        if newline is not None:
+            content = self.newline_pat.sub('\n', content)
+        if self.indent != 'keep':
+            content = self.indent_pat.sub(self.convert_indent, content)
+        if self.final_newline is True:
+            content = '{}\n'.format(content.rstrip('\n'))
+        elif self.final_newline is False:
+            content = content.rstrip('\n')
+        if (newline is not None) and (newline != '\n'):
+            content = content.replace('\n', newline)
+        return content
+
+    def convert_indent(self, match):
+        """ Convert leading whitespace from an indent_pat match. """
+        indent = match.group()
+        newindent = self.indents.get(indent, None)
+        if newindent is None:
+            columns = len(indent.expandtabs(self.width))
+            if self.indent == 'spaces':
+                newindent = ' ' * columns
+            else:
+                tabs, spaces = divmod(columns, self.width)
+                newindent = ''.join(('\t' * tabs, ' ' * spaces))
+            self.indents[indent] = newindent
+        return newindent
+
+    @classmethod
+    def from_options(cls, *optiondicts):
+        """ Build an OutputStyle from option dicts, where later dicts
+            override earlier ones. Missing or None values are skipped,
+            and unknown keys are ignored.
+        """
+        kwargs = {}
+        for options in optiondicts:
+            for key in OPTION_KEYS:
+                value = (options or {}).get(key, None)
+                if value is not None:
+                    kwargs[key] = value
+        return cls(**kwargs)
+
+
+def editorconfig_glob_pattern(glob):
+    """ Translate an .editorconfig section glob into a regex pattern
+        string, matching a path relative to the .editorconfig directory.
+    """
+    if '/' not in glob:
+        # Globs without a slash match files in any directory.
+        glob = '**/{}'.format(glob)
+    glob = glob.lstrip('/')
+    pattern = []
+    i = 0
+    while i < len(glob):
+        char = glob[i]
+        if glob.startswith('**/', i):
+            pattern.append('(?:.*/)?')
+            i += 3
+            continue
+        elif glob.startswith('**', i):
+            pattern.append('.*')
+            i += 2
+            continue
+        elif char == '*':
+            pattern.append('[^/]*')
+        elif char == '?':
+            pattern.append('[^/]')
+        elif char == '{':
+            end = glob.find('}', i)
+            if end == -1:
+                pattern.append(re.escape(char))
+            else:
+                choices = glob[i + 1:end].split(',')
+                pattern.append('(?:{})'.format(
+                    '|'.join(re.escape(c) for c in choices)
+                ))
+                i = end + 1
+                continue
+        elif char == '[':
+            end = glob.find(']', i)
+            if end == -1:
+                pattern.append(re.escape(char))
+            else:
+                pattern.append(glob[i:end + 1].replace('[!', '[^'))
+                i = end + 1
+                continue
+        else:
+            pattern.append(re.escape(char))
+        i += 1
+    return ''.join(pattern)
+
+
+def editorconfig_options(filepath):
+    """ Read output options for a file from the nearest .editorconfig
+        files (stopping at one with root = true).
+        Returns a dict of OutputStyle options.
+    """
+    filepath = os.path.abspath(filepath)
+    dirpath = os.path.dirname(filepath)
+    configs = []
+    while True:
+        sections, isroot = read_editorconfig(
+            os.path.join(dirpath, EDITORCONFIG_FILE)
+        )
+        if sections:
+            configs.append((dirpath, sections))
+        parentdir = os.path.dirname(dirpath)
+        if isroot or (parentdir == dirpath):
+            break
+        dirpath = parentdir
+
+    props = {}
+    # Closer files override the ones in parent directories.
+    for configdir, sections in reversed(configs):
+        relpath = os.path.relpath(filepath, configdir).replace(os.sep, '/')
+        for glob, sectionprops in sections:
+            if re.fullmatch(editorconfig_glob_pattern(glob), relpath):
+                props.update(sectionprops)
+
+    options = {}
+    indent_style = props.get('indent_style', None)
+    if indent_style in ('tab', 'space'):
+        options['indent'] = 'tabs' if indent_style == 'tab' else 'spaces'
+    width = props.get('indent_size', None)
+    if width == 'tab':
+        width = props.get('tab_width', None)
+    if width and width.isdigit():
+        options['width'] = int(width)
+    if props.get('end_of_line', None) in LINE_ENDINGS:
+        options['line_endings'] = props['end_of_line']
+    final_newline = props.get('insert_final_newline', None)
+    if final_newline in ('true', 'false'):
+        options['final_newline'] = (final_newline == 'true')
+    return options
+
+
+def read_editorconfig(filename):
+    """ Read an .editorconfig file.
+        Returns a tuple of ([(section_glob, {key: value})], is_root).
+        Missing or unreadable files return ([], False).
+    """
+    try:
+        with open(filename, 'r') as f:
+            lines = f.readlines()
+    except (EnvironmentError, UnicodeDecodeError):
+        return [], False
+    sections = []
+    isroot = False
+    for line in lines:
+        line = line.strip()
+        if (not line) or line.startswith(('#', ';')):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            sections.append((line[1:-1], {}))
+            continue
+        key, sep, value = line.partition('=')
+        if not sep:
+            continue
+        key = key.strip().lower()
+        value = value.strip().lower()
+        if sections:
+            sections[-1][1][key] = value
+        elif key == 'root':
+            isroot = (value == 'true')
+    return sections, isroot
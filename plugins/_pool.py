@@ -0,0 +1,47 @@
+""" Plugin instance pooling for New.
+    Creating a plugin instance loads and merges it's config
+    (see: PluginBase.load_config()), so plugins are only created once per
+    run, and the same instance is reused for every file, plugin group, and
+    helper lookup (like CPlugin using CHeaderPlugin).
+
+    Reused instances keep their config. Anything that belongs to a single
+    file is cleared by the plugin's reset() method, which is called before
+    each file is handled.
+"""
+
+
+class PluginPool(object):
+    """ Plugin instances for one run, by plugin class. """
+
+    def __init__(self):
+        # {plugin_class: plugin_instance}
+        self.instances = {}
+        # Number of instances that were created, and reused.
+        self.created = 0
+        self.reused = 0
+
+    def __contains__(self, plugincls):
+        return plugincls in self.instances
+
+    def __len__(self):
+        return len(self.instances)
+
+    def clear(self):
+        """ Remove all instances, like when plugins are reloaded. """
+        self.instances.clear()
+        self.created = 0
+        self.reused = 0
+
+    def get(self, plugincls):
+        """ Return the instance for a plugin class, creating it on first use.
+            Errors from the plugin's __init__ are not caught, and a plugin
+            that fails is not pooled.
+        """
+        plugin = self.instances.get(plugincls, None)
+        if plugin is None:
+            plugin = plugincls()
+            self.instances[plugincls] = plugin
+            self.created += 1
+        else:
+            self.reused += 1
+        return plugin
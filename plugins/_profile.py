@@ -0,0 +1,280 @@
+""" Profiling helpers for New.
+    Runs a function under cProfile, and writes pstats along with a
+    collapsed-stack file (one "frame;frame;frame microseconds" line per
+    stack) that flamegraph.pl, speedscope, and inferno can read.
+
+    Also takes tracemalloc snapshots for each run phase (see: MemProfiler).
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on all platforms, peak RSS is not reported.
+    resource = None
+
+# Extension added to the pstats file name for the collapsed-stack file.
+COLLAPSED_EXT = '.collapsed'
+# Stack depth limit when rebuilding stacks from the call graph.
+MAX_DEPTH = 128
+# Stacks with less time than this (in seconds) are not followed.
+MIN_TIME = 0.000001
+
+
+class MemProfiler(object):
+    """ Takes tracemalloc snapshots after each run phase, and keeps a small
+        summary of each one: traced memory, the traced peak during the
+        phase, peak RSS, and the top allocation sites since the last
+        snapshot. Only the latest snapshot is kept in memory.
+    """
+    # Frames that are not interesting for allocation sites.
+    ignored = (
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<unknown>'),
+    )
+
+    def __init__(self, top=10):
+        self.top = top
+        self.phases = []
+        self.last_snapshot = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def format_report(self):
+        """ Format all phase summaries as text. """
+        lines = ['Memory profile (KiB):']
+        for phase in self.phases:
+            lines.append(
+                '\n    {}: current {:.1f}, peak {:.1f}, peak rss {}'.format(
+                    phase['phase'],
+                    phase['current'] / 1024,
+                    phase['peak'] / 1024,
+                    (
+                        '?' if phase['rss_peak'] is None
+                        else '{:.1f}'.format(phase['rss_peak'] / 1024)
+                    ),
+                )
+            )
+            for site in phase['top']:
+                lines.append('        {:>+10.1f} ({:+d} blocks) {}'.format(
+                    site['size_diff'] / 1024,
+                    site['count_diff'],
+                    site['site'],
+                ))
+        return '\n'.join(lines)
+
+    def report(self, file=None):
+        """ Print the report to `file` (stderr by default). """
+        print('\n{}'.format(self.format_report()), file=file or sys.stderr)
+
+    def snapshot(self, phase):
+        """ Take a snapshot for a run phase, and summarize it. """
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.ignored)
+        if self.last_snapshot is None:
+            stats = [
+                (stat.traceback, stat.size, stat.count)
+                for stat in snapshot.statistics('lineno')[:self.top]
+            ]
+        else:
+            stats = [
+                (stat.traceback, stat.size_diff, stat.count_diff)
+                for stat in snapshot.compare_to(
+                    self.last_snapshot,
+                    'lineno',
+                )[:self.top]
+            ]
+        self.last_snapshot = snapshot
+        self.phases.append({
+            'phase': phase,
+            'current': current,
+            'peak': peak,
+            'rss_peak': get_rss_peak(),
+            'top': [
+                {
+                    'site': str(traceback[0]),
+                    'size_diff': size,
+                    'count_diff': count,
+                }
+                for traceback, size, count in stats
+            ],
+        })
+        # Each phase gets its own traced peak.
+        tracemalloc.reset_peak()
+        return self.phases[-1]
+
+
+def collapsed_stacks(stats, rootdir=None, keep=None):
+    """ Rebuild approximate call stacks from pstats data.
+        cProfile only records caller/callee edges, so a function's time is
+        split between its callers by the cumulative time of each edge.
+        Arguments:
+            stats   : A pstats.Stats instance.
+            rootdir : Directory to make frame file names relative to.
+            keep    : A callable that receives a frame's file name, and
+                      returns True for frames of interest. When set, frames
+                      above the first frame of interest are dropped, and
+                      stacks without one are skipped.
+        Returns a dict of {(frame_name, ..): microseconds}.
+    """
+    rawstats = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in rawstats.items():
+        for caller, callerinfo in callers.items():
+            callees.setdefault(caller, []).append((func, callerinfo[3]))
+    roots = [
+        func
+        for func, (_, _, _, _, callers) in rawstats.items()
+        if not callers
+    ]
+    names = {}
+
+    def name_for(func):
+        name = names.get(func, None)
+        if name is None:
+            name = names[func] = frame_name(func, rootdir=rootdir)
+        return name
+
+    stacks = {}
+
+    def add_stack(funcs, seconds):
+        if keep is not None:
+            for i, func in enumerate(funcs):
+                if keep(func[0]):
+                    funcs = funcs[i:]
+                    break
+            else:
+                return None
+        key = tuple(name_for(f) for f in funcs)
+        stacks[key] = stacks.get(key, 0) + seconds
+
+    # Walk the call graph iteratively, to avoid recursion limits.
+    pending = [((root,), rawstats[root][3]) for root in roots]
+    while pending:
+        funcs, budget = pending.pop()
+        func = funcs[-1]
+        _, _, tottime, cumtime, _ = rawstats[func]
+        ratio = (budget / cumtime) if cumtime else 0
+        selftime = tottime * ratio
+        if selftime > 0:
+            add_stack(funcs, selftime)
+        if len(funcs) >= MAX_DEPTH:
+            continue
+        for callee, edgetime in callees.get(func, ()):
+            childbudget = edgetime * ratio
+            if (childbudget < MIN_TIME) or (callee in funcs):
+                continue
+            pending.append((funcs + (callee,), childbudget))
+
+    return {
+        stack: round(seconds * 1000000)
+        for stack, seconds in stacks.items()
+        if round(seconds * 1000000) > 0
+    }
+
+
+def format_collapsed(stacks):
+    """ Format collapsed stacks from collapsed_stacks() as lines of text.
+    """
+    return ''.join(
+        '{} {}\n'.format(';'.join(stack), micros)
+        for stack, micros in sorted(stacks.items())
+    )
+
+
+def frame_name(func, rootdir=None):
+    """ Build a frame name from a pstats function key:
+            (filename, line number, function name)
+    """
+    filename, lineno, funcname = func
+    if filename == '~':
+        # Built-in function.
+        name = funcname
+    else:
+        if rootdir and filename.startswith(rootdir):
+            filename = os.path.relpath(filename, rootdir)
+        name = '{} ({}:{})'.format(funcname, filename, lineno)
+    # Semicolons separate frames in the collapsed format.
+    return name.replace(';', ',')
+
+
+def get_rss_peak():
+    """ Return the peak resident set size for this process, in bytes, or
+        None if it is not available.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes.
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def is_plugin_file(filename, plugindir):
+    """ Returns True if `filename` belongs to a plugin module in
+        `plugindir` (not the plugins package itself, or private modules).
+    """
+    plugindir = os.path.join(plugindir, '')
+    if not filename.startswith(plugindir):
+        return False
+    relpath = os.path.relpath(filename, plugindir)
+    return not relpath.split(os.path.sep)[0].startswith('_')
+
+
+def profile_call(
+        func, *args, filename=None, rootdir=None, plugindir=None,
+        **kwargs):
+    """ Call `func(*args, **kwargs)` under cProfile, and write pstats to
+        `filename` and collapsed stacks to `filename + COLLAPSED_EXT`.
+        Frame file names are made relative to `rootdir`.
+        If `plugindir` is set, collapsed stacks are limited to code running
+        in plugin modules from that directory.
+        Returns the function's return value.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        write_profile(
+            profiler,
+            filename,
+            rootdir=rootdir,
+            plugindir=plugindir,
+        )
+
+
+def write_profile(profiler, filename, rootdir=None, plugindir=None):
+    """ Write pstats and collapsed stacks for a profiler.
+        Returns True on success, or False if the files could not be written.
+    """
+    collapsedfile = '{}{}'.format(filename, COLLAPSED_EXT)
+    if plugindir:
+        def keep(path):
+            return is_plugin_file(path, plugindir)
+    else:
+        keep = None
+    try:
+        profiler.dump_stats(filename)
+        stats = pstats.Stats(profiler)
+        with open(collapsedfile, 'w') as f:
+            f.write(format_collapsed(
+                collapsed_stacks(stats, rootdir=rootdir, keep=keep)
+            ))
+    except EnvironmentError as ex:
+        print('Unable to write profile: {}'.format(ex), file=sys.stderr)
+        return False
+    print(
+        '\nProfile written to: {}\n Stacks written to: {}'.format(
+            filename,
+            collapsedfile,
+        ),
+        file=sys.stderr,
+    )
+    return True
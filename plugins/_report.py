@@ -0,0 +1,166 @@
+""" Run output for New (see: --output).
+    Status lines are only printed for terminals, and checking that (plus
+    colorizing each line) for every file and post plugin adds up in big
+    runs, so the terminal check is done once per stream, and nothing is
+    formatted for output that will not be shown.
+
+    Other output modes replace the status lines:
+        json     : One JSON record per line on stdout, for each created
+                   file and each post-plugin result, for scripts.
+        progress : A single summary line (files, files/s, bytes, errors)
+                   on stderr, refreshed at a capped rate.
+"""
+
+import json
+import sys
+import time
+
+from ._colors import import_colr
+
+OUTPUT_MODES = ('text', 'json', 'progress')
+
+# Post-plugin results that are counted as errors in progress mode.
+ERROR_RESULTS = ('error', 'fatal')
+
+# Minimum seconds between progress line refreshes.
+PROGRESS_INTERVAL = 0.2
+
+
+def format_bytes(size):
+    """ Return a short, human-readable byte size, like: 1.5 MiB """
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'TiB'
+    if unit == 'B':
+        return '{} {}'.format(size, unit)
+    return '{:.1f} {}'.format(size, unit)
+
+
+class Reporter(object):
+    """ Output for created files, post-plugin results, and status messages,
+        in one of the OUTPUT_MODES.
+    """
+
+    def __init__(self, mode='text', interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        # {stream: isatty()}
+        self.terminals = {}
+        self.set_mode(mode)
+
+    def finish(self):
+        """ Print the final progress line, when in progress mode. """
+        if self.mode != 'progress':
+            return None
+        self.refresh(force=True)
+        sys.stderr.write('\n')
+        sys.stderr.flush()
+
+    def is_terminal(self, file):
+        """ Return True if `file` is a terminal, checking once per stream.
+        """
+        try:
+            return self.terminals[file]
+        except KeyError:
+            pass
+        try:
+            isatty = file.isatty()
+        except (AttributeError, ValueError):
+            isatty = False
+        self.terminals[file] = isatty
+        return isatty
+
+    def progress_line(self):
+        """ Return the progress summary line. """
+        elapsed = time.perf_counter() - self.started
+        return 'new: {} {}, {:.1f} files/s, {}, {} {}'.format(
+            self.files,
+            'file' if self.files == 1 else 'files',
+            (self.files / elapsed) if elapsed else 0.0,
+            format_bytes(self.bytes),
+            self.errors,
+            'error' if self.errors == 1 else 'errors',
+        )
+
+    def record(self, event, **fields):
+        """ Report a created file ('created', 'dryrun', 'failed'), or a
+            post-plugin result ('post').
+            In json mode, the fields are written as a JSON record.
+            In progress mode, the counters are updated.
+            In text mode, nothing is done (callers print status lines).
+        """
+        if self.mode == 'text':
+            return None
+        if self.mode == 'json':
+            fields['event'] = event
+            sys.stdout.write(json.dumps(fields, sort_keys=True))
+            sys.stdout.write('\n')
+            return None
+        if event == 'created':
+            self.files += fields.get('files', 1)
+            self.bytes += fields.get('bytes', None) or 0
+        elif (event == 'failed') or (fields.get('result') in ERROR_RESULTS):
+            self.errors += 1
+        self.refresh()
+
+    def refresh(self, force=False):
+        """ Rewrite the progress line on stderr, at most once per interval
+            (unless `force` is used). Only terminals get updates while
+            running, otherwise the line is printed once by finish().
+        """
+        now = time.perf_counter()
+        if not force:
+            if (now - self.refreshed) < self.interval:
+                return None
+            if not self.is_terminal(sys.stderr):
+                return None
+        self.refreshed = now
+        if self.is_terminal(sys.stderr):
+            sys.stderr.write('\r\033[K')
+        sys.stderr.write(self.progress_line())
+        sys.stderr.flush()
+
+    def set_mode(self, mode):
+        """ Set the output mode, and reset the progress counters.
+            Raises ValueError for unknown modes.
+        """
+        if mode not in OUTPUT_MODES:
+            raise ValueError('Invalid output mode, expecting {}: {}'.format(
+                ', '.join(OUTPUT_MODES),
+                mode,
+            ))
+        self.mode = mode
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.refreshed = self.started
+
+    def show_text(self, file=None):
+        """ Return True if text status output should be printed to `file`
+            (default: stdout), meaning text mode and a terminal.
+        """
+        if self.mode != 'text':
+            return False
+        return self.is_terminal(sys.stdout if file is None else file)
+
+    def status(self, name, msg, padlines=0, **kwargs):
+        """ Print a status line, like: name: msg
+            Only text mode and terminals get status lines, and they are
+            only formatted (and colr is only imported) when they will be
+            printed.
+        """
+        kwargs['file'] = kwargs.get('file', None) or sys.stdout
+        if not self.show_text(kwargs['file']):
+            return None
+        C = import_colr().Colr
+        print(
+            '{}{}: {}'.format(
+                '\n' * padlines,
+                C(name.ljust(16), 'blue'),
+                msg,
+            ),
+            **kwargs
+        )
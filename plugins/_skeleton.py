@@ -0,0 +1,236 @@
+""" Directory tree copying for New's skeleton plugins.
+    Copies a template directory into a new project. Directories are all
+    created first, and plain files are cloned (FICLONE reflinks) or copied
+    in the kernel (copy_file_range/sendfile), so big skeletons don't go
+    through Python reads and writes. Only template files are read, to be
+    rendered.
+"""
+
+import errno
+import os
+import shutil
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from ._files import link_into_place, write_file_atomic
+
+# ioctl request for reflinking a whole file on Linux (btrfs, xfs, ..).
+FICLONE = 0x40049409
+
+# Errors that mean a fast copy method is not supported for these files,
+# so the next method is tried.
+COPY_UNSUPPORTED = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSOCK,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EPERM,
+    errno.EXDEV,
+    getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP),
+}
+
+# Maximum bytes for each copy_file_range/sendfile call.
+COPY_CHUNK = 1024 * 1024 * 64
+
+
+def clone_fd(src_fd, dst_fd):
+    """ Reflink a file with FICLONE, where the file system supports it.
+        Returns True on success, or False if it is not supported.
+    """
+    if (fcntl is None) or (not sys.platform.startswith('linux')):
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as ex:
+        if ex.errno in COPY_UNSUPPORTED:
+            return False
+        raise
+    return True
+
+
+def copy_fd(src_fd, dst_fd, size):
+    """ Copy `size` bytes between file descriptors, in the kernel if
+        possible (copy_file_range, then sendfile), or with reads/writes.
+    """
+    copied = 0
+    for copyfunc in (copy_range, send_file):
+        try:
+            copied = copyfunc(src_fd, dst_fd, size)
+        except OSError as ex:
+            if ex.errno not in COPY_UNSUPPORTED:
+                raise
+            continue
+        if copied == size:
+            return None
+        # The file changed size while copying, finish it off below.
+        break
+    os.lseek(src_fd, copied, os.SEEK_SET)
+    os.lseek(dst_fd, copied, os.SEEK_SET)
+    with open(src_fd, 'rb', closefd=False) as src:
+        with open(dst_fd, 'wb', closefd=False) as dst:
+            shutil.copyfileobj(src, dst)
+
+
+def copy_file(src, dst, overwrite=False):
+    """ Copy a file's content and permissions, with FICLONE or an in-kernel
+        copy where possible.
+        The copy is made in a temporary file next to `dst`, and only moved
+        into place once it is complete, so a failed copy never leaves a
+        partial file behind, or destroys the file it was replacing.
+        Unless `overwrite` is True, the file is created exclusively, and
+        FileExistsError is raised if it exists.
+    """
+    if overwrite:
+        # Replace the file that a symlink points to, not the symlink.
+        dst = os.path.realpath(dst)
+    dirpath, basename = os.path.split(os.path.abspath(dst))
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        st = os.fstat(src_fd)
+        dst_fd, tmppath = tempfile.mkstemp(
+            prefix='.{}.'.format(basename),
+            suffix='.tmp',
+            dir=dirpath,
+        )
+        try:
+            try:
+                if not clone_fd(src_fd, dst_fd):
+                    copy_fd(src_fd, dst_fd, st.st_size)
+                os.fchmod(dst_fd, st.st_mode & 0o7777)
+            finally:
+                os.close(dst_fd)
+            if overwrite:
+                os.replace(tmppath, dst)
+            else:
+                link_into_place(tmppath, dst)
+        finally:
+            try:
+                os.remove(tmppath)
+            except FileNotFoundError:
+                pass
+    finally:
+        os.close(src_fd)
+
+
+def copy_range(src_fd, dst_fd, size):
+    """ Copy with os.copy_file_range(), which can copy (or share extents)
+        without data going through user space.
+        Returns the number of bytes copied.
+    """
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range is not available.')
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(
+            src_fd,
+            dst_fd,
+            min(COPY_CHUNK, size - copied),
+            offset_src=copied,
+            offset_dst=copied,
+        )
+        if not sent:
+            break
+        copied += sent
+    return copied
+
+
+def copy_tree(
+        srcdir, destdir, is_template=None, render=None, overwrite=False,
+        dryrun=False):
+    """ Copy a skeleton directory tree to `destdir`.
+        All directories are created before any files are copied.
+        Arguments:
+            srcdir      : Skeleton directory to copy.
+            destdir     : Destination directory, created if needed.
+            is_template : A callable that receives a file's relative path,
+                          and returns the destination relative path if it
+                          is a template, or None for plain files.
+            render      : A callable that receives (relative_path, content)
+                          for template files, and returns new content.
+            overwrite   : Whether existing files can be replaced.
+            dryrun      : Don't write anything, just return the file list.
+        Returns a tuple of (created_files, skipped_existing_files), with
+        destination paths.
+    """
+    dirs, files = scan_tree(srcdir)
+    created = []
+    skipped = []
+    if not dryrun:
+        os.makedirs(destdir, exist_ok=True)
+        for reldir in dirs:
+            os.makedirs(os.path.join(destdir, reldir), exist_ok=True)
+
+    for relpath in files:
+        src = os.path.join(srcdir, relpath)
+        templatepath = is_template(relpath) if is_template else None
+        dst = os.path.join(destdir, templatepath or relpath)
+        if dryrun:
+            created.append(dst)
+            continue
+        try:
+            if templatepath is None:
+                copy_file(src, dst, overwrite=overwrite)
+            else:
+                with open(src, 'r') as f:
+                    content = f.read()
+                if render is not None:
+                    content = render(relpath, content)
+                write_file_atomic(dst, content, overwrite=overwrite)
+                shutil.copymode(src, dst)
+        except FileExistsError:
+            skipped.append(dst)
+            continue
+        created.append(dst)
+    return created, skipped
+
+
+def scan_tree(srcdir):
+    """ List all directories and files in a tree, relative to `srcdir`.
+        Symlinked directories are not followed.
+        Returns a tuple of (sorted_dirs, sorted_files).
+    """
+    dirs = []
+    files = []
+    pending = ['']
+    while pending:
+        reldir = pending.pop()
+        with os.scandir(os.path.join(srcdir, reldir)) as entries:
+            for entry in entries:
+                relpath = os.path.join(reldir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(relpath)
+                    pending.append(relpath)
+                elif entry.is_file():
+                    files.append(relpath)
+    dirs.sort()
+    files.sort()
+    return dirs, files
+
+
+def send_file(src_fd, dst_fd, size):
+    """ Copy with os.sendfile(), which only works for regular destination
+        files on Linux.
+        Returns the number of bytes copied.
+    """
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, 'sendfile is not available.')
+    os.lseek(dst_fd, 0, os.SEEK_SET)
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(
+            dst_fd,
+            src_fd,
+            copied,
+            min(COPY_CHUNK, size - copied),
+        )
+        if not sent:
+            break
+        copied += sent
+    return copied
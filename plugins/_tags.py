@@ -0,0 +1,197 @@
+""" Format tag providers for New's custom plugin templates.
+    Each tag is provided by a function that is only called when a template
+    uses the tag, and the value is kept for the rest of the run. So a git
+    config lookup happens once per batch, and never if no template needs it.
+
+    More providers can be added with: plugins.tag_providers.register()
+"""
+
+import os
+import re
+import socket
+import subprocess
+from collections.abc import Mapping
+from datetime import datetime
+
+# Files that name a project, with a pattern to find the name.
+PROJECT_FILES = (
+    ('setup.py', re.compile(r'''\bname\s*=\s*['"]([^'"]+)['"]''')),
+    ('Cargo.toml', re.compile(r'''^name\s*=\s*['"]([^'"]+)['"]''', re.M)),
+    (
+        'pyproject.toml',
+        re.compile(r'''^name\s*=\s*['"]([^'"]+)['"]''', re.M)
+    ),
+    ('package.json', re.compile(r'''"name"\s*:\s*"([^"]+)"''')),
+)
+
+
+class TagProviders(Mapping):
+    """ A mapping of {tag_name: value}, where each value is computed by a
+        provider function the first time it is looked up.
+        Providers receive this mapping, so they can use other tags.
+        Providers that return None are treated like unknown tags.
+    """
+
+    def __init__(self):
+        # {name: (func, description)}
+        self.providers = {}
+        # {name: value}, for providers that have been called.
+        self.values = {}
+
+    def __contains__(self, name):
+        return name in self.providers
+
+    def __getitem__(self, name):
+        try:
+            return self.values[name]
+        except KeyError:
+            func, _ = self.providers[name]
+        value = self.values[name] = func(self)
+        return value
+
+    def __iter__(self):
+        return iter(self.providers)
+
+    def __len__(self):
+        return len(self.providers)
+
+    def clear(self):
+        """ Forget all provided values, so they are computed again. """
+        self.values.clear()
+
+    def describe(self):
+        """ Return a list of (name, description) for all providers. """
+        return [
+            (name, desc)
+            for name, (_, desc) in sorted(self.providers.items())
+        ]
+
+    def register(self, name, func=None, description=None):
+        """ Register a tag provider, replacing any existing one.
+            This can also be used as a decorator:
+                @tag_providers.register('tagname')
+                def provide_tagname(tags):
+                    return 'value'
+        """
+        if func is None:
+            def decorator(func):
+                self.register(name, func, description=description)
+                return func
+            return decorator
+        self.providers[name] = (
+            func,
+            (description or func.__doc__ or '').strip(),
+        )
+        self.values.pop(name, None)
+        return func
+
+    def unregister(self, name):
+        """ Remove a tag provider, and it's value.
+            Returns the provider function, or None if it wasn't registered.
+        """
+        self.values.pop(name, None)
+        func, _ = self.providers.pop(name, (None, None))
+        return func
+
+
+tag_providers = TagProviders()
+
+
+def find_project_name(dirpath):
+    """ Look for the project name in the nearest project file, searching
+        `dirpath` and it's parents.
+        Returns None if no project name is found.
+    """
+    dirpath = os.path.abspath(dirpath)
+    while True:
+        for filename, pat in PROJECT_FILES:
+            filepath = os.path.join(dirpath, filename)
+            try:
+                with open(filepath, 'r') as f:
+                    match = pat.search(f.read())
+            except (EnvironmentError, UnicodeDecodeError):
+                continue
+            if match is not None:
+                return match.group(1)
+        parentdir = os.path.dirname(dirpath)
+        if parentdir == dirpath:
+            return None
+        dirpath = parentdir
+
+
+def git_config(key):
+    """ Get a value from `git config`, or None if it is not set. """
+    try:
+        value = subprocess.check_output(
+            ['git', 'config', '--get', key],
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (EnvironmentError, subprocess.CalledProcessError):
+        return None
+    return value or None
+
+
+@tag_providers.register('cwd')
+def provide_cwd(tags):
+    """ The current working directory. """
+    return os.getcwd()
+
+
+@tag_providers.register('date')
+def provide_date(tags):
+    """ Today's date (MM-DD-YYYY). """
+    return tags['now'].strftime('%m-%d-%Y')
+
+
+@tag_providers.register('dirname')
+def provide_dirname(tags):
+    """ Name of the current directory. """
+    return os.path.basename(tags['cwd'])
+
+
+@tag_providers.register('git_email')
+def provide_git_email(tags):
+    """ Email from git config (user.email). """
+    return git_config('user.email')
+
+
+@tag_providers.register('git_user')
+def provide_git_user(tags):
+    """ User name from git config (user.name). """
+    return git_config('user.name')
+
+
+@tag_providers.register('hostname')
+def provide_hostname(tags):
+    """ This machine's host name. """
+    return socket.gethostname()
+
+
+@tag_providers.register('isodate')
+def provide_isodate(tags):
+    """ Today's date (YYYY-MM-DD). """
+    return tags['now'].strftime('%Y-%m-%d')
+
+
+@tag_providers.register('now')
+def provide_now(tags):
+    """ Current date/time, with strftime formats: {now:%H:%M} """
+    return datetime.today()
+
+
+@tag_providers.register('project')
+def provide_project(tags):
+    """ Project name from the nearest setup.py, Cargo.toml, etc. """
+    return find_project_name(tags['cwd'])
+
+
+@tag_providers.register('time')
+def provide_time(tags):
+    """ Current time (HH:MM:SS). """
+    return tags['now'].strftime('%H:%M:%S')
+
+
+@tag_providers.register('year')
+def provide_year(tags):
+    """ This year. """
+    return tags['now'].year
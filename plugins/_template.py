@@ -0,0 +1,82 @@
+""" Template rendering for New's custom plugins.
+    Renders str.format-style templates in a single pass. Known tags are
+    substituted, and anything else (unknown tags, JSON/C/shell braces) is
+    left as it is, with the position of every unknown tag reported.
+"""
+
+import re
+import string
+
+
+class TemplateFormatter(string.Formatter):
+    """ A string.Formatter that never fails on stray braces.
+        Only {name}, {name!c}, and {name:spec} are treated as fields, and
+        {{ and }} are escapes like they are for str.format(). All other
+        braces are literal text.
+    """
+    field_pat = re.compile(r'{{|}}|{(\w+)(?:!([rsa]))?(?::([^{}]*))?}')
+
+    def iter_parts(self, template):
+        """ Yield (literal_text, field_match) for each field in a template.
+            field_match is None for the trailing literal text.
+            Escaped braces are added to the literal text.
+        """
+        literal = []
+        lastend = 0
+        for match in self.field_pat.finditer(template):
+            literal.append(template[lastend:match.start()])
+            lastend = match.end()
+            if match.group(1) is None:
+                # An escaped brace.
+                literal.append(match.group()[0])
+                continue
+            yield ''.join(literal), match
+            literal = []
+        literal.append(template[lastend:])
+        yield ''.join(literal), None
+
+    def parse(self, format_string):
+        """ A tolerant version of string.Formatter.parse(), so format()
+            and vformat() treat stray braces as literal text.
+        """
+        for literal, match in self.iter_parts(format_string):
+            if match is None:
+                if literal:
+                    yield literal, None, None, None
+                continue
+            name, conversion, spec = match.groups()
+            yield literal, name, spec or '', conversion
+
+    def render(self, template, tags):
+        """ Render a template, using `tags` ({name: value}) for the fields.
+            Tags that are missing (or None) are left in the output as they
+            were written.
+            Returns a tuple of (text, unknown_tags), where unknown_tags is a
+            list of (tag_name, line, column) (1-based) for each unknown tag.
+        """
+        parts = []
+        unknown = []
+        # Line numbers are counted as the template is walked.
+        linenum = 1
+        linecounted = 0
+        for literal, match in self.iter_parts(template):
+            parts.append(literal)
+            if match is None:
+                break
+            name, conversion, spec = match.groups()
+            value = tags.get(name, None)
+            if value is not None:
+                parts.append(
+                    self.format_field(
+                        self.convert_field(value, conversion),
+                        spec or '',
+                    )
+                )
+                continue
+            start = match.start()
+            linenum += template.count('\n', linecounted, start)
+            linecounted = start
+            column = start - template.rfind('\n', 0, start)
+            unknown.append((name, linenum, column))
+            parts.append(match.group())
+        return ''.join(parts), unknown
@@ -0,0 +1,134 @@
+""" Timing helpers for New.
+    Records wall and cpu time for each run phase and plugin, so a slow run
+    can be narrowed down without attaching a profiler (see: --timings).
+
+    Only totals are kept for each label, so memory use does not grow with
+    the number of files created.
+"""
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+
+class Timings(object):
+    """ Aggregated wall/cpu timings, keyed by label.
+        Labels are reported in the order they were first recorded.
+    """
+
+    def __init__(self):
+        # {label: [calls, wall, cpu, max_wall]}
+        self.entries = {}
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time()
+
+    def add(self, label, wall, cpu):
+        """ Add a single wall/cpu time (in seconds) to a label's totals. """
+        entry = self.entries.get(label, None)
+        if entry is None:
+            self.entries[label] = [1, wall, cpu, wall]
+            return
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] += cpu
+        if wall > entry[3]:
+            entry[3] = wall
+
+    def as_dict(self):
+        """ Return a JSON-friendly dict of all timings, in seconds. """
+        return {
+            'total': {
+                'wall': time.perf_counter() - self.started,
+                'cpu': time.process_time() - self.started_cpu,
+            },
+            'timings': [
+                {
+                    'label': label,
+                    'calls': calls,
+                    'wall': wall,
+                    'cpu': cpu,
+                    'max_wall': maxwall,
+                }
+                for label, (calls, wall, cpu, maxwall) in self.entries.items()
+            ],
+        }
+
+    def clear(self):
+        """ Remove all timings, and restart the total run time. """
+        self.entries.clear()
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time()
+
+    def format_table(self):
+        """ Format all timings as a table of milliseconds. """
+        timingd = self.as_dict()
+        labelwidth = max(
+            [len(t['label']) for t in timingd['timings']] + [len('total')]
+        )
+        fmt = '    {:<{lw}} {:>8} {:>12} {:>12} {:>12}'
+        lines = [
+            'Timings (milliseconds):',
+            fmt.format(
+                'label', 'calls', 'wall', 'cpu', 'max wall',
+                lw=labelwidth,
+            ),
+        ]
+        for t in timingd['timings']:
+            lines.append(fmt.format(
+                t['label'],
+                t['calls'],
+                '{:.3f}'.format(t['wall'] * 1000),
+                '{:.3f}'.format(t['cpu'] * 1000),
+                '{:.3f}'.format(t['max_wall'] * 1000),
+                lw=labelwidth,
+            ))
+        lines.append(fmt.format(
+            'total',
+            '',
+            '{:.3f}'.format(timingd['total']['wall'] * 1000),
+            '{:.3f}'.format(timingd['total']['cpu'] * 1000),
+            '',
+            lw=labelwidth,
+        ))
+        return '\n'.join(lines)
+
+    def report(self, filename=None, file=None):
+        """ Print the timing table to `file` (stderr by default), and write
+            JSON to `filename` if it is set ('-' means stdout).
+            Returns True on success, or False if the JSON couldn't be written.
+        """
+        print('\n{}'.format(self.format_table()), file=file or sys.stderr)
+        if not filename:
+            return True
+        jsonstr = json.dumps(self.as_dict(), indent=4)
+        if filename == '-':
+            print(jsonstr)
+            return True
+        try:
+            with open(filename, 'w') as f:
+                f.write(jsonstr)
+                f.write('\n')
+        except EnvironmentError as ex:
+            print(
+                'Unable to write timings: {}\n  {}'.format(filename, ex),
+                file=sys.stderr,
+            )
+            return False
+        return True
+
+    @contextmanager
+    def timed(self, label):
+        """ Context manager that adds the wall/cpu time spent in its block
+            to `label`'s totals, even if an exception is raised.
+        """
+        wallstart = time.perf_counter()
+        cpustart = time.process_time()
+        try:
+            yield self
+        finally:
+            self.add(
+                label,
+                time.perf_counter() - wallstart,
+                time.process_time() - cpustart,
+            )
@@ -0,0 +1,278 @@
+""" Span tracing for New.
+    Records nested spans (start, duration, attributes) for a run and exports
+    them as JSON lines, enabled with --trace FILE or the NEW_TRACE
+    environment variable.
+
+    Each line is a Chrome trace "complete" event, so the file can be
+    converted for chrome://tracing or Perfetto with:
+        python3 -m plugins._trace trace.jsonl trace.json
+
+    Several processes may append to the same file. Timestamps are based on
+    the epoch, so spans from parallel runs line up on one timeline.
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Environment variable that enables tracing, when --trace is not used.
+TRACE_ENV = 'NEW_TRACE'
+
+
+class NullSpan(object):
+    """ A span that does nothing, used when tracing is disabled. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ex_type, ex_value, ex_tb):
+        return False
+
+    def set(self, **attrs):
+        return self
+
+
+# Shared do-nothing span, to keep disabled tracing cheap.
+null_span = NullSpan()
+
+
+class Span(object):
+    """ A single traced span. Use it as a context manager, and add
+        attributes with set().
+    """
+
+    def __init__(self, tracer, name, attrs=None):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = dict(attrs or {})
+        self.span_id = None
+        self.parent_id = None
+        self.start = None
+        self.start_epoch = None
+
+    def __enter__(self):
+        self.tracer.push(self)
+        self.start_epoch = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, ex_type, ex_value, ex_tb):
+        duration = time.perf_counter() - self.start
+        if ex_type is not None:
+            self.attrs.setdefault('outcome', 'exception')
+            self.attrs['exception'] = ex_type.__name__
+        self.tracer.pop(self, duration)
+        return False
+
+    def set(self, **attrs):
+        """ Set attributes for this span. """
+        self.attrs.update(attrs)
+        return self
+
+
+class Tracer(object):
+    """ Collects finished spans and writes them to a JSON-lines file.
+        Spans are buffered, and flushed every `flush_size` spans so that
+        memory stays bounded for big runs.
+    """
+    flush_size = 500
+
+    def __init__(self):
+        self.filename = None
+        self.buffer = []
+        self.pid = os.getpid()
+        self.last_id = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.atexit_registered = False
+
+    @property
+    def enabled(self):
+        return self.filename is not None
+
+    def close(self):
+        """ Flush any remaining spans, and disable tracing. """
+        if not self.enabled:
+            return None
+        self.flush()
+        self.filename = None
+
+    def current(self):
+        """ Return the innermost open span for this thread.
+            If tracing is disabled, or no span is open, a NullSpan is
+            returned so attributes can always be set.
+        """
+        if not self.enabled:
+            return null_span
+        stack = self.get_stack()
+        return stack[-1] if stack else null_span
+
+    def enable(self, filename):
+        """ Enable tracing, appending spans to `filename`. """
+        if not filename:
+            return None
+        if self.enabled:
+            self.flush()
+        self.filename = filename
+        self.pid = os.getpid()
+        if not self.atexit_registered:
+            atexit.register(self.close)
+            self.atexit_registered = True
+
+    def enable_from_env(self):
+        """ Enable tracing if NEW_TRACE is set in the environment. """
+        self.enable(os.environ.get(TRACE_ENV, None))
+
+    def flush(self):
+        """ Append all buffered spans to the trace file. """
+        with self.lock:
+            lines, self.buffer = self.buffer, []
+        if not (lines and self.filename):
+            return None
+        data = ''.join(lines).encode()
+        try:
+            fd = os.open(
+                self.filename,
+                os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                0o644,
+            )
+            try:
+                # One write per flush keeps lines from parallel processes
+                # from interleaving.
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except EnvironmentError as ex:
+            print(
+                'Unable to write trace: {}\n  {}'.format(self.filename, ex),
+                file=sys.stderr,
+            )
+            self.filename = None
+
+    def get_stack(self):
+        """ Get the open span stack for this thread. """
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def pop(self, span, duration):
+        """ Close a span, and buffer its event. """
+        stack = self.get_stack()
+        if stack and (stack[-1] is span):
+            stack.pop()
+        args = {
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+        }
+        args.update(span.attrs)
+        event = {
+            'name': span.name,
+            'cat': 'new',
+            'ph': 'X',
+            'ts': round(span.start_epoch * 1000000),
+            'dur': round(duration * 1000000),
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        line = '{}\n'.format(json.dumps(event, default=str))
+        with self.lock:
+            self.buffer.append(line)
+            buflen = len(self.buffer)
+        if buflen >= self.flush_size:
+            self.flush()
+
+    def push(self, span):
+        """ Open a span, setting its id and parent id. """
+        stack = self.get_stack()
+        with self.lock:
+            self.last_id += 1
+            span.span_id = self.last_id
+        span.parent_id = stack[-1].span_id if stack else None
+        stack.append(span)
+
+    def set(self, **attrs):
+        """ Set attributes on the current span, if any. """
+        return self.current().set(**attrs)
+
+    def span(self, name, **attrs):
+        """ Return a new span context manager, or a NullSpan if tracing is
+            disabled.
+        """
+        if not self.enabled:
+            return null_span
+        return Span(self, name, attrs)
+
+    def traced(self, name=None, outcome=None):
+        """ Decorator that runs a function inside a span.
+            Arguments:
+                name    : Span name. Default: the function name.
+                outcome : A callable that receives the function's return
+                          value, and returns the 'outcome' attribute.
+        """
+        def decorator(func):
+            spanname = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with Span(self, spanname) as span:
+                    result = func(*args, **kwargs)
+                    if outcome is not None:
+                        span.attrs.setdefault('outcome', outcome(result))
+                return result
+            return wrapper
+        return decorator
+
+
+def convert_to_chrome(filenames, outfile):
+    """ Convert JSON-lines trace files into one Chrome trace (JSON object
+        format) file, which chrome://tracing and Perfetto can load.
+        Bad lines (from an interrupted run) are skipped.
+        Returns the number of events written.
+    """
+    events = []
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+    events.sort(key=lambda e: e.get('ts', 0))
+    with open(outfile, 'w') as f:
+        json.dump(
+            {'traceEvents': events, 'displayTimeUnit': 'ms'},
+            f,
+        )
+    return len(events)
+
+
+def main(args):
+    """ Convert trace files from the command line. """
+    if len(args) < 2:
+        print(
+            'Usage: python3 -m plugins._trace TRACE_FILE... OUTPUT_FILE',
+            file=sys.stderr,
+        )
+        return 1
+    try:
+        count = convert_to_chrome(args[:-1], args[-1])
+    except EnvironmentError as ex:
+        print('Unable to convert trace:\n  {}'.format(ex), file=sys.stderr)
+        return 1
+    print('Wrote {} events to: {}'.format(count, args[-1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,220 @@
+""" Syntax validation for New's generated content.
+    Content is checked before it is written, while it is still in memory.
+    Python and JSON are checked in-process (compile(), json.loads()).
+    Shell scripts and C files need a tool, so each tool checks a whole
+    batch of files in one process (see: check_bash(), check_cc()).
+"""
+
+import json
+import os
+import re
+import tempfile
+
+from ._commands import run_command, run_commands
+
+# Where `cc` reports an error: path:line:column: error: message
+CC_ERROR_PAT = re.compile(
+    r'^(?P<path>.+?):(?P<line>\d+):(?:\d+:)? (?:fatal )?error: (?P<msg>.+)$'
+)
+# Where `bash -n` reports an error: path: line N: message
+BASH_ERROR_PAT = re.compile(r'^.+?: line (?P<line>\d+): (?P<msg>.+)$')
+
+
+def check_bash(files, tmpdir, jobs=None):
+    """ Check shell script syntax with `bash -n`.
+        `bash -n` only checks one script, so every file is wrapped in a
+        function in one combined script, and only a combined script that
+        fails is checked again one file at a time (in parallel), for exact
+        error reports.
+        Arguments:
+            files  : A list of (filename, content).
+            tmpdir : Directory for the temporary scripts.
+            jobs   : Max number of processes for the per-file checks.
+        Returns a dict of {filename: [error_message, ..]}.
+    """
+    lines = []
+    for i, (_, content) in enumerate(files):
+        lines.append('__new_validate_{}() {{'.format(i))
+        lines.append(content.rstrip('\n'))
+        lines.append(':\n}')
+    combined = os.path.join(tmpdir, 'combined.sh')
+    with open(combined, 'w') as f:
+        f.write('\n'.join(lines))
+    result = run_command(['bash', '-n', combined])
+    if result.error is not None:
+        raise result.error
+    if result.ok:
+        return {}
+
+    tmppaths = write_temp_files(files, os.path.join(tmpdir, 'bash'))
+    results = run_commands(
+        (['bash', '-n', tmppath] for tmppath in tmppaths),
+        jobs=jobs,
+    )
+    errors = {}
+    for (filename, _), result in zip(files, results):
+        if result.ok:
+            continue
+        msgs = []
+        for line in result.output.splitlines():
+            match = BASH_ERROR_PAT.match(line)
+            if match is None:
+                continue
+            msgs.append('line {}: {}'.format(
+                match.group('line'),
+                match.group('msg'),
+            ))
+        errors[filename] = msgs or [result.output.strip()]
+    return errors
+
+
+def check_cc(files, tmpdir, jobs=None):
+    """ Check C syntax for all files in one `cc -fsyntax-only` process.
+        Headers from the same batch can be included, along with headers in
+        the directories the files will be written to.
+        Arguments:
+            files  : A list of (filename, content).
+            tmpdir : Directory for the temporary files.
+            jobs   : Not used, there is only one process.
+        Returns a dict of {filename: [error_message, ..]}.
+    """
+    tmppaths = write_temp_files(files, os.path.join(tmpdir, 'cc'))
+    includes = []
+    for (filename, _), tmppath in zip(files, tmppaths):
+        for dirpath in (os.path.dirname(tmppath), os.path.dirname(filename)):
+            incarg = '-I{}'.format(dirpath or '.')
+            if incarg not in includes:
+                includes.append(incarg)
+    result = run_command(['cc', '-fsyntax-only'] + includes + tmppaths)
+    if result.error is not None:
+        raise result.error
+    if result.ok:
+        return {}
+
+    filenames = {
+        tmppath: filename
+        for (filename, _), tmppath in zip(files, tmppaths)
+    }
+    errors = {}
+    for line in result.output.splitlines():
+        match = CC_ERROR_PAT.match(line)
+        if match is None:
+            continue
+        filename = filenames.get(match.group('path'), match.group('path'))
+        errors.setdefault(filename, []).append('line {}: {}'.format(
+            match.group('line'),
+            match.group('msg'),
+        ))
+    if not errors:
+        # Errors that could not be matched to a file.
+        errors[files[0][0]] = [result.output.strip()]
+    return errors
+
+
+def check_json(filename, content):
+    """ Check JSON syntax with json.loads().
+        Returns a list of error messages.
+    """
+    try:
+        json.loads(content)
+    except ValueError as ex:
+        return ['line {}: {}'.format(
+            getattr(ex, 'lineno', '?'),
+            getattr(ex, 'msg', str(ex)),
+        )]
+    return []
+
+
+def check_python(filename, content):
+    """ Check Python syntax with compile().
+        Returns a list of error messages.
+    """
+    try:
+        compile(content, filename, 'exec', dont_inherit=True)
+    except SyntaxError as ex:
+        return ['line {}: {}'.format(ex.lineno, ex.msg)]
+    except ValueError as ex:
+        # Null bytes in the source.
+        return [str(ex)]
+    return []
+
+
+# In-process checks, by file extension.
+# Each is called with (filename, content), and returns error messages.
+CONTENT_CHECKS = {
+    '.json': check_json,
+    '.py': check_python,
+}
+
+# Batch checks that need a tool, by file extension.
+# Each is called with ([(filename, content), ..], tmpdir, jobs), and
+# returns {filename: [error_message, ..]}.
+BATCH_CHECKS = {
+    '.bash': check_bash,
+    '.c': check_cc,
+    '.h': check_cc,
+    '.sh': check_bash,
+}
+
+
+def validate_files(files, jobs=None, on_missing=None):
+    """ Check the syntax of generated content for files, by extension.
+        Files with no known check are skipped.
+        Arguments:
+            files      : An iterable of (filename, content).
+            jobs       : Max number of processes for checks that need them.
+            on_missing : A callable that receives (check_name, exception)
+                         when a check's tool could not be run.
+                         The files for that check are not validated.
+        Returns a dict of {filename: [error_message, ..]} for bad files.
+    """
+    errors = {}
+    # {batch_check: [(filename, content), ..]}
+    batches = {}
+    for filename, content in files:
+        _, ext = os.path.splitext(filename)
+        check = CONTENT_CHECKS.get(ext, None)
+        if check is not None:
+            msgs = check(filename, content or '')
+            if msgs:
+                errors[filename] = msgs
+            continue
+        check = BATCH_CHECKS.get(ext, None)
+        if check is not None:
+            batches.setdefault(check, []).append((filename, content or ''))
+    if not batches:
+        return errors
+
+    with tempfile.TemporaryDirectory(prefix='new-validate-') as tmpdir:
+        for check, checkfiles in batches.items():
+            try:
+                errors.update(check(checkfiles, tmpdir, jobs=jobs))
+            except EnvironmentError as ex:
+                if on_missing is not None:
+                    on_missing(check.__name__, ex)
+    return errors
+
+
+def write_temp_files(files, tmpdir):
+    """ Write content to temporary files, keeping the base names so
+        errors and includes make sense. Files that will be written to the
+        same directory are kept together.
+        Returns a list of temporary file paths, in the same order as `files`.
+    """
+    # {destination_dir: temp_subdir}
+    subdirs = {}
+    tmppaths = []
+    for filename, content in files:
+        dirpath, basename = os.path.split(os.path.abspath(filename))
+        subdir = subdirs.get(dirpath, None)
+        if subdir is None:
+            subdir = subdirs[dirpath] = os.path.join(
+                tmpdir,
+                str(len(subdirs)),
+            )
+            os.makedirs(subdir)
+        tmppath = os.path.join(subdir, basename)
+        with open(tmppath, 'w') as f:
+            f.write(content)
+        tmppaths.append(tmppath)
+    return tmppaths
@@ -158,5 +158,9 @@ class AsmPlugin(Plugin):
             if s
         ]
 
+    def reset(self):
+        """ Clear the makefile args from the last file. """
+        self.automakefile_args = []
+
 
 exports = (AsmPlugin, )
@@ -3,7 +3,7 @@
     -Christopher Welborn 2-20-15
 """
 import os.path
-from plugins import Plugin, date, fix_author, SignalAction
+from plugins import Plugin, date, fix_author, pool, SignalAction
 
 
 __version__ = '0.3.4'
@@ -161,9 +161,11 @@ class CPlugin(Plugin):
                     filename = '{}.h'.format(filename)
                     break
             self.debug('Switching to CHeader mode: {}'.format(filename))
+            headerplugin = pool.get(CHeaderPlugin)
+            headerplugin.reset()
             raise SignalAction(
                 filename=filename,
-                content=CHeaderPlugin().create(filename),
+                content=headerplugin.create(filename),
                 ignore_post={'automakefile', 'chmodx'},
             )
 
@@ -0,0 +1,170 @@
+""" Formatter post-processing plugin for New.
+    Runs code formatters (black, clang-format, shfmt, ..) on new files.
+    Files are grouped by formatter command, each command gets as many files
+    as will fit on it's command line, and the commands are run side by
+    side with a limited number of processes.
+
+    This is disabled unless it is enabled in config, where the formatters
+    can also be changed:
+        "format": {
+            "enabled": true,
+            // Max number of formatter processes at once (default: cpus).
+            "jobs": 4,
+            // {extension: command}, file names are added to the command.
+            // null disables a default formatter.
+            "formatters": {
+                ".py": ["ruff", "format", "-q"],
+                ".sh": null
+            }
+        }
+"""
+import os
+
+from plugins import chunk_args, PostPlugin, run_commands, SignalExit
+
+# Default formatter commands, by file extension.
+FORMATTERS = {
+    '.c': ['clang-format', '-i'],
+    '.h': ['clang-format', '-i'],
+    '.py': ['black', '-q'],
+    '.sh': ['shfmt', '-w'],
+}
+
+
+class FormatterPlugin(PostPlugin):
+
+    name = 'format'
+    version = '0.0.1'
+    multifile = True
+
+    docopt = True
+    usage = """
+    Usage:
+        format FILENAME...
+
+    Options:
+        FILENAME  : File names to format, based on their extension.
+    """
+
+    def __init__(self):
+        self.load_config()
+
+    def format_files(self, paths):
+        """ Run the formatters for all file paths, with as few processes
+            as possible.
+            Returns the number of files that were formatted.
+        """
+        # [(formatter_cmd, file_paths), ..], for each process.
+        batches = []
+        for cmd, cmdpaths in self.group_by_formatter(paths).items():
+            batches.extend(
+                (list(cmd), chunk)
+                for chunk in chunk_args(cmd, cmdpaths)
+            )
+        jobs = self.get_jobs()
+        self.debug('Running {} formatter {}, {} at a time.'.format(
+            len(batches),
+            'command' if len(batches) == 1 else 'commands',
+            jobs,
+        ))
+        results = run_commands(
+            (cmd + chunk for cmd, chunk in batches),
+            jobs=jobs,
+        )
+        formatted = 0
+        errors = []
+        missing = set()
+        for (cmd, chunk), result in zip(batches, results):
+            if result.error is not None:
+                if cmd[0] not in missing:
+                    missing.add(cmd[0])
+                    self.print_err('Formatter not available: {}\n{}'.format(
+                        cmd[0],
+                        result.error,
+                    ))
+                continue
+            if not result.ok:
+                errors.append('{} failed ({}):\n{}'.format(
+                    cmd[0],
+                    result.returncode,
+                    result.output.strip(),
+                ))
+                continue
+            formatted += len(chunk)
+        if errors:
+            raise ValueError('\n'.join(errors))
+        return formatted
+
+    def get_formatters(self):
+        """ Return the formatter commands, {extension: command}, with the
+            defaults updated from config.
+        """
+        formatters = getattr(self, '_formatters', None)
+        if formatters is not None:
+            return formatters
+        formatters = dict(FORMATTERS)
+        for ext, cmd in self.config.get('formatters', {}).items():
+            ext = ext if ext.startswith('.') else '.{}'.format(ext)
+            if not cmd:
+                formatters.pop(ext, None)
+                continue
+            formatters[ext] = [cmd] if isinstance(cmd, str) else list(cmd)
+        self._formatters = formatters
+        return formatters
+
+    def get_jobs(self):
+        """ Return the max number of formatter processes to run at once. """
+        try:
+            jobs = int(self.config.get('jobs', 0))
+        except (TypeError, ValueError):
+            jobs = 0
+        return jobs if jobs > 0 else (os.cpu_count() or 1)
+
+    def group_by_formatter(self, paths):
+        """ Group file paths by their formatter command.
+            Files with no formatter are skipped.
+            Returns a dict of {command_tuple: [path, ..]}.
+        """
+        formatters = self.get_formatters()
+        bycmd = {}
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            _, ext = os.path.splitext(path)
+            cmd = formatters.get(ext, None)
+            if not cmd:
+                continue
+            bycmd.setdefault(tuple(cmd), []).append(path)
+        return bycmd
+
+    def process(self, plugin, path):
+        """ Formats the new file, based on it's extension. """
+        return self.process_multi(plugin, [path])
+
+    def process_multi(self, plugin, paths):
+        """ Formats the new files, based on their extensions. """
+        if not self.config.get('enabled', False):
+            self.debug('Not enabled in config.')
+            return 0
+        formatted = self.format_files(paths)
+        if formatted:
+            self.print_status('Formatted {} {}'.format(
+                formatted,
+                'file' if formatted == 1 else 'files',
+            ))
+        return 0
+
+    def run(self):
+        """ Format files from the command line. """
+        try:
+            formatted = self.format_files(self.argd['FILENAME'])
+        except ValueError as ex:
+            raise SignalExit(str(ex))
+        self.print_status('Formatted {} {}'.format(
+            formatted,
+            'file' if formatted == 1 else 'files',
+        ))
+        return 0
+
+
+exports = (FormatterPlugin,)
@@ -0,0 +1,155 @@
+""" GitAdd post-processing plugin for New.
+    Stages new files in their git repository.
+    All of the files from a run are grouped by repository, and added with
+    one `git add` for each repository (split into chunks when the command
+    line would be too long), instead of one `git add` for each file.
+    Files are collected from every plugin group in the run, and staged when
+    the post plugins are flushed (see: PostPlugin.flush).
+    It is deferred, so files are staged after other post plugins (like
+    format) are done with them.
+
+    This is disabled unless it is enabled in config:
+        "gitadd": {
+            "enabled": true
+        }
+"""
+import os
+
+from plugins import (
+    chunk_args,
+    DeferredPostPlugin,
+    run_command,
+    SignalExit,
+)
+
+
+def find_repo(dirpath, repos=None):
+    """ Find the top level of the git repo that `dirpath` is in, by
+        looking for .git in it and it's parents (no git process is needed).
+        Arguments:
+            dirpath : Directory to start looking in.
+            repos   : A dict of {dirpath: repo_dir} to cache lookups in.
+        Returns the repo directory, or None if it's not in a repo.
+    """
+    if repos is None:
+        repos = {}
+    checked = []
+    repodir = None
+    while True:
+        if dirpath in repos:
+            repodir = repos[dirpath]
+            break
+        checked.append(dirpath)
+        if os.path.exists(os.path.join(dirpath, '.git')):
+            repodir = dirpath
+            break
+        parentdir = os.path.dirname(dirpath)
+        if parentdir == dirpath:
+            break
+        dirpath = parentdir
+    for checkeddir in checked:
+        repos[checkeddir] = repodir
+    return repodir
+
+
+class GitAddPlugin(DeferredPostPlugin):
+
+    name = 'gitadd'
+    version = '0.0.1'
+    multifile = True
+
+    docopt = True
+    usage = """
+    Usage:
+        gitadd FILENAME...
+
+    Options:
+        FILENAME  : File names to stage in their git repos.
+    """
+
+    def __init__(self):
+        self.load_config()
+        # Files to stage when the run is done (see: flush()).
+        self.pending = []
+
+    def flush(self):
+        """ Stage the files from every plugin group in the run. """
+        paths, self.pending = self.pending, []
+        if not paths:
+            return None
+        staged = self.git_add(paths)
+        if staged:
+            self.print_status('Staged {} {} (git add)'.format(
+                staged,
+                'file' if staged == 1 else 'files',
+            ))
+        return None
+
+    def git_add(self, paths):
+        """ Stage files in their git repos, with as few `git add` calls as
+            possible.
+            Returns the number of files that were staged.
+        """
+        byrepo = self.group_by_repo(paths)
+        staged = 0
+        for repodir, repopaths in byrepo.items():
+            cmd = ['git', '-C', repodir, 'add', '--']
+            for chunk in chunk_args(cmd, repopaths):
+                self.debug('Running: {} ({} files)'.format(
+                    ' '.join(cmd),
+                    len(chunk),
+                ))
+                result = run_command(cmd + chunk)
+                if result.error is not None:
+                    raise result.error
+                if not result.ok:
+                    raise ValueError('git add failed in {}:\n{}'.format(
+                        repodir,
+                        result.output.strip(),
+                    ))
+                staged += len(chunk)
+        return staged
+
+    def group_by_repo(self, paths):
+        """ Group file paths by the git repo they are in.
+            Files that are not in a repo are skipped.
+            Returns a dict of {repo_dir: [path, ..]}.
+        """
+        repos = {}
+        byrepo = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            repodir = find_repo(os.path.dirname(path), repos=repos)
+            if repodir is None:
+                self.debug('Not in a git repo: {}'.format(path))
+                continue
+            byrepo.setdefault(repodir, []).append(path)
+        return byrepo
+
+    def process(self, plugin, path):
+        """ Collects the new file, to stage it when the run is done. """
+        return self.process_multi(plugin, [path])
+
+    def process_multi(self, plugin, paths):
+        """ Collects the new files, to stage them all when the run is done.
+        """
+        if not self.config.get('enabled', False):
+            self.debug('Not enabled in config.')
+            return 0
+        self.pending.extend(paths)
+        return 0
+
+    def run(self):
+        """ Stage files in their git repos from the command line. """
+        try:
+            staged = self.git_add(self.argd['FILENAME'])
+        except (EnvironmentError, ValueError) as ex:
+            raise SignalExit(str(ex))
+        self.print_status('Staged {} {} (git add)'.format(
+            staged,
+            'file' if staged == 1 else 'files',
+        ))
+        return 0
+
+
+exports = (GitAddPlugin,)
@@ -1,7 +1,7 @@
 """ Html plugin for New.
     -Christopher Welborn 12-25-14
 """
-from plugins import Plugin, SignalExit
+from plugins import Plugin, pool, SignalExit
 from plugins.jquerydl import JQueryDownloadPost
 
 template = """<!DOCTYPE html>
@@ -147,11 +147,12 @@ class JQueryPlugin(Plugin):
             self.ignore_deferred.add('jquerydl')
         else:
             # Set an attribute for the jquerydl plugin.
-            jquerydl = JQueryDownloadPost()
+            jquerydl = pool.get(JQueryDownloadPost)
             if self.argd['VERSION']:
                 self.jquery_ver = self.argd['VERSION']
             else:
-                verinfo = jquerydl.get_jquery_latest()
+                with self.timed('get_jquery_latest'):
+                    verinfo = jquerydl.get_jquery_latest()
                 if not verinfo:
                     raise SignalExit('Unable to get jquery version!')
                 self.jquery_ver = list(verinfo.keys())[0]
@@ -172,5 +173,9 @@ class JQueryPlugin(Plugin):
         }
         return template.format(**template_args)
 
+    def reset(self):
+        """ Clear the jquery version from the last file. """
+        self.jquery_ver = None
+
 
 exports = (HtmlPlugin, JQueryPlugin)
@@ -1,5 +1,10 @@
 """ jQuery download, post-processing plugin for New.
     Downloads jQuery for the jQuery plugin.
+    Partial downloads are resumed, and downloads are verified when their
+    integrity strings are set in config:
+        "jquerydl": {
+            "integrity": {"3.7.1": "sha256-<base64 digest>"}
+        }
     -Christopher Welborn 12-25-14
 """
 import os
@@ -7,9 +12,23 @@ import os
 
 from lxml import html
 from urllib import request
-from urllib.error import HTTPError
 
-from plugins import PostPlugin, print_inplace
+from plugins import (
+    cache,
+    check_integrity,
+    copy_file,
+    dir_lock,
+    download_file,
+    DownloadError,
+    get_post_option,
+    PostPlugin,
+    print_inplace,
+    reporter as output,
+)
+
+# Seconds to wait for the server before giving up on a connection or read.
+# Can be set in config with "url_timeout".
+URL_TIMEOUT = 30
 
 
 class JQueryDownloadPost(PostPlugin):
@@ -34,62 +53,92 @@ class JQueryDownloadPost(PostPlugin):
     """
 
     def create_dl_reporter(self):
-        """ Create a download reporter that tracks the total bytes read so far.
+        """ Create a download reporter for plugins.download_file().
             Returns: A reporter function that will print download status.
         """
-        readtotal = 0
         name = self.get_name()
 
-        def reporter(blocknum, readsize, totalsize):
+        def reporter(readtotal, totalsize):
             """ Print number of bytes read so far, in place. """
-            nonlocal name, readtotal
-            readtotal += readsize
-            if totalsize > 0:
-                sizefmt = '{}b/~{}b'.format(readsize, totalsize)
+            if not output.show_text():
+                return
+            if totalsize:
+                sizefmt = '{}b/~{}b'.format(readtotal, totalsize)
             else:
-                sizefmt = '{}b'.format(readsize)
+                sizefmt = '{}b'.format(readtotal)
             print_inplace('{:<15}: Downloading: {}'.format(name, sizefmt))
         return reporter
 
     def download_jquery(self, ver, dest):
-        """ Downloads a specific jquery version to the current directory.
-            Returns the file name on success, or None on failure.
+        """ Downloads a specific jquery version to `dest`, resuming a partial
+            download if there is one, and verifying it if it's integrity
+            string is known.
+            Returns the file name on success.
+            Raises DownloadError on failure.
         """
         url = 'http://code.jquery.com/{}'.format(self.get_jquery_file(ver))
         self.print_status('Downloading: {}\n'.format(url))
         try:
-            path, httpmsg = request.urlretrieve(
+            path = download_file(
                 url,
-                filename=dest,
-                reporthook=self.create_dl_reporter())
-            self.print_status('Download complete: {}'.format(path))
-        except HTTPError as ex:
-            msg = '\n'.join((
-                'Unable to download: {}',
-                '    {}'
-            )).format(url, ex)
-            if ex.code == 404:
-                msg = '\n'.join((
-                    msg,
+                dest,
+                integrity=self.get_integrity(ver),
+                timeout=self.get_url_timeout(),
+                reporter=self.create_dl_reporter(),
+            )
+        except DownloadError as ex:
+            if getattr(ex.msg, 'code', None) == 404:
+                ex.msg = '\n'.join((
+                    str(ex.msg),
                     'Use `new jquerydl --` to list known versions.'
                 ))
-            raise Exception(msg)
-
+            raise
+        self.print_status('Download complete: {}'.format(path))
         return path
 
     def ensure_jquery_version(self, ver, basedir):
         """ Ensures that a local copy of jquery-{ver}.min.js can be found.
             If ver is None, returns None.
-            If the file can't be found, it is downloaded.
-            If the download fails, errors are printed and None is returned.
+            If the file can't be found (or doesn't match it's known
+            integrity string), it is copied from the cache, which is where
+            it is downloaded to (the 'jquerydl' namespace).
+            The cache is locked while checking, downloading, and copying, so
+            parallel runs never download into the same file, and the copy is
+            only moved into place once it is complete.
             Returns the filepath if the file exists, and None if it doesn't.
         """
-        destname = os.path.join(basedir, self.get_jquery_file(ver))
-        if os.path.exists(destname):
-            self.debug('Exists: {}'.format(destname))
-            return destname
-
-        return self.download_jquery(ver, destname)
+        filename = self.get_jquery_file(ver)
+        destname = os.path.join(basedir, filename)
+        integrity = self.get_integrity(ver)
+        exists = os.path.exists(destname)
+        if exists:
+            if (not integrity) or check_integrity(destname, integrity):
+                self.debug('Exists: {}'.format(destname))
+                return destname
+            self.print_err('Existing file does not match: {}'.format(
+                destname
+            ))
+
+        store = cache.store(self.get_name())
+        cachedname = store.path(filename)
+        # Another run may have downloaded it while waiting for the lock.
+        with dir_lock(store.makedirs()):
+            cached = os.path.exists(cachedname) and (
+                (not integrity) or check_integrity(cachedname, integrity)
+            )
+            if cached:
+                self.debug('Using cached download: {}'.format(cachedname))
+                store.touch(filename)
+            else:
+                self.download_jquery(ver, cachedname)
+            try:
+                copy_file(cachedname, destname, overwrite=exists)
+            except FileExistsError:
+                # Another run copied it from the cache first.
+                self.debug('Created by another process: {}'.format(
+                    destname
+                ))
+        return destname
 
     def format_ver_info(self, ver, link):
         return '{:<16} - {}'.format(ver, link)
@@ -98,6 +147,12 @@ class JQueryDownloadPost(PostPlugin):
         """ Get jquery filename for download based on version number. """
         return 'jquery-{ver}.min.js'.format(ver=ver)
 
+    def get_integrity(self, ver):
+        """ Return the integrity string for a jquery version, from the
+            "integrity" config ({version: 'sha384-<base64>'}), or None.
+        """
+        return (get_post_option(self, 'integrity', None) or {}).get(ver, None)
+
     def get_jquery_latest(self, versioninfo=None):
         """ Return the version and link for the latest stable release
             available for download in the form of {version: dl_link}.
@@ -119,7 +174,10 @@ class JQueryDownloadPost(PostPlugin):
     def get_jquery_page(self):
         """ Return the html response from the jquery download page. """
         try:
-            response = request.urlopen(self.jquery_url)
+            response = request.urlopen(
+                self.jquery_url,
+                timeout=self.get_url_timeout(),
+            )
         except Exception as ex:
             self.print_err(
                 'Unable to connect to {}.\n{}'.format(self.jquery_url, ex))
@@ -161,6 +219,11 @@ class JQueryDownloadPost(PostPlugin):
             if is_dl_link(l)
         )
 
+    def get_url_timeout(self):
+        """ Return the connection/read timeout for downloads, in seconds.
+        """
+        return float(get_post_option(self, 'url_timeout', URL_TIMEOUT))
+
     def list_latest(self):
         """ Print the latest version of jquery available. """
         latestverinfo = self.get_jquery_latest()
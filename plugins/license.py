@@ -0,0 +1,126 @@
+""" License header transform plugin for New.
+    Adds a license/copyright header comment to the top of new files, before
+    they are written. The comment style is picked from the file extension,
+    and the header goes after any shebang, coding, or <?php line.
+    Files that already start with the header are left alone.
+
+    This is disabled unless it is enabled in config, where the header
+    can also be changed:
+        "license": {
+            "enabled": true,
+            // A string, or a list of lines. Format tags can be used, and
+            // {filename} is the new file's name.
+            "header": [
+                "Copyright (c) {year} {author}",
+                "SPDX-License-Identifier: MIT"
+            ],
+            // {extension: comment_prefix}, null skips an extension.
+            "comments": {
+                ".lisp": ";;",
+                ".txt": null
+            }
+        }
+"""
+import os
+import re
+from collections import ChainMap
+
+from plugins import get_template_tags, TemplateFormatter, TransformPlugin
+
+# Default comment prefixes, by file extension.
+COMMENTS = {
+    '.asm': ';',
+    '.bash': '#',
+    '.bats': '#',
+    '.c': '//',
+    '.cpp': '//',
+    '.h': '//',
+    '.hpp': '//',
+    '.js': '//',
+    '.lisp': ';;',
+    '.php': '//',
+    '.pl': '#',
+    '.py': '#',
+    '.rb': '#',
+    '.rs': '//',
+    '.s': ';',
+    '.sh': '#',
+}
+
+DEFAULT_HEADER = 'Copyright (c) {year} {author}'
+
+# Lines that must stay at the top of a file, before the header.
+PREAMBLE_PAT = re.compile(r'^(#!|<\?php\b|#.*coding[:=])')
+
+
+class LicenseTransform(TransformPlugin):
+
+    name = 'license'
+    version = '0.0.1'
+    description = 'Adds a license header comment to new files.'
+    # Run after most transforms, so the header isn't changed by them.
+    order = 90
+
+    def __init__(self):
+        self.load_config()
+
+    def get_comment(self, filename):
+        """ Return the comment prefix for a file name, or None if the file
+            type has no known comment style.
+        """
+        ext = os.path.splitext(filename)[-1].lower()
+        comments = dict(COMMENTS)
+        comments.update(self.config.get('comments', None) or {})
+        return comments.get(ext, None)
+
+    def get_header(self, filename):
+        """ Return the formatted header lines for a file name. """
+        header = self.config.get('header', None) or DEFAULT_HEADER
+        if not isinstance(header, str):
+            header = '\n'.join(header)
+        headerfmt, badtags = TemplateFormatter().render(
+            header,
+            ChainMap(
+                {'filename': os.path.split(filename)[-1]},
+                get_template_tags(),
+            ),
+        )
+        for tagname, linenum, column in badtags:
+            self.debug('Unknown format tag: {{{}}} ({}:{})'.format(
+                tagname,
+                linenum,
+                column,
+            ))
+        return headerfmt.splitlines()
+
+    def handles(self, filename):
+        """ Only files with a known comment style are handled. """
+        return self.get_comment(filename) is not None
+
+    def transform(self, plugin, filename, content):
+        """ Insert the license header after any preamble lines. """
+        if not self.config.get('enabled', False):
+            self.debug('License plugin not enabled.')
+            return content
+        comment = self.get_comment(filename)
+        header = [
+            ' '.join((comment, line)).rstrip()
+            for line in self.get_header(filename)
+        ]
+        lines = content.splitlines(True)
+        start = 0
+        while (start < len(lines)) and PREAMBLE_PAT.match(lines[start]):
+            start += 1
+        existing = [line.rstrip() for line in lines[start:start + len(header)]]
+        if existing == header:
+            self.debug('Header already in: {}'.format(filename))
+            return content
+        self.debug('Adding header to: {}'.format(filename))
+        headerlines = ['{}\n'.format(line) for line in header]
+        if start and lines[start - 1][-1:] != '\n':
+            # The preamble is the whole file, with no newline at the end.
+            lines[start - 1] = '{}\n'.format(lines[start - 1])
+        return ''.join(lines[:start] + headerlines + lines[start:])
+
+
+exports = (LicenseTransform,)
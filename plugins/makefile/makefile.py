@@ -7,7 +7,10 @@ import os.path
 
 from .. import (
     confirm,
+    dir_lock,
+    write_file_atomic,
     Plugin,
+    pool,
     PostPlugin,
     SignalAction,
     SignalExit
@@ -45,7 +48,18 @@ class MakefilePost(PostPlugin):
         self.create_makefile(filepaths, plugin)
 
     def create_makefile(self, filepaths, plugin):
-        """ Create a basic Makefile with the file as it's target. """
+        """ Create a basic Makefile with the file as it's target.
+            The directory is locked while checking for and writing the
+            makefile, so parallel runs in the same directory create only one.
+        """
+        parentdir = os.path.split(filepaths[0])[0]
+        with dir_lock(parentdir):
+            return self.create_makefile_locked(filepaths, plugin)
+
+    def create_makefile_locked(self, filepaths, plugin):
+        """ Create a basic Makefile with the file as it's target.
+            This should be called with the makefile's directory locked.
+        """
         filepath = filepaths[0]
         parentdir, filename = os.path.split(filepath)
         trynames = 'Makefile', 'makefile', 'MakeFile'
@@ -85,7 +99,7 @@ class MakefilePost(PostPlugin):
             ))
 
         # Use default MakeFilePlugin config.
-        config = MakefilePlugin().config
+        config = pool.get(MakefilePlugin).config
         # Makefile name.
         makefilename = config.get(
             'default_filename',
@@ -107,8 +121,11 @@ class MakefilePost(PostPlugin):
                 config=config,
             )
 
-        with open(makefile, 'w') as f:
-            f.write(content)
+        try:
+            write_file_atomic(makefile, content)
+        except FileExistsError:
+            self.debug('Makefile already exists: {}'.format(makefile))
+            return None
         self.print_status('Created {}'.format(makefile))
         return makefile
 
@@ -122,6 +139,8 @@ class MakefilePlugin(Plugin):
     version = VERSION
     ignore_post = {'chmodx'}
     multifile = True
+    # Recipes must be indented with tabs, whatever the user's config says.
+    output_options = {'indent': 'keep'}
 
     description = 'Creates a makefile for a given c, cpp, nasm, or rust file.'
 
@@ -9,6 +9,7 @@ from .. import (
     date,
     debug,
     fix_author,
+    open_text,
     SignalExit,
 )
 
@@ -76,7 +77,7 @@ def template_load(filepath, argd):
     lang, template_file = choose_template(filepath, argd=argd)
     try:
         lines = []
-        with open(template_file, 'r') as f:
+        with open_text(template_file) as f:
             for line in f:
                 if line.startswith('#!'):
                     continue
@@ -7,13 +7,36 @@
     -Christopher Welborn 01-26-2016
 """
 
+import base64
+import errno
+import hashlib
+import http.server
+import io
+import json
 import os
 import socket
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+import zipfile
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import mock
+
+from colr import docopt as colr_docopt
 
 # If this fails we have problems.
 import plugins
+import new
+from plugins._profile import (
+    collapsed_stacks,
+    format_collapsed,
+    is_plugin_file,
+    MemProfiler,
+)
 
 # Can be set for more output.
 plugins.DEBUG = False
@@ -139,6 +162,671 @@ class NewTest(unittest.TestCase):
             )
         )
 
+    def test_bad_tags_exit(self):
+        """ Custom and skeleton plugins should report unknown format tags
+            with the same message.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            skeleton = plugins.create_custom_plugin(
+                ['testskeleton'],
+                {'filename': tmpdir},
+            )()
+            with self.assertRaises(plugins.SignalExit) as cm:
+                skeleton.render_template('README.template', 'x {nope}')
+        skeletonmsg = str(cm.exception)
+        custom = plugins.create_custom_plugin(
+            ['testcustom'],
+            {'content': 'x {nope}', 'formatted': True},
+        )()
+        with self.assertRaises(plugins.SignalExit) as cm:
+            custom.format_content('x {nope}')
+        custommsg = str(cm.exception)
+        self.assertEqual(
+            skeletonmsg.splitlines()[0],
+            'Unknown format tag in testskeleton\'s template, '
+            'README.template:',
+        )
+        self.assertEqual(
+            custommsg.splitlines()[:2],
+            ['Unknown format tag in testcustom\'s content:', "    'x {nope}'"],
+        )
+        for msg in (skeletonmsg, custommsg):
+            self.assertIn('    Line 1, column 3: {nope}', msg)
+            self.assertIn('allow_bad_tags', msg)
+
+    def test_bundle(self):
+        """ build_bundle() should write a zipapp with bytecode next to each
+            module, a config snapshot, and a plugin manifest.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'new.pyz')
+            manifest = plugins.build_bundle(
+                filename,
+                os.path.join(SCRIPTDIR, 'new.py'),
+                PLUGINDIR,
+                {'plugins': {'global': {'author': 'Bundled'}}},
+                modules=['bash'],
+            )
+            self.assertEqual(manifest['modules'], ['bash'])
+            with zipfile.ZipFile(filename) as zf:
+                names = set(zf.namelist())
+                config = zf.read('new.json').decode('utf-8')
+            pycnames = (
+                '__main__.pyc',
+                'new.pyc',
+                'plugins/__init__.pyc',
+                'plugins/bash.pyc',
+            )
+            for name in pycnames:
+                self.assertIn(name, names)
+            self.assertIn('plugins/bundle.json', names)
+            self.assertIn('plugins/makefile/c.makefile', names)
+            self.assertIn('Bundled', config)
+            self.assertFalse(any('__pycache__' in name for name in names))
+
+    def test_cache(self):
+        """ Cache stores should write entries atomically, and prune should
+            remove the least recently used entries first.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = plugins.Cache(root=tmpdir)
+            store = cache.store('test')
+            self.assertIsNone(store.get('missing'))
+            self.assertEqual(store.put_json('a', {'a': 1}), {'a': 1})
+            self.assertEqual(store.get_json('a'), {'a': 1})
+            store.put('b', b'x' * 1024)
+            store.put('unsafe/key', 'c' * 1024)
+            self.assertIn('unsafe/key', store)
+            self.assertEqual(store.get('unsafe/key'), 'c' * 1024)
+            self.assertEqual(
+                os.path.dirname(store.path('unsafe/key')),
+                store.dirpath,
+            )
+            stats = cache.stats()
+            self.assertEqual(stats['namespaces']['test']['entries'], 3)
+
+            # 'b' is the least recently used entry.
+            now = time.time()
+            for key, age in (('a', 100), ('b', 300), ('unsafe/key', 200)):
+                os.utime(store.path(key), (now - age, now - age))
+            store.touch('a')
+            removed = cache.prune(max_size_mb=1.5 / 1024)
+            self.assertEqual([e.path for e in removed], [store.path('b')])
+            removed = cache.prune(max_age_days=150 / (24 * 60 * 60))
+            self.assertEqual(
+                [e.path for e in removed],
+                [store.path('unsafe/key')],
+            )
+
+            # Pinned namespaces are never pruned, and only cleared by name.
+            pinnedstore = cache.store('completion')
+            pinnedstore.put('data', 'x' * 1024)
+            self.assertEqual(cache.clear(), 1)
+            self.assertEqual(cache.prune(max_size_mb=0, max_age_days=0), [])
+            self.assertEqual(cache.clear(), 0)
+            self.assertIn('data', pinnedstore)
+            self.assertEqual(cache.stats()['entries'], 1)
+            self.assertEqual(cache.clear('completion'), 1)
+            self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_collapsed_stacks(self):
+        """ collapsed_stacks() should split time between callers, and only
+            keep plugin frames when asked to.
+        """
+        rootdir = os.path.join(os.sep, 'newroot')
+        plugindir = os.path.join(rootdir, 'plugins')
+        main = (os.path.join(rootdir, 'new.py'), 1, 'main')
+        create = (os.path.join(plugindir, 'python.py'), 10, 'create')
+        builtin = ('~', 0, '<built-in method len>')
+
+        class FakeStats(object):
+            # pstats data: {func: (cc, nc, tottime, cumtime, callers)}
+            stats = {
+                main: (1, 1, 0.001, 0.004, {}),
+                create: (1, 1, 0.002, 0.003, {main: (1, 1, 0.002, 0.003)}),
+                builtin: (1, 1, 0.001, 0.001, {
+                    create: (1, 1, 0.001, 0.001),
+                }),
+            }
+
+        mainname = 'main (new.py:1)'
+        createname = 'create ({}:10)'.format(
+            os.path.join('plugins', 'python.py')
+        )
+        builtinname = '<built-in method len>'
+        stacks = collapsed_stacks(FakeStats(), rootdir=rootdir)
+        self.assertEqual(stacks, {
+            (mainname,): 1000,
+            (mainname, createname): 2000,
+            (mainname, createname, builtinname): 1000,
+        })
+        self.assertEqual(
+            format_collapsed(stacks).splitlines(),
+            [
+                '{} 1000'.format(mainname),
+                '{};{} 2000'.format(mainname, createname),
+                '{};{};{} 1000'.format(mainname, createname, builtinname),
+            ],
+        )
+        pluginstacks = collapsed_stacks(
+            FakeStats(),
+            rootdir=rootdir,
+            keep=lambda path: is_plugin_file(path, plugindir),
+        )
+        self.assertEqual(pluginstacks, {
+            (createname,): 2000,
+            (createname, builtinname): 1000,
+        })
+
+        self.assertTrue(is_plugin_file(create[0], plugindir))
+        notplugins = (
+            main[0],
+            os.path.join(plugindir, '__init__.py'),
+            os.path.join(plugindir, '_args.py'),
+            os.path.join(rootdir, 'pluginsextra', 'python.py'),
+            '~',
+        )
+        for filename in notplugins:
+            self.assertFalse(
+                is_plugin_file(filename, plugindir),
+                msg='Not a plugin file: {}'.format(filename),
+            )
+
+    def test_completion_data(self):
+        """ Completion data should be usable from the shell without
+            running Python.
+        """
+        data = plugins.completion_data(plugins.plugins, 'Usage: new [-h]')
+        self.assertEqual(data['options'], ['-h'])
+        self.assertEqual(data['extensions']['.py'], 'python')
+        self.assertIn('--templates', data['plugin_options']['python'])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            datafile = os.path.join(tmpdir, 'completion.sh')
+            plugins.write_completion_data('bash', data, [tmpdir], datafile)
+            try:
+                output = subprocess.check_output(
+                    [
+                        'bash',
+                        '-c',
+                        ' '.join((
+                            'source "$1";',
+                            '_new_plugin_name py;',
+                            '_new_plugin_opts "$_new_reply";',
+                            'echo "$_new_reply"',
+                        )),
+                        'bash',
+                        datafile,
+                    ],
+                    universal_newlines=True,
+                )
+            except FileNotFoundError:
+                self.skipTest('bash is not available.')
+        self.assertIn('--templates', output.split())
+
+    def test_completion_regen(self):
+        """ The completion script should regenerate a missing data file
+            before using it.
+        """
+        data = plugins.completion_data(plugins.plugins, 'Usage: new [-h]')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            datafile = os.path.join(tmpdir, 'completion.sh')
+            newdata = plugins.write_completion_data(
+                'bash',
+                data,
+                [tmpdir],
+                os.path.join(tmpdir, 'new_data.sh'),
+            )
+            command = os.path.join(tmpdir, 'fakenew')
+            with open(command, 'w') as f:
+                f.write('#!/bin/sh\ncp "{}" "{}"\n'.format(newdata, datafile))
+            os.chmod(command, 0o755)
+            script = plugins.completion_script(
+                'bash',
+                datafile,
+                [command],
+                ['new'],
+            )
+            try:
+                output = subprocess.check_output(
+                    [
+                        'bash',
+                        '-c',
+                        '{}\n_new_load && echo "$_new_opts"'.format(script),
+                    ],
+                    universal_newlines=True,
+                )
+            except FileNotFoundError:
+                self.skipTest('bash is not available.')
+            self.assertTrue(os.path.exists(datafile))
+        self.assertEqual(output.split(), ['-h'])
+
+    def test_copy_file_atomic(self):
+        """ copy_file should never leave a partial file behind, or destroy
+            the file it is replacing, when a copy fails.
+        """
+        def copy_partial(src_fd, dst_fd, size):
+            os.write(dst_fd, b'partial')
+            raise OSError(errno.EIO, 'Copy failed.')
+
+        skeleton = plugins._skeleton
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src = os.path.join(tmpdir, 'src.txt')
+            with open(src, 'w') as f:
+                f.write('new content')
+            os.chmod(src, 0o750)
+            existing = os.path.join(tmpdir, 'existing.txt')
+            with open(existing, 'w') as f:
+                f.write('original')
+            dst = os.path.join(tmpdir, 'dst.txt')
+            with mock.patch.object(skeleton, 'clone_fd', return_value=False):
+                with mock.patch.object(skeleton, 'copy_fd', copy_partial):
+                    with self.assertRaises(OSError):
+                        skeleton.copy_file(src, existing, overwrite=True)
+                    with self.assertRaises(OSError):
+                        skeleton.copy_file(src, dst)
+            with open(existing, 'r') as f:
+                self.assertEqual(f.read(), 'original')
+            self.assertFalse(os.path.exists(dst))
+            self.assertEqual(
+                sorted(os.listdir(tmpdir)),
+                ['existing.txt', 'src.txt'],
+                msg='Temporary files were left behind.',
+            )
+            # A later run can still create and replace the files.
+            skeleton.copy_file(src, dst)
+            with self.assertRaises(FileExistsError):
+                skeleton.copy_file(src, dst)
+            skeleton.copy_file(src, existing, overwrite=True)
+            for filename in (dst, existing):
+                with open(filename, 'r') as f:
+                    self.assertEqual(f.read(), 'new content')
+                self.assertEqual(os.stat(filename).st_mode & 0o777, 0o750)
+
+    def test_copy_tree(self):
+        """ copy_tree should copy plain files, render templates, and skip
+            existing files.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            srcdir = os.path.join(tmpdir, 'skeleton')
+            os.makedirs(os.path.join(srcdir, 'src', 'empty'))
+            with open(os.path.join(srcdir, 'src', 'plain.txt'), 'w') as f:
+                f.write('{plain}')
+            with open(os.path.join(srcdir, 'README.template'), 'w') as f:
+                f.write('{name}')
+
+            def is_template(relpath):
+                if relpath.endswith('.template'):
+                    return relpath[:-9]
+                return None
+
+            destdir = os.path.join(tmpdir, 'project')
+            created, skipped = plugins.copy_tree(
+                srcdir,
+                destdir,
+                is_template=is_template,
+                render=lambda relpath, content: 'rendered',
+            )
+            self.assertEqual(len(created), 2)
+            self.assertEqual(skipped, [])
+            self.assertTrue(
+                os.path.isdir(os.path.join(destdir, 'src', 'empty'))
+            )
+            with open(os.path.join(destdir, 'src', 'plain.txt'), 'r') as f:
+                self.assertEqual(f.read(), '{plain}')
+            with open(os.path.join(destdir, 'README'), 'r') as f:
+                self.assertEqual(f.read(), 'rendered')
+            created, skipped = plugins.copy_tree(
+                srcdir,
+                destdir,
+                is_template=is_template,
+            )
+            self.assertEqual(created, [])
+            self.assertEqual(len(skipped), 2)
+
+    def test_custom_plugins_lazy(self):
+        """ Custom plugins should only be created when they are looked up.
+        """
+        customplugins = plugins.CustomPlugins({
+            'testcustom': {'aliases': ['TestAlias'], 'content': 'test'},
+            'testother': {'content': 'test'},
+        })
+        self.assertEqual(len(customplugins), 2)
+        self.assertFalse(customplugins.classes)
+        plugincls = customplugins.get_byname('testalias')
+        self.assertEqual(plugincls.get_name(), 'testcustom')
+        self.assertEqual(
+            list(customplugins.classes),
+            ['testcustom'],
+            msg='Unused custom plugins were created.'
+        )
+        self.assertIsNone(customplugins.get_byname('nonexistent'))
+
+    def test_determine_plugins_iterable(self):
+        """ determine_plugins() should accept a generator of file names. """
+        filenames = ('test{}.txt'.format(i) for i in range(3))
+        determined = plugins.determine_plugins(None, filenames)
+        self.assertEqual(
+            [f for filepaths in determined.values() for f in filepaths],
+            ['test0.txt', 'test1.txt', 'test2.txt'],
+            msg='File names were lost from a generator.'
+        )
+
+    def test_docopt_cached(self):
+        """ The cached docopt should parse plugin args like docopt does. """
+        for cls in self.iter_plugin_classes():
+            if not (getattr(cls, 'docopt', False) and cls.get_usage()):
+                continue
+            usage = cls.get_usage()
+            try:
+                expected = colr_docopt(usage, argv=[])
+            except SystemExit:
+                # Plugin requires arguments.
+                continue
+            self.assertEqual(
+                plugins.docopt(usage, argv=[]),
+                expected,
+                msg='Cached docopt differs for: {}'.format(cls.get_name())
+            )
+
+    def test_download_file(self):
+        """ download_file() should resume partial downloads with a Range
+            request, verify integrity strings, and only rename complete
+            downloads to the destination.
+        """
+        data = bytes(range(256)) * 64
+        integrity = 'sha256-{}'.format(
+            base64.b64encode(hashlib.sha256(data).digest()).decode()
+        )
+        ranges = []
+
+        class RangeHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                start = 0
+                rangehdr = self.headers.get('Range', None)
+                ranges.append(rangehdr)
+                if self.path == '/short.js':
+                    # Close the connection before the whole body is sent.
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data[:100])
+                    return None
+                if rangehdr:
+                    start = int(rangehdr.split('=')[1].rstrip('-'))
+                    self.send_response(206)
+                    self.send_header(
+                        'Content-Range',
+                        'bytes {}-{}/{}'.format(
+                            start,
+                            len(data) - 1,
+                            len(data),
+                        ),
+                    )
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(len(data) - start))
+                self.end_headers()
+                self.wfile.write(data[start:])
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), RangeHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:{}/file.js'.format(server.server_port)
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                dest = os.path.join(tmpdir, 'file.js')
+                with open('{}.part'.format(dest), 'wb') as f:
+                    f.write(data[:1000])
+                reports = []
+                plugins.download_file(
+                    url,
+                    dest,
+                    integrity=integrity,
+                    reporter=lambda done, total: reports.append(done),
+                )
+                self.assertEqual(ranges, ['bytes=1000-'])
+                with open(dest, 'rb') as f:
+                    self.assertEqual(f.read(), data)
+                self.assertEqual(reports[-1], len(data))
+                self.assertTrue(plugins.check_integrity(dest, integrity))
+
+                baddest = os.path.join(tmpdir, 'bad.js')
+                with self.assertRaises(plugins.IntegrityError):
+                    plugins.download_file(
+                        url,
+                        baddest,
+                        integrity='sha256-{}'.format(
+                            base64.b64encode(b'x' * 32).decode()
+                        ),
+                    )
+                self.assertEqual(os.listdir(tmpdir), ['file.js'])
+
+                shortdest = os.path.join(tmpdir, 'short.js')
+                with self.assertRaises(plugins.DownloadError):
+                    plugins.download_file(
+                        url.replace('file.js', 'short.js'),
+                        shortdest,
+                    )
+                self.assertFalse(os.path.exists(shortdest))
+                self.assertTrue(
+                    os.path.exists('{}.part'.format(shortdest)),
+                    msg='Partial download should be kept for resuming.',
+                )
+                with mock.patch.object(
+                        plugins._download,
+                        'read_response',
+                        side_effect=socket.timeout('timed out')):
+                    with self.assertRaises(plugins.DownloadError):
+                        plugins.download_file(url, shortdest)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_expand_braces(self):
+        """ Brace patterns in file names should expand like the shell
+            expands them, lazily.
+        """
+        patterns = {
+            'f{1..3}.txt': ['f1.txt', 'f2.txt', 'f3.txt'],
+            'f{3..1}': ['f3', 'f2', 'f1'],
+            'f{-1..1}': ['f-1', 'f0', 'f1'],
+            'f{08..10}': ['f08', 'f09', 'f10'],
+            'f{001..100..50}': ['f001', 'f051'],
+            'f{0..10..5}': ['f0', 'f5', 'f10'],
+            'f{10..0..5}': ['f10', 'f5', 'f0'],
+            '{a..c}.c': ['a.c', 'b.c', 'c.c'],
+            '{C..A}': ['C', 'B', 'A'],
+            '{a,b}/{main,util}.c': [
+                'a/main.c',
+                'a/util.c',
+                'b/main.c',
+                'b/util.c',
+            ],
+            'x{a,b{1..2}}': ['xa', 'xb1', 'xb2'],
+            'f{,.bak}': ['f', 'f.bak'],
+            # Literal or unbalanced braces are kept as they are.
+            'plain.txt': ['plain.txt'],
+            'f{}': ['f{}'],
+            'f{abc}': ['f{abc}'],
+            'f{1..a}': ['f{1..a}'],
+            'f{1..3': ['f{1..3'],
+            'f1..3}': ['f1..3}'],
+            '{f{1..2}': ['{f1', '{f2'],
+        }
+        for pattern, expected in patterns.items():
+            self.assertEqual(
+                list(new.expand_braces(pattern)),
+                expected,
+                msg='Bad expansion for: {}'.format(pattern),
+            )
+        self.assertEqual(
+            new.parse_braces('a{1..3}b'),
+            ['a', ('range', 1, 4, 1, 0, False), 'b'],
+        )
+        self.assertEqual(
+            list(new.iter_brace_parts(['x', ('choice', [['a'], ['b']])])),
+            ['xa', 'xb'],
+        )
+        self.assertEqual(
+            list(new.expand_filenames(['a{1..2}', 'b'])),
+            ['a1', 'a2', 'b'],
+        )
+        # Big ranges are not expanded all at once.
+        filenames = new.expand_braces('f{1..1000000000}')
+        self.assertEqual(next(filenames), 'f1')
+        self.assertEqual(next(filenames), 'f2')
+        # Empty file names are rejected.
+        with self.assertRaises(plugins.InvalidArg):
+            list(new.expand_braces('{,a}'))
+
+    def test_formatter_batched(self):
+        """ The format plugin should run one formatter process for many
+            files, using the formatters from config.
+        """
+        formattercls = self.plugins['post'].get('format', None)
+        if formattercls is None:
+            self.skipTest('format plugin is not loaded.')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logfile = os.path.join(tmpdir, 'calls.log')
+            script = os.path.join(tmpdir, 'fakefmt')
+            with open(script, 'w') as f:
+                f.write('\n'.join((
+                    '#!/bin/sh',
+                    'echo "$#" >> "{}"'.format(logfile),
+                    # Skip options, like -w, instead of writing them.
+                    'for f; do',
+                    '    case "$f" in -*) continue;; esac',
+                    '    echo formatted > "$f"',
+                    'done',
+                    '',
+                )))
+            os.chmod(script, 0o755)
+            filepaths = []
+            for i in range(20):
+                ext = ('.py', '.sh', '.txt')[i % 3]
+                filepath = os.path.join(tmpdir, 'f{}{}'.format(i, ext))
+                with open(filepath, 'w') as f:
+                    f.write('test')
+                filepaths.append(filepath)
+            formatter = formattercls()
+            formatter.config = {
+                'enabled': True,
+                'jobs': 2,
+                'formatters': {'.py': [script], '.sh': [script, '-w']},
+            }
+            formatted = formatter.format_files(filepaths)
+            self.assertEqual(formatted, 14)
+            with open(logfile, 'r') as f:
+                calls = f.read().split()
+            self.assertEqual(
+                sorted(calls),
+                ['7', '8'],
+                msg='Expected one formatter process for each extension.'
+            )
+            with open(filepaths[0], 'r') as f:
+                self.assertEqual(f.read().strip(), 'formatted')
+            with open(filepaths[2], 'r') as f:
+                self.assertEqual(f.read(), 'test')
+
+    def test_gitadd_batched(self):
+        """ The gitadd plugin should stage files with one git add per repo.
+        """
+        gitaddcls = self.plugins['deferred'].get('gitadd', None)
+        if gitaddcls is None:
+            self.skipTest('gitadd plugin is not loaded.')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            try:
+                subprocess.check_call(
+                    ['git', 'init', '-q', tmpdir],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            except (EnvironmentError, subprocess.CalledProcessError):
+                self.skipTest('git is not available.')
+            os.mkdir(os.path.join(tmpdir, 'sub'))
+            filepaths = [
+                os.path.join(tmpdir, 'sub' if i % 2 else '', 'f{}'.format(i))
+                for i in range(10)
+            ]
+            for filepath in filepaths:
+                with open(filepath, 'w') as f:
+                    f.write('test')
+            gitadd = gitaddcls()
+            gitadd.config = {'enabled': True}
+            self.assertEqual(len(gitadd.group_by_repo(filepaths)), 1)
+            self.assertEqual(gitadd.git_add(filepaths), len(filepaths))
+            staged = subprocess.check_output(
+                ['git', '-C', tmpdir, 'diff', '--cached', '--name-only'],
+            ).decode().split()
+            self.assertEqual(len(staged), len(filepaths))
+
+    def test_gitadd_run(self):
+        """ The gitadd plugin should stage the files from every plugin group
+            in a run with one git add per repo.
+        """
+        gitaddcls = self.plugins['deferred'].get('gitadd', None)
+        if gitaddcls is None:
+            self.skipTest('gitadd plugin is not loaded.')
+        gitaddmod = sys.modules[gitaddcls.__module__]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            repos = [os.path.join(tmpdir, name) for name in ('r1', 'r2')]
+            for repo in repos:
+                try:
+                    subprocess.check_call(
+                        ['git', 'init', '-q', repo],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                except (EnvironmentError, subprocess.CalledProcessError):
+                    self.skipTest('git is not available.')
+            createdinfo = {}
+            for ext in ('.py', '.sh'):
+                typeplugin = plugins.get_plugin_byext('test{}'.format(ext))
+                for repo in repos:
+                    filepath = os.path.join(repo, 'test{}'.format(ext))
+                    with open(filepath, 'w') as f:
+                        f.write('test')
+                    createdinfo.setdefault(typeplugin, []).append(filepath)
+            self.assertEqual(len(createdinfo), 2)
+
+            # Only run gitadd, with a fresh pooled instance.
+            saved = {
+                ptype: dict(plugins.plugins[ptype])
+                for ptype in ('post', 'deferred')
+            }
+            plugins.plugins['post'].clear()
+            plugins.plugins['deferred'].clear()
+            plugins.plugins['deferred']['gitadd'] = gitaddcls
+            plugins.pool.instances.pop(gitaddcls, None)
+            try:
+                gitadd = plugins.pool.get(gitaddcls)
+                gitadd.config = {'enabled': True}
+                with mock.patch.object(
+                        gitaddmod,
+                        'run_command',
+                        wraps=gitaddmod.run_command) as run_command:
+                    errs = new.handle_post_plugins(createdinfo)
+            finally:
+                plugins.pool.instances.pop(gitaddcls, None)
+                for ptype, ptypeplugins in saved.items():
+                    plugins.plugins[ptype].clear()
+                    plugins.plugins[ptype].update(ptypeplugins)
+            self.assertEqual(errs, 0)
+            self.assertEqual(
+                run_command.call_count,
+                len(repos),
+                msg='Expected one git add for each repo.',
+            )
+            self.assertEqual(gitadd.pending, [])
+            for repo in repos:
+                staged = subprocess.check_output(
+                    ['git', '-C', repo, 'diff', '--cached', '--name-only'],
+                ).decode().split()
+                self.assertEqual(sorted(staged), ['test.py', 'test.sh'])
+
     def test_get_plugin_byext(self):
         """ Plugins can be loaded by file extension. """
         ext = 'test.txt'
@@ -168,6 +856,126 @@ class NewTest(unittest.TestCase):
             msg='Failed to load plugin by explicit name: {!r}'.format(cls)
         )
 
+    def test_lazy_imports(self):
+        """ Importing plugins should not import the color/debug stack, or
+            the rarely used commands, until they are used.
+        """
+        code = '\n'.join((
+            'import sys',
+            'import plugins',
+            'lazy = ("colr", "fmtblock", "printdebug",',
+            '        "plugins._custom", "plugins._listing")',
+            'print(sorted(m for m in lazy if m in sys.modules))',
+            'print(callable(plugins.list_plugins))',
+            'try:',
+            '    plugins.docopt("Usage:\\n    prog [--x]\\n", ["--y"])',
+            'except SystemExit as ex:',
+            '    print(type(ex).__name__)',
+            'print(plugins.C.__name__)',
+        ))
+        proc = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=SCRIPTDIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        self.assertEqual(proc.returncode, 0, msg=proc.stderr)
+        self.assertEqual(
+            proc.stdout.splitlines(),
+            ['[]', 'True', '_ColorDocoptExit', 'Colr'],
+        )
+
+    def test_license_transform(self):
+        """ The license plugin should add a header after any preamble lines,
+            only when enabled, and only once.
+        """
+        licensecls = self.plugins['transform'].get('license', None)
+        if licensecls is None:
+            self.skipTest('license plugin is not loaded.')
+        plugin = self.default_plugin
+        transform = licensecls()
+        transform.config = {}
+        self.assertEqual(
+            transform.transform(plugin, 'test.py', 'a\n'),
+            'a\n',
+            msg='License headers should be disabled by default.',
+        )
+        transform.config = {
+            'enabled': True,
+            'header': ['License for {filename}', '', 'SPDX: MIT'],
+            'comments': {'.lisp': ';', '.py': None, '.txt': '--'},
+        }
+        header = '; License for test.lisp\n;\n; SPDX: MIT\n'
+        cases = (
+            ('', header),
+            ('(a)\n', header + '(a)\n'),
+            ('#!/bin/lisp\n(a)\n', '#!/bin/lisp\n' + header + '(a)\n'),
+            (
+                '#!/bin/lisp\n# -*- coding: utf-8 -*-\n(a)',
+                '#!/bin/lisp\n# -*- coding: utf-8 -*-\n' + header + '(a)',
+            ),
+            # A preamble with no newline at the end of the file.
+            ('#!/bin/lisp', '#!/bin/lisp\n' + header),
+            # The header is already there.
+            (header + '(a)\n', header + '(a)\n'),
+            ('#!/bin/lisp\n' + header, '#!/bin/lisp\n' + header),
+        )
+        for content, expected in cases:
+            self.assertEqual(
+                transform.transform(plugin, 'test.lisp', content),
+                expected,
+                msg='Wrong header for: {!r}'.format(content),
+            )
+        transform.config['header'] = 'Header'
+        self.assertEqual(
+            transform.transform(plugin, 'test.php', '<?php\necho 1;\n'),
+            '<?php\n// Header\necho 1;\n',
+        )
+        self.assertEqual(
+            transform.transform(plugin, 'test.txt', 'a\n'),
+            '-- Header\na\n',
+        )
+        # A null comment prefix skips an extension that is known by default.
+        self.assertTrue(transform.handles('test.sh'))
+        self.assertFalse(transform.handles('test.py'))
+        self.assertFalse(transform.handles('test.unknown'))
+
+    def test_mem_profiler(self):
+        """ MemProfiler should keep a summary for each phase, and report
+            all of them.
+        """
+        if not tracemalloc.is_tracing():
+            self.addCleanup(tracemalloc.stop)
+        profiler = MemProfiler(top=3)
+        self.assertTrue(tracemalloc.is_tracing())
+        kept = [str(i) * 100 for i in range(1000)]
+        first = profiler.snapshot('load')
+        kept.extend(str(i) * 100 for i in range(1000))
+        second = profiler.snapshot('create')
+        self.assertEqual(
+            [phase['phase'] for phase in profiler.phases],
+            ['load', 'create'],
+        )
+        self.assertIs(profiler.phases[-1], second)
+        for phase in (first, second):
+            self.assertGreater(phase['current'], 0)
+            self.assertGreaterEqual(phase['peak'], 0)
+            self.assertLessEqual(len(phase['top']), 3)
+            for site in phase['top']:
+                self.assertEqual(
+                    sorted(site),
+                    ['count_diff', 'site', 'size_diff'],
+                )
+        self.assertTrue(second['top'], msg='No allocation sites found.')
+        output = io.StringIO()
+        profiler.report(file=output)
+        report = output.getvalue()
+        self.assertIn('Memory profile (KiB):', report)
+        self.assertIn('load:', report)
+        self.assertIn('create:', report)
+        del kept
+
     def test_plugin_create(self):
         """ Filetype plugins should create. (unless allow_blank is set) """
         for cls in self.types:
@@ -205,6 +1013,23 @@ class NewTest(unittest.TestCase):
                         )
                     )
 
+    def test_output_style(self):
+        """ OutputStyle should fix indents, line endings, and newlines. """
+        style = plugins.OutputStyle(
+            indent='tabs',
+            width=4,
+            line_endings='crlf',
+            final_newline=True,
+        )
+        self.assertEqual(
+            style.apply('a\n    b\r\n      c\n\n\n'),
+            'a\r\n\tb\r\n\t  c\r\n',
+        )
+        self.assertEqual(
+            plugins.OutputStyle(indent='spaces', width=2).apply('\tx\n'),
+            '  x\n',
+        )
+
     def test_plugin_init(self):
         """ Plugins should initialize """
 
@@ -216,6 +1041,386 @@ class NewTest(unittest.TestCase):
                     pname=cls.get_name())
             )
 
+    def test_plugin_pool(self):
+        """ Post plugins should be created once per run, and reset for each
+            file.
+        """
+        class CountingPost(plugins.PostPlugin):
+            name = 'counting'
+            inits = 0
+
+            def __init__(self):
+                type(self).inits += 1
+                self.resets = 0
+                self.processed = []
+
+            def process(self, plugin, filepath):
+                self.processed.append(filepath)
+
+            def reset(self):
+                self.resets += 1
+
+        typeplugin = plugins.pool.get(plugins.plugins['types']['text'])
+        self.assertIs(
+            plugins.pool.get(plugins.plugins['types']['text']),
+            typeplugin,
+        )
+        for _ in range(3):
+            plugins.try_post_plugin(CountingPost, typeplugin, ['a', 'b'])
+        plugin = plugins.pool.get(CountingPost)
+        self.assertEqual(CountingPost.inits, 1)
+        self.assertEqual(plugin.resets, 6)
+        self.assertEqual(plugin.processed, ['a', 'b'] * 3)
+
+    def test_plugin_timed(self):
+        """ PluginBase.timed() should record timings under the plugin name.
+        """
+        plugin = plugins.get_plugin_byname('text')()
+        label = '{}.test'.format(plugin.get_name())
+        with plugin.timed('test'):
+            pass
+        self.assertIn(
+            label,
+            plugins.timings.entries,
+            msg='Plugin timing was not recorded: {!r}'.format(label)
+        )
+        calls = plugins.timings.entries[label][0]
+        with plugin.timed('test'):
+            pass
+        self.assertEqual(
+            plugins.timings.entries[label][0],
+            calls + 1,
+            msg='Plugin timing calls were not counted.'
+        )
+
+    def test_post_plugin_timeout(self):
+        """ Post plugins that run past their timeout should be cancelled,
+            and count as errors (or fatal errors, by config).
+        """
+        if not plugins.can_interrupt():
+            self.skipTest('Timeouts are not supported here.')
+
+        class SlowPost(plugins.PostPlugin):
+            name = 'slow'
+            config = {'timeout': 0.05}
+
+            def process(self, plugin, filepath):
+                try:
+                    time.sleep(5)
+                except Exception:
+                    # Timeouts are not swallowed by plugins.
+                    pass
+
+        typeplugin = plugins.pool.get(plugins.plugins['types']['text'])
+        started = time.perf_counter()
+        self.assertEqual(
+            plugins.try_post_plugin(SlowPost, typeplugin, ['a']),
+            plugins.PluginReturn.error,
+        )
+        self.assertLess(time.perf_counter() - started, 2)
+        plugins.pool.get(SlowPost).config = {
+            'timeout': 0.05,
+            'timeout_fatal': True,
+        }
+        self.assertEqual(
+            plugins.try_post_plugin(SlowPost, typeplugin, ['a']),
+            plugins.PluginReturn.fatal,
+        )
+
+        budget = plugins.TimeBudget()
+        self.assertIsNone(budget.limit(None))
+        self.assertEqual(budget.limit(None, timeout=5), 5)
+        budget.add(8)
+        self.assertEqual(budget.limit(10, timeout=5), 2)
+        budget.add(3)
+        self.assertEqual(budget.limit(10, timeout=5), 0)
+
+    def test_reporter(self):
+        """ Reporter should write one JSON record per line in json mode,
+            count files and errors in progress mode, and only print status
+            lines for terminals in text mode.
+        """
+        reporter = plugins.Reporter()
+        out = io.StringIO()
+        with redirect_stdout(out):
+            reporter.status('test', 'not a terminal')
+        self.assertEqual(out.getvalue(), '')
+
+        reporter.set_mode('json')
+        out = io.StringIO()
+        with redirect_stdout(out):
+            reporter.status('test', 'no status lines for json')
+            reporter.record('created', plugin='text', file='a.txt', bytes=3)
+            reporter.record('post', post='chmodx', result='success')
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            [r['event'] for r in records],
+            ['created', 'post'],
+        )
+        self.assertEqual(records[0]['file'], 'a.txt')
+
+        reporter.set_mode('progress')
+        err = io.StringIO()
+        with redirect_stderr(err):
+            reporter.record('created', file='a.txt', bytes=2048)
+            reporter.record('created', file='b', files=2)
+            reporter.record('post', post='chmodx', result='error')
+            reporter.record('post', post='chmodx', result='fatal')
+            reporter.record('post', post='chmodx', result='success')
+            reporter.finish()
+        self.assertEqual((reporter.files, reporter.errors), (3, 2))
+        self.assertIn('3 files', err.getvalue())
+        self.assertIn('2.0 KiB', err.getvalue())
+        with self.assertRaises(ValueError):
+            reporter.set_mode('xml')
+
+        # Post plugins that can't be created are reported too.
+        class BrokenPost(plugins.PostPlugin):
+            name = 'broken'
+
+            def __init__(self):
+                raise ValueError('broken post plugin')
+
+        typeplugin = plugins.pool.get(plugins.plugins['types']['text'])
+        self.addCleanup(plugins.reporter.set_mode, plugins.reporter.mode)
+        plugins.reporter.set_mode('json')
+        out = io.StringIO()
+        with redirect_stdout(out), redirect_stderr(io.StringIO()):
+            self.assertEqual(
+                plugins.try_post_plugin(BrokenPost, typeplugin, ['a']),
+                plugins.PluginReturn.fatal,
+            )
+        record = json.loads(out.getvalue())
+        self.assertEqual(
+            (record['post'], record['plugin'], record['result']),
+            ('broken', 'text', 'fatal'),
+        )
+        self.assertEqual(record['error'], 'broken post plugin')
+
+    def test_tag_providers(self):
+        """ Tag providers should only be called when used, and only once.
+        """
+        calls = []
+
+        @plugins.tag_providers.register('test_tag')
+        def provide_test_tag(tags):
+            calls.append(1)
+            return 'test'
+
+        self.addCleanup(plugins.tag_providers.unregister, 'test_tag')
+        self.assertIn('test_tag', plugins.tag_providers)
+        self.assertEqual(calls, [], msg='Provider was called early.')
+        for _ in range(2):
+            self.assertEqual(plugins.tag_providers['test_tag'], 'test')
+        self.assertEqual(calls, [1], msg='Provider value was not kept.')
+        self.assertIs(
+            plugins.tag_providers.unregister('test_tag'),
+            provide_test_tag,
+        )
+        self.assertNotIn('test_tag', plugins.tag_providers)
+        self.assertIsNone(plugins.tag_providers.unregister('test_tag'))
+
+    def test_template_formatter(self):
+        """ TemplateFormatter should substitute known tags, and leave
+            unknown tags and stray braces alone.
+        """
+        template = 'int main() {\n    return {value}; // {{x}} {other}\n}'
+        content, unknown = plugins.TemplateFormatter().render(
+            template,
+            {'value': 0},
+        )
+        self.assertEqual(
+            content,
+            'int main() {\n    return 0; // {x} {other}\n}'
+        )
+        self.assertEqual(unknown, [('other', 2, 30)])
+
+    def test_tracer_spans(self):
+        """ Tracer spans should nest, keep their attributes, and be written
+            as Chrome trace events (JSON lines) to the --trace file, or the
+            NEW_TRACE file.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'trace.jsonl')
+            tracer = plugins.Tracer()
+            self.assertFalse(tracer.enabled)
+            self.assertIs(tracer.span('disabled'), tracer.current())
+            with mock.patch.dict(os.environ, {'NEW_TRACE': filename}):
+                tracer.enable_from_env()
+            self.assertTrue(tracer.enabled)
+
+            @tracer.traced(outcome=lambda r: 'created' if r else 'none')
+            def inner():
+                tracer.set(files=2)
+                return True
+
+            with tracer.span('outer', plugin='test') as outer:
+                inner()
+                outer.set(done=True)
+            tracer.close()
+            self.assertFalse(tracer.enabled)
+            with open(filename, 'r') as f:
+                events = [json.loads(line) for line in f]
+            chromefile = os.path.join(tmpdir, 'trace.json')
+            count = plugins._trace.convert_to_chrome([filename], chromefile)
+            with open(chromefile, 'r') as f:
+                chromedata = json.load(f)
+
+        # Spans are written when they end, inner spans first.
+        self.assertEqual([e['name'] for e in events], ['inner', 'outer'])
+        inner, outer = events
+        for event in events:
+            self.assertEqual(event['ph'], 'X')
+            self.assertEqual(event['pid'], os.getpid())
+            self.assertIsInstance(event['ts'], int)
+            self.assertGreaterEqual(event['dur'], 0)
+        self.assertIsNone(outer['args']['parent_id'])
+        self.assertEqual(
+            inner['args']['parent_id'],
+            outer['args']['span_id'],
+        )
+        self.assertEqual(inner['args']['files'], 2)
+        self.assertEqual(inner['args']['outcome'], 'created')
+        self.assertEqual(outer['args']['plugin'], 'test')
+        self.assertTrue(outer['args']['done'])
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            sorted(e['name'] for e in chromedata['traceEvents']),
+            ['inner', 'outer'],
+        )
+
+    def test_transform_plugins(self):
+        """ Transform plugins should run in order, each one receiving the
+            content from the last, and skip ignored or failing transforms.
+        """
+        class UpperTransform(plugins.TransformPlugin):
+            name = 'upper'
+            order = 20
+
+            def transform(self, plugin, filename, content):
+                return content.upper()
+
+        class SuffixTransform(plugins.TransformPlugin):
+            name = 'suffix'
+            extensions = ('.txt',)
+            order = 10
+
+            def transform(self, plugin, filename, content):
+                return '{}-suffix'.format(content)
+
+        class BrokenTransform(plugins.TransformPlugin):
+            name = 'broken'
+
+            def transform(self, plugin, filename, content):
+                raise ValueError('broken transform')
+
+        transforms = plugins.plugins['transform']
+        saved = dict(transforms)
+        transforms.clear()
+        transforms.update({
+            cls.name: cls
+            for cls in (UpperTransform, SuffixTransform, BrokenTransform)
+        })
+        try:
+            plugin = plugins.pool.get(plugins.plugins['types']['text'])
+            self.assertEqual(
+                plugins.do_transform_plugins(plugin, 'test.txt', 'a'),
+                'A-SUFFIX',
+            )
+            self.assertEqual(
+                plugins.do_transform_plugins(plugin, 'test.py', 'a'),
+                'A',
+            )
+            plugin.ignore_transform = {'upper'}
+            self.assertEqual(
+                plugins.do_transform_plugins(plugin, 'test.txt', 'a'),
+                'a-suffix',
+            )
+        finally:
+            del plugin.ignore_transform
+            transforms.clear()
+            transforms.update(saved)
+
+    def test_validate_files(self):
+        """ validate_files() should report bad content for each file. """
+        files = [
+            ('good.py', 'x = 1\n'),
+            ('bad.py', 'def f(:\n    pass\n'),
+            ('good.json', '{"a": 1}'),
+            ('bad.json', '{"a": 1,}'),
+            ('unknown.txt', '{{{'),
+        ]
+        errors = plugins.validate_files(files)
+        self.assertEqual(sorted(errors), ['bad.json', 'bad.py'])
+        self.assertTrue(errors['bad.py'][0].startswith('line 1:'))
+
+        missing = []
+        errors = plugins.validate_files(
+            [
+                ('good.sh', 'if true; then\n    echo ok\nfi\n'),
+                ('bad.sh', 'if true; then\n    echo bad\n'),
+                ('other.sh', 'echo ok\n'),
+            ],
+            on_missing=lambda name, ex: missing.append(name),
+        )
+        if missing:
+            self.skipTest('bash is not available.')
+        self.assertEqual(list(errors), ['bad.sh'])
+
+    def test_validate_output(self):
+        """ Content should be validated after it is formatted for output,
+            and written exactly as it was validated.
+        """
+        plugincls = plugins.get_plugin_byext('test.sh')
+        if plugincls is None:
+            self.skipTest('No plugin for .sh files.')
+        plugin = plugincls()
+        content = 'if true; then\n    echo ok\nfi\n'
+        argd = dict(self.default_args, **{'--noopen': True})
+        plugin.output_options = {'line_endings': 'crlf'}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch.object(plugin, '_create', return_value=content):
+                prepared = new.prepare_plugin_file(
+                    plugin,
+                    os.path.join(tmpdir, 'test.sh'),
+                    argd,
+                )
+            fname, formatted, _ = prepared
+            self.assertIn('then\r\n', formatted)
+            errors = plugins.validate_files(
+                [(fname, formatted)],
+                on_missing=lambda name, ex: self.skipTest(
+                    'bash is not available.'
+                ),
+            )
+            self.assertEqual(list(errors), [fname])
+            self.assertEqual(
+                new.write_plugin_file(plugin, prepared, argd),
+                fname,
+            )
+            with open(fname, 'r', newline='') as f:
+                self.assertEqual(f.read(), formatted)
+
+    def test_write_file_atomic(self):
+        """ write_file_atomic should never clobber an existing file, unless
+            overwrite is used.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'test.txt')
+            plugins.write_file_atomic(filename, 'first')
+            with self.assertRaises(FileExistsError):
+                plugins.write_file_atomic(filename, 'second')
+            with open(filename, 'r') as f:
+                self.assertEqual(f.read(), 'first')
+            plugins.write_file_atomic(filename, 'second', overwrite=True)
+            with open(filename, 'r') as f:
+                self.assertEqual(f.read(), 'second')
+            self.assertEqual(
+                os.listdir(tmpdir),
+                ['test.txt'],
+                msg='Temporary files were left behind.'
+            )
+
     def test_plugins_loaded(self):
         """ load_plugins should set plugins.plugins to non-empty values. """
         for key in ('types', 'post', 'deferred'):